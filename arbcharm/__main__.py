@@ -10,21 +10,54 @@ main_loop = asyncio.get_event_loop()
 
 
 def main():
-    start_arbtrage_task()
+    from arbcharm import settings
+    if settings.WORKER_NUM > 0:
+        from arbcharm.supervisor import Supervisor
+        Supervisor(settings.ARB_CONF, settings.WORKER_NUM).run()
+    else:
+        start_arbtrage_task()
 
 
 def start_arbtrage_task():
     from arbcharm import settings
     from arbcharm.charm import ArbCharm
+    from arbcharm.metrics import registry
     from arbcharm.models import get_exchange
+    from arbcharm.tools import SharedRateBudget
+
+    recorder = None
+    if settings.RECORD_PATH:
+        from arbcharm.replay import FeedRecorder
+        recorder = FeedRecorder(settings.RECORD_PATH)
 
-    tasks = []
+    rate_budget = SharedRateBudget(settings.ORDER_RATE_LIMIT)
+    charms = []
+    exchanges = []
     for sym, exc_dict in settings.ARB_CONF.items():
         excs = [get_exchange(e, config) for e, config in exc_dict.items()]
-        tasks.append(ArbCharm(sym, excs).start())
-
-    cortasks = asyncio.gather(*tasks)
-    main_loop.run_until_complete(cortasks)
+        for e in excs:
+            e.recorder = recorder
+            if e not in exchanges:
+                exchanges.append(e)
+        charms.append(ArbCharm(sym, excs, rate_budget))
+    if settings.GRAPH_ENABLED:
+        from arbcharm.graph import RateGraph
+        # reports only, the books come from the charms of the symbols
+        charms.append(RateGraph(exchanges))
+
+    if settings.METRICS_PORT:
+        main_loop.run_until_complete(registry.serve())
+    if settings.METRICS_SNAPSHOT_PATH:
+        asyncio.ensure_future(registry.dump_periodically(settings.METRICS_SNAPSHOT_PATH))
+
+    cortasks = asyncio.gather(*[c.start() for c in charms])
+    try:
+        main_loop.run_until_complete(cortasks)
+    except KeyboardInterrupt:
+        # let the charms drain their orders and close the http sessions
+        for c in charms:
+            c.close()
+        main_loop.run_until_complete(cortasks)
 
 
 main()
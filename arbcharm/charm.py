@@ -3,239 +3,254 @@ __author__ = 'Rick Zhang'
 __time__ = '2018/10/12'
 
 import asyncio
+import logging
 import time
-from typing import List
+from typing import Dict, List
 
 from arbcharm import settings
-from arbcharm.models import BaseExchange, Order, OrderBook, Trade, get_exchange
-from arbcharm.tools import get_logger, rate_limit_generator
-from ccxt.base import errors as ccxt_errors
+from arbcharm.evaluator import Opportunity, size_opportunity
+from arbcharm.execution import ExecutionEngine
+from arbcharm.matcher import auto_match, crossing_books
+from arbcharm.metrics import registry
+from arbcharm.models import BaseExchange, Order, Trade, get_book_notifier, get_exchange
+from arbcharm.store import get_store
+from arbcharm.tools import SharedRateBudget, get_logger, monotonic, rate_limit_generator
 
 
 class ArbCharm:
-    def __init__(self, symbol, exchanges: List[BaseExchange]):
+    def __init__(self, symbol, exchanges: List[BaseExchange], rate_budget: SharedRateBudget = None):
         self.symbol = symbol
         self.exchanges = exchanges
+        self.rate_budget = rate_budget
         self.name = 'ArbCharm-{}'.format(self.symbol)
         self.trade_limit = rate_limit_generator()
         self.trade_limit.send(None)
         self.logger = get_logger(self.name)
         self.is_running = False
+        self.notifier = get_book_notifier(self.symbol)
+        self.engine = ExecutionEngine(self.symbol, rate_budget)
+        self.store = get_store()
+        self.stat_limit = rate_limit_generator()
+        self.stat_limit.send(None)
+        self.match_hist = registry.histogram('match_seconds', symbol=symbol)
+        self.find_hist = registry.histogram('find_opportunity_seconds', symbol=symbol)
+        self.decision_hist = registry.histogram('tick_to_decision_seconds', symbol=symbol)
+        self.opportunity_counter = registry.counter('opportunities_total', symbol=symbol)
+        self.evaluation_counter = registry.counter('evaluations_total', symbol=symbol)
+        self.unchanged_counter = registry.counter(
+            'evaluation_skips_total', symbol=symbol, reason='unchanged')
+        self.no_cross_counter = registry.counter(
+            'evaluation_skips_total', symbol=symbol, reason='no_cross')
+        self.left_out_counter = registry.counter('matcher_books_left_out_total', symbol=symbol)
+        self.below_minimum_counter = registry.counter(
+            'opportunity_drops_total', symbol=symbol, reason='below_minimum')
+        self._last_versions = None  # ((book, version), ...) of the last evaluation
+        # how stale the books an opportunity is found on are
+        self.book_age_hist_d = {}  # exchange name: histogram, exchanges may join later on replay
 
     async def start(self):
         self.is_running = True
         self.logger.info(event='arbcharm_start')
 
+        await asyncio.gather(*[e.load_markets() for e in self.exchanges])
         for e in self.exchanges:
+            e.start_http(self)
             asyncio.ensure_future(e.set_orderbook_d(self.symbol))
 
-        alerter_exc = get_exchange('binance', {})
-        while self.is_running:
-            await alerter_exc.wait_book_update(self.symbol)
-            await self.arbitrage()
-            alerter_exc.reset_book_update(self.symbol)
-
-        # TODO cancel all orders
-        self.logger.info(event='arbcharm_exit')
+        try:
+            while self.is_running:
+                tick_time = await self.notifier.wait()
+                if not self.is_running:
+                    break
+                await self.arbitrage(tick_time)
+            await self.engine.drain()
+        finally:
+            for e in self.exchanges:
+                await e.stop_http(self)
+            if self.store is not None:
+                self.store.flush(wait=True)
+            self.logger.info(event='arbcharm_exit')
 
     def close(self):
         self.is_running = False
+        self.notifier.notify()  # wake start up to exit
+
+    async def arbitrage(self, tick_time=None):
+        """
+        :param tick_time: tools.monotonic time of the book update which triggers this evaluation
+        """
+        opportunity = self.evaluate(tick_time)
+        if opportunity:
+            self.catch_opportunity(opportunity)
 
-    async def arbitrage(self):
-        now = time.time()
+    def evaluate(self, tick_time=None) -> List[Order]:
+        """
+        find opportunity from the freshest books of all exchanges, no order is placed here
+        """
         ob_l = self.get_valide_ob_l()
         if len(ob_l) < 2:
-            return
-
-        self.logger.debug(
-            event='arbitrage',
-            market_price={ob.exchange.name: (ob.asks[0].price+ob.bids[0].price)/2 for ob in ob_l},
-            time_delay={ob.exchange.name: now-ob.timestamp for ob in ob_l},
-        )
-        trades = auto_match(ob_l)
-        opportunity = self.find_opportunity_from_trade(trades)
-
-        if opportunity:
+            return []
+        self.evaluation_counter.inc()
+
+        # nothing published since the last evaluation, e.g. a wakeup which lost the race
+        versions = tuple((ob, ob.version) for ob in ob_l)
+        if versions == self._last_versions:
+            self.unchanged_counter.inc()
+            return []
+        self._last_versions = versions
+
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(
+                event='arbitrage',
+                market_price={
+                    ob.exchange.name: (ob.asks[0].price+ob.bids[0].price)/2 for ob in ob_l
+                },
+                book_age={ob.exchange.name: ob.exchange.book_age(ob) for ob in ob_l},
+            )
+        fee_d = {ob.exchange: ob.exchange.market(self.symbol).taker_fee for ob in ob_l}
+        cross_l = crossing_books(ob_l, fee_d, settings.ARBITRAGE_OPPORTUNITY_RATE)
+        if not cross_l:
+            # the usual case: a delta far from the spread or tops which do not cross
+            self.no_cross_counter.inc()
+            if tick_time is not None:
+                self.record_decision_latency(monotonic()-tick_time)
+            return []
+        self.left_out_counter.inc(len(ob_l)-len(cross_l))
+        ob_l = cross_l
+
+        t1 = time.perf_counter()
+        trades = auto_match(ob_l, fee_d)
+        t2 = time.perf_counter()
+        opportunity = self.find_opportunity_from_trade(trades, fee_d)
+        self.match_hist.record(t2-t1)
+        self.find_hist.record(time.perf_counter()-t2)
+        if tick_time is not None:
+            self.record_decision_latency(monotonic()-tick_time)
+
+        if not opportunity:
+            return []
+        self.opportunity_counter.inc()
+        book_age = {}
+        for ob in ob_l:
+            book_age[ob.exchange.name] = age = ob.exchange.book_age(ob)
+            hist = self.book_age_hist_d.get(ob.exchange.name)
+            if hist is None:
+                hist = self.book_age_hist_d[ob.exchange.name] = registry.histogram(
+                    'opportunity_book_age_seconds', symbol=self.symbol, exchange=ob.exchange.name,
+                )
+            hist.record(age)
+        self.logger.info(event='found_opportunity', book_age=book_age, **opportunity.to_dict())
+        if self.store is not None:
+            self.store.append_opportunity(opportunity)
+        return opportunity.to_orders()
+
+    def record_decision_latency(self, latency):
+        """
+        tick-to-decision: from a book update to the end of its evaluation
+        """
+        self.decision_hist.record(latency)
+        if registry.enabled and self.stat_limit.send(('decision_latency', 60)):
             self.logger.info(
-                event='found_opportunity',
-                opportunity=[o.to_dict() for o in opportunity],
+                event='decision_latency',
+                book_updates=self.notifier.update_count,
+                coalesced_updates=self.notifier.coalesced_count,
+                **self.decision_hist.snapshot()
             )
-            await self.catch_opportunity(opportunity)
-            await asyncio.sleep(3)
+
+    def health(self) -> dict:
+        book_age = {}
+        for e in self.exchanges:
+            book = e.get_book(self.symbol)
+            book_age[e.name] = e.book_age(book) if book else None
+        return {
+            'symbol': self.symbol,
+            'is_running': self.is_running,
+            'book_age': book_age,
+            'clock': {e.name: e.clock.to_dict() for e in self.exchanges},
+            'book_updates': self.notifier.update_count,
+            'coalesced_updates': self.notifier.coalesced_count,
+            'execution': self.engine.health(),
+        }
 
     def get_valide_ob_l(self):
-        now = time.time()
         ob_l = []
         for e in self.exchanges:
             book = e.get_book(self.symbol)
-            if book and now - book.timestamp < 1:
+            if book and e.book_age(book) < e.book_max_age:
                 ob_l.append(book)
         return ob_l
 
-    def find_opportunity_from_trade(self, trades: List[Trade]) -> List[Order]:
-        rate = settings.ARBITRAGE_OPPORTUNITY_RATE
-        orders = {}
-
-        for t in trades:
-            if (t.bid_price-t.ask_price)/t.ask_price > rate:
-                od = orders.get(
-                    t.ask_exc,
-                    Order(
-                        exc=t.ask_exc,
-                        symbol=self.symbol,
-                        price=t.ask_price,
-                        amount=0,
-                        side=Order.SIDE_BUY,
-                    )
-                )
-                assert od.side == Order.SIDE_BUY
-                od.amount += t.amount
-                od.price = max(od.price, t.ask_price)
-                orders[od.exc] = od
-
-                od = orders.get(
-                    t.bid_exc,
-                    Order(
-                        exc=t.bid_exc,
-                        symbol=self.symbol,
-                        price=t.bid_price,
-                        amount=0,
-                        side=Order.SIDE_SELL,
-                    )
-                )
-                assert od.side == Order.SIDE_SELL
-                od.amount += t.amount
-                od.price = min(od.price, t.bid_price)
-                orders[od.exc] = od
-
-        return list(orders.values())
-
-    async def catch_opportunity(self, opportunity: List[Order]):
-        order_task = []
-        for o in opportunity:
-            fixd_am = self.fix_amount(o.amount)
-            if o.side == Order.SIDE_BUY:
-                order_task.append(
-                    self.deal_buy(o.exc, fixd_am, o.price)
-                )
-            if o.side == Order.SIDE_SELL:
-                order_task.append(
-                    self.deal_sell(o.exc, fixd_am, o.price)
-                )
-
-        await asyncio.wait(order_task)
-
-    def fix_amount(self, amount):
-        amount_mul = settings.ARBCHARM_AMOUNT_MULTIPLIER
-        config_min_amount = max([e.ccxt_exchange.min_amount for e in self.exchanges])
-        return max(amount*amount_mul, config_min_amount)
+    def find_opportunity_from_trade(
+            self, trades: List[Trade], fee_d: Dict[BaseExchange, float]
+    ) -> Opportunity:
+        capacity_d = {}
+        for e in self.exchanges:
+            capacity = e.available(self.symbol)
+            if capacity is not None:
+                capacity_d[e] = capacity
+        return size_opportunity(
+            self.symbol,
+            trades,
+            fee_d,
+            settings.ARBITRAGE_OPPORTUNITY_RATE,
+            settings.ARBCHARM_AMOUNT_MULTIPLIER,
+            capacity_d,
+        )
 
-    async def deal_buy(self, exchange: BaseExchange, amount, price):
-        if settings.MODE != 'prd':
-            return
-        try:
-            res = await exchange.ccxt_exchange.create_limit_buy_order(
-                self.symbol,
-                amount,
-                price,
-            )
-        except ccxt_errors.BaseError:
-            self.logger.exception()
-            return
-
-        oid = res['id']
-        await asyncio.sleep(3)
-        await self.deal_cancel(exchange, oid)
-        await self.save_order_and_trade(exchange, oid)
-
-    async def deal_sell(self, exchange: BaseExchange, amount, price):
-        if settings.MODE != 'prd':
-            return
-        try:
-            res = await exchange.ccxt_exchange.create_limit_sell_order(
-                self.symbol,
-                amount,
-                price,
-            )
-        except ccxt_errors.BaseError:
-            self.logger.exception()
-            return
-
-        oid = res['id']
-        await asyncio.sleep(10)
-        await self.deal_cancel(exchange, oid)
-        await self.save_order_and_trade(exchange, oid)
-
-    async def deal_cancel(self, exchange: BaseExchange, oid):
-        cancel_success = False
-        while not cancel_success:
-            try:
-                await exchange.ccxt_exchange.cancel_order(oid, symbol=self.symbol)
-                cancel_success = True
-                self.logger.info(event='cancel_order_success', oid=oid, exchange=exchange.name)
-            except ccxt_errors.OrderNotFound:
-                cancel_success = True
-            except ccxt_errors.BaseError as e:
-                self.logger.exception(error_class=e.__class__.__name__)
-                await asyncio.sleep(3)
-        return oid
-
-    async def save_order_and_trade(self, exchange: BaseExchange, oid):
-        pass
+    def catch_opportunity(self, opportunity: List[Order]) -> bool:
+        sized = [{'exchange': o.exc.name, 'side': o.side, 'amount': o.amount} for o in opportunity]
+        orders = self.fix_amounts(opportunity)
+        if not orders:
+            self.below_minimum_counter.inc()
+            self.logger.info(event='opportunity_below_minimum', symbol=self.symbol, legs=sized)
+            return False
+        for o in orders:
+            o.price = o.exc.market(self.symbol).fix_price(o.price, o.side)
+        return self.engine.submit(orders)
+
+    def fix_amounts(self, orders: List[Order]) -> List[Order]:
+        """
+        round the legs to the lot steps without unbalancing them: every leg is floored to the
+        coarsest step of all legs, then the side with more is cut back to the other,
+        largest legs first.
+        legs are never raised to a minimum, that would break the sizing and the balance caps.
+        :return: the orders left, empty if one of them is below the minimum of its exchange
+        """
+        meta_d = {o.exc: o.exc.market(self.symbol) for o in orders}
+        stepped = [m for m in meta_d.values() if m.amount_step is not None]
+        # steps are powers of ten, the coarsest is a multiple of all the others
+        coarsest = max(stepped, key=lambda m: m.amount_step) if stepped else None
+        if coarsest is not None:
+            for o in orders:
+                o.amount = coarsest.floor_amount(o.amount)
+
+        buy_l = [o for o in orders if o.side == Order.SIDE_BUY]
+        sell_l = [o for o in orders if o.side == Order.SIDE_SELL]
+        excess = sum(o.amount for o in buy_l) - sum(o.amount for o in sell_l)
+        heavy_l = buy_l if excess > 0 else sell_l
+        excess = abs(excess)
+        for o in sorted(heavy_l, key=lambda o: o.amount, reverse=True):
+            if excess <= 1e-12:
+                break
+            cut = min(o.amount, excess)
+            o.amount -= cut
+            excess -= cut
+            if coarsest is not None:
+                o.amount = coarsest.floor_amount(o.amount)
+
+        orders = [o for o in orders if o.amount > 1e-12]
+        sides = {o.side for o in orders}
+        if Order.SIDE_BUY not in sides or Order.SIDE_SELL not in sides:
+            return []
+        for o in orders:
+            if o.amount < meta_d[o.exc].min_order_amount(o.price) - 1e-12:
+                return []
+        return orders
 
     def __str__(self):
         return self.name
 
 
-def auto_match(ob_l: List[OrderBook]) -> List[Trade]:
-    """
-    orderbook成交函数
-    :param ob_l: 多个交易所和当前的orderbook
-    :return: 成交列表
-    """
-    bid_row_l = []
-    for ob in ob_l[::-1]:  # 相同条件下, 放在前面的交易所得到优先成交
-        bid_row_l.extend([[ob.exchange, ow] for ow in ob.bids])
-    bid_row_l = sorted(bid_row_l, key=lambda i: i[1].price)  # best order row at last index
-
-    ask_row_l = []
-    for ob in ob_l[::-1]:
-        ask_row_l.extend([[ob.exchange, ow] for ow in ob.asks])
-    ask_row_l = sorted(ask_row_l, key=lambda i: i[1].price, reverse=True)
-
-    trade_l = []
-    bid_retain_row = None
-    ask_retain_row = None
-    while bid_row_l and ask_row_l:
-        bid_exc, bid_ow = bid_retain_row if bid_retain_row else bid_row_l.pop()
-        ask_exc, ask_ow = ask_retain_row if ask_retain_row else ask_row_l.pop()
-        if bid_ow.price < ask_ow.price:
-            break
-
-        if bid_ow.amount < ask_ow.amount:
-            amount = bid_ow.amount
-            ask_ow.amount = ask_ow.amount - amount
-            bid_retain_row, ask_retain_row = None, [ask_exc, ask_ow]
-        elif bid_ow.amount == ask_ow.amount:
-            amount = bid_ow.amount
-            bid_retain_row, ask_retain_row = None, None
-        else:
-            amount = ask_ow.amount
-            bid_ow.amount = bid_ow.amount - amount
-            bid_retain_row, ask_retain_row = [bid_exc, bid_ow], None
-
-        trade_l.append(
-            Trade(
-                bid_exc=bid_exc,
-                ask_exc=ask_exc,
-                bid_price=bid_ow.price,
-                ask_price=ask_ow.price,
-                amount=amount,
-            )
-        )
-    return trade_l
-
-
 if __name__ == "__main__":
     lp = asyncio.get_event_loop()
     ac = ArbCharm('BTC/USDT', [get_exchange(e, {}) for e in ('binance', 'bitfinex', 'huobipro')])
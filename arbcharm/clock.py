@@ -0,0 +1,65 @@
+# !/usr/bin/env python
+"""
+clock offset of one exchange against the local wall clock, and the one-way latency of its messages.
+"""
+__author__ = 'Rick Zhang'
+__time__ = '2018/10/12'
+
+from collections import deque
+
+from arbcharm import settings
+from arbcharm.metrics import registry
+
+
+class ClockEstimator:
+    """
+    offset = local wall clock - exchange clock.
+    ping/pong carrying the server time gives it NTP-style from the round trip with the smallest rtt.
+    without that, the smallest receive - event delay of the window stands for the offset,
+    so latencies are measured above the best case seen instead of absolutely.
+    """
+    def __init__(self, exchange_name, window=None):
+        window = window or settings.CLOCK_WINDOW
+        self._ping_samples = deque(maxlen=window)  # (rtt, offset)
+        self._delay_samples = deque(maxlen=window)  # receive - event
+        self.offset = None
+        self.rtt = None
+        self.latency = 0.0  # latest one-way latency estimate
+        self.latency_hist = registry.histogram('event_latency_seconds', exchange=exchange_name)
+
+    def add_ping(self, sent, received, server_time=None):
+        """
+        :param sent: local wall time the ping was sent
+        :param received: local wall time the pong arrived
+        :param server_time: exchange time in the pong, if the exchange sends one
+        """
+        self.rtt = received - sent
+        if server_time is None:
+            if not self._delay_samples:
+                self.latency = self.rtt / 2
+            return
+        self._ping_samples.append((self.rtt, (sent+received)/2 - server_time))
+        self.offset = min(self._ping_samples)[1]
+        self.latency = max(received - self.offset - server_time, 0.0)
+
+    def add_event(self, event_time, received) -> float:
+        """
+        :param event_time: exchange time a message was produced at
+        :param received: local wall time it arrived
+        :return: one-way latency of the message
+        """
+        delay = received - event_time
+        if not self._ping_samples:
+            samples = self._delay_samples
+            evicted = samples[0] if len(samples) == samples.maxlen else None
+            samples.append(delay)
+            if self.offset is None or delay <= self.offset:
+                self.offset = delay
+            elif evicted is not None and evicted <= self.offset:
+                self.offset = min(samples)
+        self.latency = max(delay - self.offset, 0.0)
+        self.latency_hist.record(self.latency)
+        return self.latency
+
+    def to_dict(self):
+        return {'offset': self.offset, 'rtt': self.rtt, 'latency': self.latency}
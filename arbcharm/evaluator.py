@@ -0,0 +1,132 @@
+# !/usr/bin/env python
+"""
+turn the fee-aware matches of auto_match into sized orders.
+the trades come best edge first, so the walk stops at the first one below the required rate
+and every leg is sized from cumulative depth, capped by the balance available on its exchange.
+"""
+__author__ = 'Rick Zhang'
+__time__ = '2018/10/12'
+
+from typing import Dict, List, Tuple
+
+from arbcharm.models import BaseExchange, Order, Trade
+
+
+class Leg:
+    __slots__ = ('exchange', 'side', 'amount', 'notional', 'price')
+
+    def __init__(self, exchange: BaseExchange, side):
+        self.exchange = exchange
+        self.side = side
+        self.amount = 0.0
+        self.notional = 0.0  # sum of price*amount of the levels taken
+        self.price = None  # worst level taken, the limit price of the order
+
+    def take(self, price, amount):
+        self.amount += amount
+        self.notional += price * amount
+        if self.price is None:
+            self.price = price
+        elif self.side == Order.SIDE_BUY:
+            self.price = max(self.price, price)
+        else:
+            self.price = min(self.price, price)
+
+    @property
+    def vwap(self):
+        return self.notional / self.amount if self.amount else None
+
+
+class Opportunity:
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.leg_d = {}  # (exchange, side): Leg
+        self.profit = 0.0  # expected quote currency after taker fees
+        self.cost = 0.0  # quote currency spent on the buy legs, fees included
+
+    def leg(self, exchange: BaseExchange, side) -> Leg:
+        leg = self.leg_d.get((exchange, side))
+        if leg is None:
+            leg = self.leg_d[(exchange, side)] = Leg(exchange, side)
+        return leg
+
+    @property
+    def edge(self):
+        return self.profit / self.cost if self.cost else 0.0
+
+    def to_orders(self) -> List[Order]:
+        return [
+            Order(
+                exc=leg.exchange,
+                symbol=self.symbol,
+                price=leg.price,
+                amount=leg.amount,
+                side=leg.side,
+            )
+            for leg in self.leg_d.values()
+        ]
+
+    def to_dict(self):
+        return {
+            'symbol': self.symbol,
+            'profit': self.profit,
+            'edge': self.edge,
+            'legs': [
+                {'exchange': leg.exchange.name, 'side': leg.side, 'amount': leg.amount,
+                 'price': leg.price, 'vwap': leg.vwap}
+                for leg in self.leg_d.values()
+            ],
+        }
+
+    def __bool__(self):
+        return bool(self.leg_d)
+
+
+def size_opportunity(
+        symbol,
+        trades: List[Trade],
+        fee_d: Dict[BaseExchange, float],
+        rate,
+        amount_mul=1.0,
+        capacity_d: Dict[BaseExchange, Tuple[float, float]] = None,
+) -> Opportunity:
+    """
+    :param trades: auto_match(ob_l, fee_d) output
+    :param fee_d: exchange: taker fee rate
+    :param rate: minimal edge of a trade after fees
+    :param amount_mul: share of the matched depth to take
+    :param capacity_d: exchange: (base, quote) available for trading, missing means unlimited
+    """
+    opportunity = Opportunity(symbol)
+    base_left = {}
+    quote_left = {}
+    if capacity_d:
+        for e, (base, quote) in capacity_d.items():
+            base_left[e] = base
+            quote_left[e] = quote
+
+    for t in trades:
+        if t.bid_exc is t.ask_exc:
+            continue
+        ask_cost = t.ask_price * (1 + fee_d.get(t.ask_exc, 0.0))
+        bid_gain = t.bid_price * (1 - fee_d.get(t.bid_exc, 0.0))
+        if (bid_gain - ask_cost) / ask_cost <= rate:
+            break  # the edge only gets thinner deeper in the books
+
+        amount = t.amount * amount_mul
+        if t.ask_exc in quote_left:
+            amount = min(amount, quote_left[t.ask_exc] / ask_cost)
+        if t.bid_exc in base_left:
+            amount = min(amount, base_left[t.bid_exc])
+        if amount <= 0:
+            continue
+        if t.ask_exc in quote_left:
+            quote_left[t.ask_exc] -= amount * ask_cost
+        if t.bid_exc in base_left:
+            base_left[t.bid_exc] -= amount
+
+        opportunity.leg(t.ask_exc, Order.SIDE_BUY).take(t.ask_price, amount)
+        opportunity.leg(t.bid_exc, Order.SIDE_SELL).take(t.bid_price, amount)
+        opportunity.profit += (bid_gain - ask_cost) * amount
+        opportunity.cost += ask_cost * amount
+    return opportunity
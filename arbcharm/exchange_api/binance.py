@@ -3,51 +3,76 @@ __author__ = 'Rick Zhang'
 __time__ = '2018/10/12'
 
 import asyncio
-import json
-import time
+from collections import deque
 
-import websockets
-
-from arbcharm.models import BaseExchange, OrderBook, OrderRow
+from arbcharm import settings
+from arbcharm.metrics import registry
+from arbcharm.models import BaseExchange, ccxt_errors
+from arbcharm.tools import is_clock_simulated, rate_limit_generator
 
 
 class Binance(BaseExchange):
     """
     binance websockets doc:
     https://github.com/binance-exchange/binance-official-api-docs/blob/master/web-socket-streams.md
+    the book comes from the depth20 partial stream, or with BINANCE_DIFF_DEPTH from the
+    depth@100ms diff stream applied on a REST snapshot of BINANCE_BOOK_DEPTH levels
     """
-    async def set_orderbook_d(self, symbol):
-        """
-        bitfinex websockets doc: https://docs.bitfinex.com/docs/ws-general
-        """
-        if symbol in self._orderbook_d:
-            return
-        self.clear_book(symbol)
-
-        while True:
-            try:
-                await self._cache_book_ws(symbol)
-            except websockets.exceptions.ConnectionClosed as e:
-                self.logger.exception(error_class=e.__class__.__name__)  # TODO fix connection error
-                await asyncio.sleep(10)
-            except:  # pylint: disable=bare-except
-                self.logger.exception()
-                await asyncio.sleep(10)
-
-    async def _cache_book_ws(self, symbol):
+    max_symbol_per_conn = 100  # 2 streams per symbol, 1024 streams at most per connection
+
+    def __init__(self, name, config):
+        super().__init__(name, config)
+        self._stream_sym_d = {}  # 'btcusdt': sym
+        self._request_id = 0
+        self.diff_depth = settings.BINANCE_DIFF_DEPTH
+        self.depth_stream = 'depth@100ms' if self.diff_depth else 'depth20'
+        self._diff_buffer_d = {}  # sym: deque of the diff events received before the snapshot
+        self._snapshot_task_d = {}  # sym: Task
+        self.snapshot_rate_limit = rate_limit_generator()
+        self.snapshot_rate_limit.send(None)
+        self.gap_counter = registry.counter('book_sequence_gaps_total', exchange=name)
+        self.snapshot_counter = registry.counter('book_snapshots_total', exchange=name)
+
+    def ws_url(self):
+        return 'wss://stream.binance.com:9443/stream'
+
+    def get_streams(self, symbol):
         __sym = symbol.replace('/', '').lower()
-        stm_book = '{}@depth20'.format(__sym)
-        stm_trade = '{}@aggTrade'.format(__sym)
-        url = 'wss://stream.binance.com:9443/stream?streams={}/{}'.format(stm_book, stm_trade)
-
-        async with websockets.connect(url) as ws:
-            while True:
-                msg = json.loads(await asyncio.wait_for(ws.recv(), timeout=30))
-                event = msg.get('stream')
-                if event == stm_book:
-                    self.deal_book_event(symbol, msg['data'])
-                elif event == stm_trade:
-                    self.deal_trade_event(symbol, msg['data'])
+        return ['{}@{}'.format(__sym, self.depth_stream), '{}@aggTrade'.format(__sym)]
+
+    def register_symbol(self, conn, symbol):
+        self._stream_sym_d[symbol.replace('/', '').lower()] = symbol
+
+    async def send_subscribe(self, conn, symbol):
+        await self._send_request(conn, 'SUBSCRIBE', self.get_streams(symbol))
+
+    async def send_unsubscribe(self, conn, symbol):
+        await self._send_request(conn, 'UNSUBSCRIBE', self.get_streams(symbol))
+
+    async def _send_request(self, conn, method, params):
+        self._request_id += 1
+        msg = {'method': method, 'params': params, 'id': self._request_id}
+        await conn.ws.send(self.codec.dumps(msg))
+
+    async def handle_frame(self, conn, frame):
+        msg = self.decode(frame)
+        stream = msg.get('stream')
+        if not stream:
+            if msg.get('error'):
+                self.logger.error(event='request_error', conn=conn.name, data=msg)
+            return True
+
+        __sym, event = stream.split('@', 1)
+        symbol = self._stream_sym_d.get(__sym)
+        if symbol not in conn.symbols:
+            return True
+        if event == 'depth20':
+            self.deal_book_event(symbol, msg['data'])
+        elif event == 'depth@100ms':
+            self.deal_diff_event(symbol, msg['data'])
+        elif event == 'aggTrade':
+            self.deal_trade_event(symbol, msg['data'])
+        return True
 
     def deal_book_event(self, symbol, data):
         """
@@ -58,15 +83,112 @@ class Binance(BaseExchange):
             'asks': [['6749.48000000', '0.14953300', []],...],
         }
         """
-        ob = OrderBook(
-            exchange=self,
-            symbol=symbol,
-            asks=[OrderRow(price=float(p), amount=float(a), count=1) for p, a, _ in data['asks']],
-            bids=[OrderRow(price=float(p), amount=float(a), count=1) for p, a, _ in data['bids']],
-            timestamp=time.time(),
-        )
+        ob = self.book_engine(symbol)
+        update_id = data.get('lastUpdateId')
+        if ob.sequence is not None and update_id is not None and update_id <= ob.sequence:
+            return  # older than the REST snapshot
+        ob.load(asks=data['asks'], bids=data['bids'], cast=float)
+        ob.sequence = update_id
         self.set_book(ob)
 
+    def deal_diff_event(self, symbol, data):
+        """
+        data:
+        {
+            'e': 'depthUpdate',
+            'E': 1539683812143,
+            's': 'BTCUSDT',
+            'U': 265429176,  # first update id of the event
+            'u': 265429180,  # last update id of the event
+            'b': [['6749.48000000', '0.14953300'],...],  # changed levels, amount 0 removes
+            'a': [['6749.49000000', '0.00000000'],...],
+        }
+        events are applied in place on a snapshot, the first one must cover the update after the
+        snapshot and every next one must start right after the previous one, otherwise the book
+        is lost and a new snapshot is loaded
+        """
+        ob = self.book_engine(symbol)
+        if ob.sequence is None:
+            self._buffer_diff_event(symbol, data)
+            return
+        if data['u'] <= ob.sequence:
+            return  # already in the snapshot
+        if data['U'] > ob.sequence + 1:
+            self.gap_counter.inc()
+            self.logger.warning(
+                event='book_sequence_gap', symbol=symbol, sequence=ob.sequence, first=data['U'],
+            )
+            self.mark_down([symbol])
+            self._buffer_diff_event(symbol, data)
+            return
+        for side, rows in ((ob.bids, data['b']), (ob.asks, data['a'])):
+            for price, amount in rows:
+                amount = float(amount)
+                if amount:
+                    side.set_level(float(price), amount)
+                else:
+                    side.remove_level(float(price))
+            if len(side) > settings.BINANCE_BOOK_DEPTH:
+                # levels beyond the snapshot are only known if they changed since
+                side.truncate(settings.BINANCE_BOOK_DEPTH)
+        ob.sequence = data['u']
+        self.set_book(ob, data['E']/1000)
+
+    def _buffer_diff_event(self, symbol, data):
+        buffer = self._diff_buffer_d.get(symbol)
+        if buffer is None:
+            buffer = self._diff_buffer_d[symbol] = deque(maxlen=settings.BINANCE_DIFF_BUFFER)
+        buffer.append(data)
+        self.request_snapshot(symbol)
+
+    def request_snapshot(self, symbol):
+        """
+        load the REST snapshot of symbol in the background, at most one at a time and one per
+        BINANCE_SNAPSHOT_INTERVAL
+        """
+        if is_clock_simulated():
+            return  # replaying: the recorded snapshot comes later in the feed
+        if symbol in self._snapshot_task_d:
+            return
+        if not self.snapshot_rate_limit.send((symbol, settings.BINANCE_SNAPSHOT_INTERVAL)):
+            return  # the next diff event asks again
+        self._snapshot_task_d[symbol] = asyncio.ensure_future(self.load_snapshot(symbol))
+
+    async def load_snapshot(self, symbol):
+        try:
+            snapshot = await self.ccxt_exchange.fetch_order_book(
+                symbol, settings.BINANCE_BOOK_DEPTH)
+        except ccxt_errors.BaseError as e:
+            self.logger.exception(
+                event='snapshot_error', symbol=symbol, error_class=e.__class__.__name__,
+            )
+            return
+        finally:
+            self._snapshot_task_d.pop(symbol, None)
+        self.record_snapshot(symbol, snapshot)
+        self.apply_snapshot(symbol, snapshot)
+
+    def apply_snapshot(self, symbol, snapshot):
+        """
+        load a REST snapshot, fetched or recorded, and apply the diff events buffered for it
+        :param snapshot: {'bids': [[price, amount], ...], 'asks': [...], 'nonce': lastUpdateId}
+        """
+        self.snapshot_counter.inc()
+        ob = self.book_engine(symbol)
+        ob.load(asks=snapshot['asks'], bids=snapshot['bids'])
+        ob.sequence = snapshot['nonce']
+        self.set_book(ob)
+        buffer = self._diff_buffer_d.pop(symbol, ())
+        for data in buffer:
+            self.deal_diff_event(symbol, data)
+
+    async def warm_start(self, symbol):
+        if self.diff_depth:
+            # the snapshot the diff events apply to
+            self.request_snapshot(symbol)
+        else:
+            await super().warm_start(symbol)
+
     def deal_trade_event(self, symbol, data):
         """
         data:
@@ -84,9 +206,7 @@ class Binance(BaseExchange):
             'M': True
         }
         """
-        ob = self.get_book(symbol)
-        if ob:
-            ob.remove_bad_price(float(data['p']))
+        self.on_trade(symbol, float(data['p']), data['E']/1000)
 
     async def cancel_all(self):
         pass
@@ -96,3 +216,4 @@ if __name__ == '__main__':
     ba = Binance('binance', {})
     lp = asyncio.get_event_loop()
     lp.run_until_complete(ba.set_orderbook_d('BTC/USDT'))
+    lp.run_forever()
@@ -3,127 +3,473 @@ __author__ = 'Rick Zhang'
 __time__ = '2018/10/12'
 
 import asyncio
-import json
-import time
+import zlib
 
-import websockets
+from arbcharm import settings
+from arbcharm.metrics import registry
+from arbcharm.models import BaseExchange, OrderBook
+from arbcharm.tools import monotonic, now, rate_limit_generator
 
-from arbcharm import errors, settings
-from arbcharm.models import BaseExchange, OrderBook, OrderRow
-from arbcharm.tools import bisect_right, rate_limit_generator
+CONF_FLAG_CHECKSUM = 131072  # a [chanId, 'cs', CHECKSUM] message after every book update
+
+CHECKSUM_DEPTH = 25
+
+ERROR_ALREADY_SUBSCRIBED = 10301
+ERROR_NOT_SUBSCRIBED = 10401
+ERROR_UNKNOWN_PAIR = 10001
+ERROR_UNKNOWN_CHANNEL = 10302
+PERMANENT_ERRORS = (ERROR_UNKNOWN_PAIR, ERROR_UNKNOWN_CHANNEL)  # asking again gets the same error
+
+
+def js_number(x) -> str:
+    """
+    x as javascript's Number.toString writes it, which is what the checksum is computed on:
+    no '.0' on integral values, positional notation down to 1e-6 and exponents as 'e-7' or 'e+21'
+    """
+    if x == int(x) and abs(x) < 1e21:
+        return str(int(x))
+    r = repr(float(x))
+    if 'e' not in r:
+        return r
+    mantissa, exp = r.split('e')
+    exp = int(exp)
+    if -6 <= exp < 0:  # python switches to exponents below 1e-4
+        sign = '-' if mantissa.startswith('-') else ''
+        return '{}0.{}{}'.format(sign, '0'*(-exp-1), mantissa.lstrip('-').replace('.', ''))
+    return '{}e{:+d}'.format(mantissa, exp)
+
+
+def _first_diff(a, b) -> int:
+    if a == b:  # most updates leave three of the four columns alone
+        return len(a)
+    for i, (x, y) in enumerate(zip(a, b)):
+        if x != y:
+            return i
+    return min(len(a), len(b))
+
+
+def is_book_snapshot(data) -> bool:
+    """
+    [chanId, [[...], ...]], an empty book is [chanId, []]
+    """
+    ows = data[1]
+    return isinstance(ows, list) and (not ows or isinstance(ows[0], list))
+
+
+class BookChecksum:
+    """
+    crc32 of the top levels as bitfinex computes it, a signed int32 of
+    'bid key:bid amount:ask key:ask amount:...' over level 0, 1... with negative ask amounts.
+    the key is the price on P0 books and the order id on R0 books.
+    the crc after every level is kept, a check only hashes the levels from the first one
+    that changed since the last check, and the formatted levels are cached.
+    """
+    __slots__ = ('value', '_cols', '_prefix', '_bid_frag_d', '_ask_frag_d')
+    max_fragments = 10000
+
+    def __init__(self):
+        self.value = 0
+        self._cols = ([], [], [], [])
+        self._prefix = []  # level i: crc of the string up to and including level i
+        self._bid_frag_d = {}  # (key, amount): b':key:amount'
+        self._ask_frag_d = {}
+
+    def compute(self, bid_keys, bid_amounts, ask_keys, ask_amounts) -> int:
+        """
+        :param bid_keys: best first, as BookSide.top returns them, ask amounts are positive
+        :return: the signed checksum
+        """
+        last_bid_keys, last_bid_amounts, last_ask_keys, last_ask_amounts = self._cols
+        start = min(
+            _first_diff(bid_keys, last_bid_keys),
+            _first_diff(bid_amounts, last_bid_amounts),
+            _first_diff(ask_keys, last_ask_keys),
+            _first_diff(ask_amounts, last_ask_amounts),
+        )
+        self._cols = (bid_keys, bid_amounts, ask_keys, ask_amounts)
+        n_bid, n_ask = len(bid_keys), len(ask_keys)
+        n = max(n_bid, n_ask)
+        if start >= n and len(self._prefix) == n:
+            return self.value
+        prefix = self._prefix
+        del prefix[start:]
+        crc = prefix[-1] if start else 0
+        bid_frag_d, ask_frag_d = self._bid_frag_d, self._ask_frag_d
+        crc32 = zlib.crc32
+        for i in range(start, n):
+            if i < n_bid:
+                key = (bid_keys[i], bid_amounts[i])
+                frag = bid_frag_d.get(key) or self._fragment(bid_frag_d, key, 1)
+                crc = crc32(frag[1:] if i == 0 else frag, crc)
+            if i < n_ask:
+                key = (ask_keys[i], ask_amounts[i])
+                frag = ask_frag_d.get(key) or self._fragment(ask_frag_d, key, -1)
+                crc = crc32(frag[1:] if i == 0 and not n_bid else frag, crc)
+            prefix.append(crc)
+        self.value = crc - 0x100000000 if crc & 0x80000000 else crc
+        return self.value
+
+    def _fragment(self, frag_d, key, sign) -> bytes:
+        if len(frag_d) >= self.max_fragments:
+            frag_d.clear()
+        frag = frag_d[key] = ':{}:{}'.format(js_number(key[0]), js_number(key[1]*sign)).encode()
+        return frag
+
+
+class RawBook:
+    """
+    R0 book: every order by id, summed into the price levels of an OrderBook.
+    an order changes in O(1) on the id index plus a set_level of its price
+    """
+    __slots__ = ('ob', '_order_d', '_level_d')
+
+    def __init__(self, ob: OrderBook):
+        self.ob = ob
+        self._order_d = {}  # id: (price, amount), amount negative for an ask
+        self._level_d = {}  # price, negative for an ask: {id: amount}
+
+    def load(self, orders):
+        self.ob.clear()
+        self._order_d.clear()
+        self._level_d.clear()
+        for oid, price, amount in orders:
+            self.update(oid, price, amount)
+
+    def update(self, oid, price, amount):
+        """
+        price 0 removes the order
+        :return: (price, amount) the order had before, None if it is new
+        """
+        old = self._order_d.pop(oid, None)
+        if old is not None:
+            self._change(oid, old[0], old[1], remove=True)
+        if price:
+            self._order_d[oid] = (price, amount)
+            self._change(oid, price, amount)
+        return old
+
+    def has_level(self, key) -> bool:
+        """
+        :param key: price of a bid, negative price of an ask
+        """
+        return key in self._level_d
+
+    def _change(self, oid, price, amount, remove=False):
+        is_bid = amount > 0
+        key = price if is_bid else -price
+        orders = self._level_d.get(key)
+        if orders is None:
+            orders = self._level_d[key] = {}
+        if remove:
+            orders.pop(oid, None)
+        else:
+            orders[oid] = amount
+        side = self.ob.bids if is_bid else self.ob.asks
+        if orders:
+            side.set_level(price, abs(sum(orders.values())), len(orders))
+        else:
+            del self._level_d[key]
+            side.remove_level(price)
+
+    def top(self, is_bid, depth):
+        """
+        :return: (ids, amounts) of the first depth orders by price, then by id within a price
+        """
+        side = self.ob.bids if is_bid else self.ob.asks
+        ids, amounts = [], []
+        for i in range(len(side)):
+            price = side.price(i)
+            orders = self._level_d[price if is_bid else -price]
+            for oid in sorted(orders):
+                ids.append(oid)
+                amounts.append(abs(orders[oid]))
+                if len(ids) == depth:
+                    return ids, amounts
+        return ids, amounts
 
 
 class Bitfinex(BaseExchange):
     """
     bitfinex websockets doc: https://docs.bitfinex.com/docs/ws-general
     """
-    async def set_orderbook_d(self, symbol):
-        if symbol in self._orderbook_d:
-            return
-        self.clear_book(symbol)
-
-        while True:
-            try:
-                await self._cache_book_ws(symbol)
-            except websockets.exceptions.ConnectionClosed as e:
-                self.logger.exception(error_class=e.__class__.__name__)  # TODO fix connection error
-                await asyncio.sleep(10)
-            except:  # pylint: disable=bare-except
-                self.logger.exception()
-                await asyncio.sleep(10)
-
-    async def _cache_book_ws(self, symbol):
-        # pylint: disable=too-many-locals, too-many-branches, too-many-statements
-        __sym = symbol.replace('/', '').replace('USDT', 'USD').upper()
-        d1 = {
+    max_symbol_per_conn = 12  # book and trades channels per symbol, 25 channels per connection
+
+    def __init__(self, name, config):
+        super().__init__(name, config)
+        self._pair_sym_d = {}  # 'BTCUSD': sym
+        self.book_prec = settings.BITFINEX_BOOK_PREC
+        self._checksum_d = {}  # sym: BookChecksum
+        self._raw_book_d = {}  # sym: RawBook
+        # sym: (keys of the levels a trade pruned, time of the first prune).
+        # a key is the price of a bid, the negative price of an ask.
+        # the exchange keeps them until it sends their deletes
+        self._pruned_d = {}
+        self.checksum_counter = registry.counter('book_checksums_total', exchange=name)
+        self.checksum_error_counter = registry.counter('book_checksum_errors_total', exchange=name)
+        self.checksum_skip_counter = registry.counter('book_checksum_skips_total', exchange=name)
+        self.channel_error_counter = registry.counter('channel_errors_total', exchange=name)
+        self._resubscribe_s = set()  # (conn name, channel, sym) waiting for a resubscribe
+        self.ping_rate_limit = rate_limit_generator()
+        self.ping_rate_limit.send(None)
+
+    def ws_url(self):
+        return 'wss://api.bitfinex.com/ws/2'
+
+    @staticmethod
+    def get_pair(symbol):
+        return symbol.replace('/', '').replace('USDT', 'USD').upper()
+
+    def register_symbol(self, conn, symbol):
+        self._pair_sym_d[self.get_pair(symbol)] = symbol
+
+    def book_subscription(self, symbol):
+        d = {
             "event": "subscribe",
             "channel": "book",
-            "pair": __sym,
-            "prec": "P0",
-            "freq": "F0",
-            "length": str(settings.CACHE_ORDER_ROW_LENGTH),
+            "symbol": 't' + self.get_pair(symbol),
+            "prec": self.book_prec,
+            # the checksum covers 25 levels, lengths are 1, 25, 100 or 250
+            "len": str(CHECKSUM_DEPTH),
+        }
+        if self.book_prec != 'R0':
+            d["freq"] = "F0"
+        return d
+
+    def trades_subscription(self, symbol):
+        return {
+            "event": "subscribe",
+            "channel": "trades",
+            "symbol": 't' + self.get_pair(symbol),
         }
-        # d2 = {
-        #     "event": "subscribe",
-        #     "channel": "trades",
-        #     "pair": __sym
-        # }
-        book_channel_id = None
-        # trades_channel_id = None
-        ping_rate_limit = rate_limit_generator()
-        ping_rate_limit.send(None)
-        async with websockets.connect("wss://api.bitfinex.com/ws") as ws:
-            await ws.send(json.dumps(d1))
-            # await ws.send(json.dumps(d2))
-            asks = []
-            bids = []
-
-            while True:
-                data = json.loads(await asyncio.wait_for(ws.recv(), timeout=30))
-                if isinstance(data, dict):
-                    if data.get('event') == 'info':
-                        self.logger.info(event='get_bitfinex_event', data=data)
-                        if data.get('code') == 20051:  # reconn signal
-                            return
-                        if data.get('code') == 20060:  # pause signal
-                            await asyncio.sleep(15)
-                            return
-                        continue
-                    elif data.get('event') == 'error':
-                        raise errors.ExchangeError(data)
-                    elif data.get('event') == 'subscribed':
-                        if data.get('channel') == 'book':
-                            book_channel_id = data['chanId']
-                        # if data.get('channel') == 'trades':
-                        #     trades_channel_id = data['chanId']
-                elif isinstance(data, list) and book_channel_id == data[0]:
-                    await self._handle_ws_book(data, asks, bids, symbol)
-                # elif isinstance(data, list) and trades_channel_id == data[0]:
-                #     await self._handle_ws_trades(data)
-
-                if ping_rate_limit.send(('{}.ping'.format(self.name), 5)):
-                    await ws.send(json.dumps({"event": "ping"}))
-
-    async def _handle_ws_book(self, data, asks, bids, symbol):
-        # pylint: disable=too-many-locals
-        recv_time = time.time()
-        if len(data) == 2:  # get book snapshot
-            if data[1] == 'hb':
-                return
-            _, ows = data
-            asks.clear()
-            bids.clear()
+
+    async def send_subscribe(self, conn, symbol):
+        if settings.BITFINEX_BOOK_CHECKSUM:
+            # flags hold for the whole connection, setting them again per symbol is harmless
+            await conn.ws.send(self.codec.dumps({"event": "conf", "flags": CONF_FLAG_CHECKSUM}))
+        await conn.ws.send(self.codec.dumps(self.book_subscription(symbol)))
+        await conn.ws.send(self.codec.dumps(self.trades_subscription(symbol)))
+
+    async def send_unsubscribe(self, conn, symbol):
+        for chan_id, (_channel, sym) in list(conn.channel_d.items()):
+            if sym == symbol:
+                await conn.ws.send(self.codec.dumps({"event": "unsubscribe", "chanId": chan_id}))
+
+    async def keepalive(self, conn):
+        if self.ping_rate_limit.send(('{}.ping'.format(conn.name), 5)):
+            # the send time comes back in the pong as cid
+            await conn.ws.send(self.codec.dumps({"event": "ping", "cid": int(now()*1000)}))
+
+    async def handle_frame(self, conn, frame):
+        data = self.decode(frame)
+        if isinstance(data, dict):
+            if data.get('event') == 'info':
+                self.logger.info(event='get_bitfinex_event', conn=conn.name, data=data)
+                if data.get('code') == 20051:  # reconn signal
+                    return False
+                if data.get('code') == 20060:  # pause signal
+                    if conn.ws is not None:
+                        await asyncio.sleep(15)
+                    return False
+            elif data.get('event') == 'error':
+                # the connection is shared by several symbols, only the failed channel is concerned
+                await self.handle_channel_error(conn, data)
+            elif data.get('event') == 'conf':
+                if data.get('status') != 'OK':
+                    self.logger.warning(event='bitfinex_conf_failed', conn=conn.name, data=data)
+            elif data.get('event') == 'subscribed':
+                if data.get('channel') in ('book', 'trades'):
+                    symbol = self._pair_sym_d.get(data.get('pair'))
+                    conn.channel_d[data['chanId']] = (data['channel'], symbol)
+            elif data.get('event') == 'unsubscribed':
+                channel, symbol = conn.channel_d.pop(data.get('chanId'), (None, None))
+                if channel == 'resync' and symbol in conn.symbols and conn.ws is not None:
+                    await conn.ws.send(self.codec.dumps(self.book_subscription(symbol)))
+            elif data.get('event') == 'pong':
+                if data.get('cid'):
+                    server_time = data['ts']/1000 if data.get('ts') else None
+                    self.clock.add_ping(data['cid']/1000, now(), server_time)
+        elif isinstance(data, list):
+            channel, symbol = conn.channel_d.get(data[0], (None, None))
+            if symbol in conn.symbols:
+                if channel == 'resync' and conn.ws is None and is_book_snapshot(data):
+                    # a replay does not resubscribe, the next recorded snapshot brings the book back
+                    channel = 'book'
+                    conn.channel_d[data[0]] = (channel, symbol)
+                if channel == 'book':
+                    if data[1] == 'cs':
+                        if not self.verify_book(symbol, data[2]):
+                            await self.resync_book(conn, data[0], symbol)
+                    else:
+                        await self._handle_ws_book(data, symbol)
+                elif channel == 'trades':
+                    self._handle_ws_trades(data, symbol)
+        return True
+
+    async def handle_channel_error(self, conn, data):
+        """
+        a subscribe or unsubscribe bitfinex refused:
+        {"event": "error", "msg": ..., "code": ..., "channel": "book", "symbol": "tBTCUSD", ...}.
+        the book of the symbol is down and the channel is subscribed again after
+        BITFINEX_RESUBSCRIBE_DELAY, the other channels of the connection go on
+        """
+        code = data.get('code')
+        self.channel_error_counter.inc()
+        self.logger.warning(event='bitfinex_channel_error', conn=conn.name, code=code, data=data)
+        if data.get('chanId') in conn.channel_d:
+            # unsubscribe failed, the channel is gone or stays: forget it like a done unsubscribe
+            channel, symbol = conn.channel_d.pop(data['chanId'])
+            if channel == 'resync' and symbol in conn.symbols and conn.ws is not None:
+                await conn.ws.send(self.codec.dumps(self.book_subscription(symbol)))
+            return
+        if code in (ERROR_ALREADY_SUBSCRIBED, ERROR_NOT_SUBSCRIBED):
+            return  # the channel already is in the state asked for
+        channel = data.get('channel')
+        symbol = self._pair_sym_d.get(data.get('pair') or data.get('symbol', '')[1:])
+        if symbol not in conn.symbols or channel not in ('book', 'trades'):
+            return
+        if channel == 'book':
+            self.mark_down([symbol])
+        if code in PERMANENT_ERRORS:
+            self.logger.error(
+                event='bitfinex_channel_dropped', conn=conn.name, channel=channel, symbol=symbol,
+            )
+            return
+        key = (conn.name, channel, symbol)
+        if conn.ws is not None and key not in self._resubscribe_s:
+            self._resubscribe_s.add(key)
+            asyncio.ensure_future(self.resubscribe(conn, channel, symbol))
+
+    async def resubscribe(self, conn, channel, symbol):
+        ws = conn.ws
+        try:
+            await asyncio.sleep(settings.BITFINEX_RESUBSCRIBE_DELAY)
+        finally:
+            self._resubscribe_s.discard((conn.name, channel, symbol))
+        if conn.ws is not ws or symbol not in conn.symbols:
+            return  # reconnected, which subscribed everything again, or unsubscribed meanwhile
+        if (channel, symbol) in conn.channel_d.values():
+            return
+        if channel == 'book':
+            d = self.book_subscription(symbol)
+        else:
+            d = self.trades_subscription(symbol)
+        await ws.send(self.codec.dumps(d))
+
+    def raw_book(self, symbol) -> RawBook:
+        raw = self._raw_book_d.get(symbol)
+        if raw is None:
+            raw = self._raw_book_d[symbol] = RawBook(self.book_engine(symbol))
+        return raw
+
+    async def _handle_ws_book(self, data, symbol):
+        """
+        P0 snapshot [chanId, [[PRICE, COUNT, AMOUNT], ...]]
+        and update [chanId, [PRICE, COUNT, AMOUNT]],
+        R0 snapshot [chanId, [[ORDER_ID, PRICE, AMOUNT], ...]]
+        and update [chanId, [ORDER_ID, PRICE, AMOUNT]].
+        positive amounts are bids, count 0 or price 0 removes
+        """
+        ows = data[1]
+        if ows == 'hb':
+            return
+        ob = self.book_engine(symbol)
+        is_snapshot = is_book_snapshot(data)
+        if is_snapshot:
+            self._pruned_d.pop(symbol, None)
+        if self.book_prec == 'R0':
+            if is_snapshot:
+                self.raw_book(symbol).load(ows)
+            else:
+                raw = self.raw_book(symbol)
+                oid, price, amount = ows
+                old = raw.update(oid, price, amount)
+                if self._pruned_d:
+                    if price:
+                        self._confirm_pruned(symbol, price if amount > 0 else -price)
+                    if old is not None:
+                        old_key = old[0] if old[1] > 0 else -old[0]
+                        if not raw.has_level(old_key):  # the last order of the level is gone
+                            self._confirm_pruned(symbol, old_key)
+        elif is_snapshot:
+            ob.clear()
             for p, c, a in ows:
                 if a >= 0:
-                    bids.append(OrderRow(price=p, count=c, amount=a))
+                    ob.bids.set_level(p, a, c)
                 else:
-                    asks.append(OrderRow(price=p, count=c, amount=-a))
-        elif len(data) == 4:  # get change
-            _conn_id, price, count, amount = data
-            side_ows = bids if amount >= 0 else asks
-            amount = abs(amount)
-            ow = OrderRow(price=price, count=count, amount=amount)
+                    ob.asks.set_level(p, -a, c)
+        else:
+            price, count, amount = ows
+            side = ob.bids if amount >= 0 else ob.asks
             # Binary search [O(logn)]
-            ind = bisect_right(
-                side_ows, ow, key=lambda o: o.price, rv=side_ows is bids
-            )
-            l_ind = ind-1
-            if l_ind >= 0 and side_ows[l_ind].price == ow.price:
-                if count == 0:
-                    side_ows.pop(l_ind)
-                else:
-                    side_ows[l_ind] = ow
+            if count == 0:
+                side.remove_level(price)
             else:
-                side_ows.insert(ind, ow)
-        ob = OrderBook(exchange=self,
-                       symbol=symbol,
-                       bids=bids,
-                       asks=asks,
-                       timestamp=recv_time)
+                side.set_level(price, abs(amount), count)
+            if self._pruned_d:
+                self._confirm_pruned(symbol, price if amount >= 0 else -price)
         self.set_book(ob)
 
-    async def _handle_ws_trades(self):
-        pass
+    def _confirm_pruned(self, symbol, key):
+        pruned = self._pruned_d.get(symbol)
+        if pruned is not None:
+            pruned[0].discard(key)
+
+    def verify_book(self, symbol, checksum) -> bool:
+        """
+        compare the checksum bitfinex sent with the one of our book
+        """
+        pruned = self._pruned_d.get(symbol)
+        if pruned is not None:
+            keys, since = pruned
+            if keys and monotonic() - since < settings.BITFINEX_PRUNE_GRACE:
+                self.checksum_skip_counter.inc()
+                return True
+            # all deleted, or a level never deleted: the prune was wrong and the book is checked
+            del self._pruned_d[symbol]
+        self.checksum_counter.inc()
+        cs = self._checksum_d.get(symbol)
+        if cs is None:
+            cs = self._checksum_d[symbol] = BookChecksum()
+        if self.book_prec == 'R0':
+            raw = self.raw_book(symbol)
+            bid_keys, bid_amounts = raw.top(True, CHECKSUM_DEPTH)
+            ask_keys, ask_amounts = raw.top(False, CHECKSUM_DEPTH)
+        else:
+            ob = self.book_engine(symbol)
+            bid_keys, bid_amounts = ob.bids.top(CHECKSUM_DEPTH)
+            ask_keys, ask_amounts = ob.asks.top(CHECKSUM_DEPTH)
+        return cs.compute(bid_keys, bid_amounts, ask_keys, ask_amounts) == checksum
+
+    async def resync_book(self, conn, chan_id, symbol):
+        """
+        the book missed an update: drop it and subscribe again for a new snapshot.
+        frames of the channel are ignored until it is unsubscribed, or on a detached connection
+        of a replay until the channel sends a snapshot
+        """
+        self.checksum_error_counter.inc()
+        self.logger.warning(event='book_checksum_mismatch', conn=conn.name, symbol=symbol)
+        self.mark_down([symbol])
+        conn.channel_d[chan_id] = ('resync', symbol)
+        if conn.ws is not None:
+            await conn.ws.send(self.codec.dumps({"event": "unsubscribe", "chanId": chan_id}))
+
+    def _handle_ws_trades(self, data, symbol):
+        """
+        only executions are used, the snapshot holds old trades and 'tu' repeats a 'te':
+        [chanId, 'te', [ID, MTS, AMOUNT, PRICE]]
+        """
+        if data[1] == 'te':
+            _tid, mts, _amount, price = data[2]
+            ob = self.get_book(symbol)
+            keys = None
+            if ob:
+                keys = ob.bids.better_than(price) + [-p for p in ob.asks.better_than(price)]
+            if self.on_trade(symbol, price, mts/1000):
+                pruned = self._pruned_d.get(symbol)
+                if pruned is None:
+                    self._pruned_d[symbol] = (set(keys), monotonic())
+                else:
+                    pruned[0].update(keys)
 
     async def cancel_all(self):
         pass
@@ -133,3 +479,4 @@ if __name__ == '__main__':
     lp = asyncio.get_event_loop()
     bf = Bitfinex('bitfinex', {})
     lp.run_until_complete(bf.set_orderbook_d('BTC/USDT'))
+    lp.run_forever()
@@ -0,0 +1,88 @@
+# !/usr/bin/env python
+"""
+websocket message codecs.
+the fastest installed json parser is used unless settings.JSON_CODEC names one.
+"""
+__author__ = 'Rick Zhang'
+__time__ = '2018/10/12'
+
+import importlib
+import json
+import zlib
+
+from arbcharm import settings
+
+
+class JsonCodec:
+    name = 'json'
+
+    def __init__(self):
+        self.loads = json.loads
+        self.dumps = json.dumps
+
+
+class OrJsonCodec(JsonCodec):
+    name = 'orjson'
+
+    def __init__(self):
+        super().__init__()
+        orjson = importlib.import_module('orjson')
+        _dumps = orjson.dumps
+        self.loads = orjson.loads
+        self.dumps = lambda obj: _dumps(obj).decode()  # websockets sends str as text frame
+
+
+class UJsonCodec(JsonCodec):
+    name = 'ujson'
+
+    def __init__(self):
+        super().__init__()
+        ujson = importlib.import_module('ujson')
+        self.loads = ujson.loads
+        self.dumps = ujson.dumps
+
+
+CODEC_CLASSES = (OrJsonCodec, UJsonCodec, JsonCodec)  # preference order
+
+
+def _get_codec_factory():
+
+    codec_d = {}
+
+    def _get_codec(name=None) -> JsonCodec:
+        """
+        :param name: codec name, None or 'auto' for the fastest installed one
+        """
+        name = name or settings.JSON_CODEC
+        if name not in codec_d:
+            for codec_cls in CODEC_CLASSES:
+                if name not in ('auto', codec_cls.name):
+                    continue
+                try:
+                    codec_d[name] = codec_cls()
+                    break
+                except ImportError:
+                    if name != 'auto':
+                        raise
+            else:
+                raise ValueError('unknown json codec: {}'.format(name))
+        return codec_d[name]
+
+    return _get_codec
+
+
+get_codec = _get_codec_factory()
+
+
+class GzipDecoder:
+    """
+    one-shot gzip inflate through zlib, skipping the GzipFile machinery of gzip.decompress.
+    a decompressobj can not be rewound once a gzip member ends,
+    so the window bits are kept instead of a decompressor instance.
+    """
+    def __init__(self):
+        self._wbits = 16 + zlib.MAX_WBITS  # expect gzip header and trailer
+        self._decompress = zlib.decompress
+
+    def decompress(self, data: bytes) -> bytes:
+        return self._decompress(data, self._wbits)
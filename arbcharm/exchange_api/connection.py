@@ -0,0 +1,148 @@
+# !/usr/bin/env python
+__author__ = 'Rick Zhang'
+__time__ = '2018/10/12'
+
+import asyncio
+import random
+import time
+
+import websockets
+
+from arbcharm import settings
+
+
+class ReconnectPolicy:
+    """
+    exponential backoff with full jitter, guarded by a circuit breaker.
+    after CIRCUIT_BREAKER_FAILURES consecutive failures the breaker opens for a cooldown,
+    then a single attempt is allowed (half open) and one more failure opens it again.
+    """
+    def __init__(
+            self,
+            base_delay=None,
+            max_delay=None,
+            breaker_failures=None,
+            breaker_cooldown=None
+    ):
+        self.base_delay = base_delay or settings.RECONNECT_BASE_DELAY
+        self.max_delay = max_delay or settings.RECONNECT_MAX_DELAY
+        self.breaker_failures = breaker_failures or settings.CIRCUIT_BREAKER_FAILURES
+        self.breaker_cooldown = breaker_cooldown or settings.CIRCUIT_BREAKER_COOLDOWN
+        self.failures = 0
+        self.half_open = False
+        self.open_count = 0
+
+    def next_delay(self) -> float:
+        self.failures += 1
+        if self.half_open or self.failures >= self.breaker_failures:
+            self.half_open = True
+            self.open_count += 1
+            return self.breaker_cooldown
+        return random.uniform(0, min(self.max_delay, self.base_delay*2**(self.failures-1)))
+
+    @property
+    def is_open(self) -> bool:
+        return self.half_open
+
+    def reset(self):
+        self.failures = 0
+        self.half_open = False
+
+
+class WsConnection:
+    """
+    one websocket shared by the subscriptions of several symbols of an exchange.
+    frames are demultiplexed by the exchange, per-connection demux state lives in channel_d.
+    """
+    def __init__(self, exchange, name):
+        self.exchange = exchange
+        self.name = name
+        self.logger = exchange.logger
+        self.symbols = set()
+        self.channel_d = {}  # exchange specific, e.g. bitfinex chanId: sym
+        self.ws = None
+        self._task = None
+        self.policy = ReconnectPolicy()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self.run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self.ws is not None:
+            await self.ws.close()
+
+    def attach(self, symbol):
+        """
+        register symbol for demultiplexing without sending anything
+        """
+        self.symbols.add(symbol)
+        self.exchange.register_symbol(self, symbol)
+        self.exchange.record_subscribe(self.name, symbol)
+
+    async def subscribe(self, symbol):
+        self.attach(symbol)
+        if self.ws is not None:  # otherwise subscribed on connect
+            await self.exchange.send_subscribe(self, symbol)
+            asyncio.ensure_future(self.exchange.warm_start(symbol))
+
+    async def unsubscribe(self, symbol):
+        self.symbols.discard(symbol)
+        if self.ws is not None:
+            await self.exchange.send_unsubscribe(self, symbol)
+
+    async def run(self):
+        while True:
+            try:
+                await self._run_once()
+                continue  # asked to reconnect by the exchange
+            except asyncio.CancelledError:
+                raise
+            except websockets.exceptions.ConnectionClosed as e:
+                self.logger.exception(conn=self.name, error_class=e.__class__.__name__)
+            except:  # pylint: disable=bare-except
+                self.logger.exception(conn=self.name)
+            finally:
+                self.exchange.mark_down(self.symbols)
+
+            delay = self.policy.next_delay()
+            if self.policy.is_open:
+                self.logger.error(
+                    event='circuit_open',
+                    conn=self.name,
+                    cooldown=delay,
+                    open_count=self.policy.open_count,
+                )
+            await asyncio.sleep(delay)
+
+    async def _run_once(self):
+        exchange = self.exchange
+        async with websockets.connect(exchange.ws_url()) as ws:
+            self.ws = ws
+            self.channel_d.clear()
+            try:
+                for symbol in list(self.symbols):
+                    await exchange.send_subscribe(self, symbol)
+                    asyncio.ensure_future(exchange.warm_start(symbol))
+                # a connection that drops soon after connecting keeps backing off
+                healthy_at = time.perf_counter() + settings.RECONNECT_HEALTHY_TIME
+                while True:
+                    frame = await asyncio.wait_for(ws.recv(), timeout=30)
+                    t1 = time.perf_counter()
+                    if healthy_at and t1 >= healthy_at:
+                        self.policy.reset()
+                        healthy_at = None
+                    exchange.record_frame(self.name, frame)
+                    exchange.frame_counter.inc()
+                    if not await exchange.handle_frame(self, frame):
+                        return
+                    exchange.frame_hist.record(time.perf_counter()-t1)
+                    await exchange.keepalive(self)
+            finally:
+                self.ws = None
+
+    def __str__(self):
+        return self.name
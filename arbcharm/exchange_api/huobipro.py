@@ -5,70 +5,104 @@ __time__ = '2018/10/12'
 import asyncio
 import gzip
 import json
-import time
 
-import websockets
+from arbcharm.exchange_api.codec import GzipDecoder
+from arbcharm.models import BaseExchange
+from arbcharm.tools import now
 
-from arbcharm.models import BaseExchange, OrderBook, OrderRow
+_gzip_decoder = GzipDecoder()
 
 
 class HuoBiPro(BaseExchange):
-    async def set_orderbook_d(self, symbol):
-        """
-        huobipro websockets doc: https://github.com/huobiapi/API_Docs/wiki/WS_request
-        """
-        if symbol in self._orderbook_d:
-            return
-        self.clear_book(symbol)
+    """
+    huobipro websockets doc: https://github.com/huobiapi/API_Docs/wiki/WS_request
+    """
+    max_symbol_per_conn = 20
 
-        while True:
-            try:
-                await self._cache_book_ws(symbol)
-            except websockets.exceptions.ConnectionClosed as e:
-                self.logger.exception(error_class=e.__class__.__name__)  # TODO fix connection error
-                await asyncio.sleep(10)
-            except:  # pylint: disable=bare-except
-                self.logger.exception()
-                await asyncio.sleep(10)
+    def __init__(self, name, config):
+        super().__init__(name, config)
+        self._topic_sym_d = {}  # topic: sym
+        self._trade_topic_sym_d = {}  # trade topic: sym
 
+    def ws_url(self):
+        return 'wss://api.huobi.pro/ws'
 
-    async def _cache_book_ws(self, symbol):
-        url = 'wss://api.huobi.pro/ws'
+    @staticmethod
+    def get_topic(symbol):
         __sym = symbol.replace('/', '').lower()
-        topic = 'market.{}.depth.step0'.format(__sym)
-        async with websockets.connect(url) as ws:
-            await self.send_data(ws, {'sub': topic, "freq-ms": 0})
-            while True:
-                data = self.decompress_msg(await asyncio.wait_for(ws.recv(), timeout=30))
-                await self.data_handler(ws, symbol, data)
-
-    async def data_handler(self, ws, symbol, data):
+        return 'market.{}.depth.step0'.format(__sym)
+
+    @staticmethod
+    def get_trade_topic(symbol):
+        __sym = symbol.replace('/', '').lower()
+        return 'market.{}.trade.detail'.format(__sym)
+
+    def register_symbol(self, conn, symbol):
+        self._topic_sym_d[self.get_topic(symbol)] = symbol
+        self._trade_topic_sym_d[self.get_trade_topic(symbol)] = symbol
+
+    async def send_subscribe(self, conn, symbol):
+        await self.send_data(conn.ws, {'sub': self.get_topic(symbol), "freq-ms": 0})
+        await self.send_data(conn.ws, {'sub': self.get_trade_topic(symbol)})
+
+    async def send_unsubscribe(self, conn, symbol):
+        await self.send_data(conn.ws, {'unsub': self.get_topic(symbol)})
+        await self.send_data(conn.ws, {'unsub': self.get_trade_topic(symbol)})
+
+    async def handle_frame(self, conn, frame):
+        await self.data_handler(conn, self.decode(frame))
+        return True
+
+    def decode_frame(self, frame):
+        return self.decompress_msg(frame)
+
+    async def data_handler(self, conn, data):
         if 'ping' in data:
-            await self.send_data(ws, {'pong': int(time.time()*1000)})
+            self.clock.add_event(data['ping']/1000, now())  # the server time of the ping
+            if conn.ws is not None:
+                await self.send_data(conn.ws, {'pong': data['ping']})
             return
         elif 'status' in data:
             if data['status'] != 'ok':
                 self.logger.error(data)
             return
         elif 'ch' in data:
-            self.handle_book(symbol, data)
+            symbol = self._topic_sym_d.get(data['ch'])
+            if symbol in conn.symbols:
+                self.handle_book(symbol, data)
+                return
+            symbol = self._trade_topic_sym_d.get(data['ch'])
+            if symbol in conn.symbols:
+                self.handle_trade(symbol, data)
         else:
             self.logger.error(event='unhandle_data', data=data)
 
     def handle_book(self, symbol, data):
-        asks = [OrderRow(price=p, amount=a, count=1) for p, a in data['tick']['asks']]
-        bids = [OrderRow(price=p, amount=a, count=1) for p, a in data['tick']['bids']]
-        timestamp = data['tick']['ts']/1000
-        ob = OrderBook(exchange=self, symbol=symbol, asks=asks, bids=bids, timestamp=timestamp)
-        self.set_book(ob)
+        tick = data['tick']
+        ob = self.book_engine(symbol)
+        ob.load(asks=tick['asks'], bids=tick['bids'])
+        self.set_book(ob, tick['ts']/1000)
 
-    @staticmethod
-    async def send_data(ws, data):
-        await ws.send(json.dumps(data))
+    def handle_trade(self, symbol, data):
+        """
+        data['tick']:
+        {
+            'id': 14650745135,
+            'ts': 1533265950234,
+            'data': [{'amount': 0.0099, 'ts': 1533265950234, 'id': 146507451359183894799,
+                      'price': 401.74, 'direction': 'buy'}, ...],
+        }
+        """
+        tick = data['tick']
+        for trade in tick['data']:
+            self.on_trade(symbol, trade['price'])
+        self.clock.add_event(tick['ts']/1000, now())
 
-    @staticmethod
-    def decompress_msg(msg):
-        return json.loads(gzip.decompress(msg).decode())
+    async def send_data(self, ws, data):
+        await ws.send(self.codec.dumps(data))
+
+    def decompress_msg(self, msg):
+        return self.codec.loads(_gzip_decoder.decompress(msg))
 
     @staticmethod
     def compress_msg(msg):
@@ -82,3 +116,4 @@ if __name__ == '__main__':
     ba = HuoBiPro('huobipro', {})
     lp = asyncio.get_event_loop()
     lp.run_until_complete(ba.set_orderbook_d('BTC/USDT'))
+    lp.run_forever()
@@ -0,0 +1,82 @@
+# !/usr/bin/env python
+"""
+exchange name -> websocket adapter class, resolved on first use so an adapter module and
+its ccxt class are only imported for the exchanges actually configured.
+adapters register with a dotted path, the register_exchange decorator,
+or an 'arbcharm.exchanges' entry point of another package:
+    [options.entry_points]
+    arbcharm.exchanges =
+        okex = my_package.okex:Okex
+"""
+__author__ = 'Rick Zhang'
+__time__ = '2018/10/12'
+
+import importlib
+
+ENTRY_POINT_GROUP = 'arbcharm.exchanges'
+
+_adapter_d = {  # name: class or 'module:Class'
+    'binance': 'arbcharm.exchange_api.binance:Binance',
+    'bitfinex': 'arbcharm.exchange_api.bitfinex:Bitfinex',
+    'huobipro': 'arbcharm.exchange_api.huobipro:HuoBiPro',
+}
+
+
+def register_exchange(name, adapter=None):
+    """
+    register_exchange('okex', 'my_package.okex:Okex'), or as a class decorator:
+    @register_exchange('okex')
+    class Okex(BaseExchange): ...
+    """
+    if adapter is not None:
+        _adapter_d[name] = adapter
+        return adapter
+
+    def _register(cls):
+        _adapter_d[name] = cls
+        return cls
+    return _register
+
+
+def _load(target):
+    module_name, _, attr = target.partition(':')
+    return getattr(importlib.import_module(module_name), attr)
+
+
+def _find_entry_point(name):
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:  # python < 3.8
+        return None
+    eps = entry_points()
+    if hasattr(eps, 'select'):
+        eps = eps.select(group=ENTRY_POINT_GROUP)
+    else:
+        eps = eps.get(ENTRY_POINT_GROUP, [])
+    for ep in eps:
+        if ep.name == name:
+            return ep.value
+    return None
+
+
+def get_exchange_class(name):
+    """
+    :return: the adapter class of name, None if no adapter is registered
+    """
+    adapter = _adapter_d.get(name)
+    if adapter is None:
+        adapter = _find_entry_point(name)
+        if adapter is None:
+            return None
+    if isinstance(adapter, str):
+        adapter = _adapter_d[name] = _load(adapter)
+    return adapter
+
+
+def get_ccxt_class(name):
+    """
+    the async ccxt class of name, only this exchange's module is imported by us.
+    ccxt's package __init__ still runs on the first call, which is why nothing imports ccxt eagerly.
+    """
+    module = importlib.import_module('ccxt.async_support.{}'.format(name))
+    return getattr(module, name)
@@ -0,0 +1,71 @@
+# !/usr/bin/env python
+"""
+aiohttp sessions for the REST calls of ccxt.
+ccxt uses a session passed in its config instead of creating its own, so the pool,
+keep-alive and dns cache are ours to tune, pre-warm and close.
+"""
+__author__ = 'Rick Zhang'
+__time__ = '2018/10/12'
+
+import ssl
+from typing import List
+from urllib.parse import urlsplit
+
+from arbcharm import settings
+from arbcharm.tools import LazyModule
+
+aiohttp = LazyModule('aiohttp')
+
+try:
+    import certifi
+    _cafile = certifi.where()
+except ImportError:
+    _cafile = None
+
+
+def make_http_session(ssl_context: ssl.SSLContext = None) -> "aiohttp.ClientSession":
+    """
+    must be called in the running loop which will use the session
+    """
+    connector = aiohttp.TCPConnector(
+        ssl=ssl_context or ssl.create_default_context(cafile=_cafile),
+        limit_per_host=settings.HTTP_POOL_SIZE,
+        keepalive_timeout=settings.HTTP_KEEPALIVE_TIMEOUT,
+        use_dns_cache=True,
+        ttl_dns_cache=settings.HTTP_DNS_CACHE_TTL,
+        enable_cleanup_closed=True,
+    )
+    return aiohttp.ClientSession(connector=connector)
+
+
+def api_origins(urls_api) -> List[str]:
+    """
+    :param urls_api: ccxt exchange.urls['api'], one url or a dict of them
+    :return: the distinct scheme://host[:port] the REST calls go to
+    """
+    if isinstance(urls_api, str):
+        urls_api = [urls_api]
+    elif isinstance(urls_api, dict):
+        urls_api = list(urls_api.values())
+    origins = []
+    for url in urls_api:
+        if not isinstance(url, str):
+            continue
+        parts = urlsplit(url)
+        origin = '{}://{}'.format(parts.scheme, parts.netloc)
+        if parts.netloc and origin not in origins:
+            origins.append(origin)
+    return origins
+
+
+async def warm_origin(session: "aiohttp.ClientSession", origin, timeout=None):
+    """
+    a cheap request which leaves a resolved, connected and tls-handshaked connection in the pool.
+    GET, not HEAD: aiohttp does not return the connection of a HEAD response to the pool
+    """
+    async with session.get(
+        origin + '/',
+        timeout=aiohttp.ClientTimeout(total=timeout or settings.HTTP_WARM_TIMEOUT),
+        allow_redirects=False,
+    ) as resp:
+        await resp.read()
@@ -0,0 +1,314 @@
+# !/usr/bin/env python
+"""
+order execution: every opportunity runs as its own task, so the symbol keeps evaluating
+while earlier orders are in flight. orders are followed until filled or timed out,
+then cancelled and the unmatched part is hedged.
+"""
+__author__ = 'Rick Zhang'
+__time__ = '2018/10/12'
+
+import asyncio
+import time
+from collections import defaultdict, deque
+from typing import List
+
+from arbcharm import settings
+from arbcharm.metrics import registry
+from arbcharm.models import Order
+from arbcharm.store import get_store
+from arbcharm.tools import LazyModule, SharedRateBudget, get_logger
+
+ccxt_errors = LazyModule('ccxt.base.errors')
+
+
+class TrackedOrder:
+    """
+    an order placed on an exchange, updated by polling or by pushed private stream updates
+    """
+    STATUS_OPEN = 'open'
+    STATUS_CLOSED = 'closed'
+    STATUS_CANCELED = 'canceled'
+    STATUS_FAILED = 'failed'  # never reached the exchange
+    STATUS_UNKNOWN = 'unknown'  # could not be cancelled, the balance reconcile finds out
+
+    def __init__(self, order: Order):
+        self.order = order
+        self.oid = None
+        self.status = self.STATUS_OPEN
+        self.filled = 0.0
+        self.average = None
+        self.placed_at = None  # monotonic
+        self.done_at = None
+        self.changed = None  # asyncio.Event, created in the loop that places the order
+
+    @property
+    def is_done(self):
+        return self.status != self.STATUS_OPEN
+
+    @property
+    def remaining(self):
+        return max(self.order.amount - self.filled, 0)
+
+    def update(self, info: dict):
+        """
+        :param info: ccxt order structure, from create_order, fetch_order or a private stream
+        """
+        if info.get('average'):
+            self.average = info['average']
+        filled = info.get('filled')
+        if filled is not None and filled > self.filled:  # updates may arrive out of order
+            o = self.order
+            o.exc.inventory.fill(o.side, o.symbol, filled-self.filled, self.average or o.price)
+            self.filled = filled
+        status = info.get('status')
+        if not self.is_done and status in (self.STATUS_CLOSED, self.STATUS_CANCELED):
+            self.finish(status)
+        if self.changed is not None:
+            self.changed.set()
+
+    def finish(self, status):
+        self.status = status
+        self.done_at = time.monotonic()
+        if self.oid is not None:
+            o = self.order
+            o.exc.inventory.unlock(o.side, o.symbol, self.remaining, o.price)
+
+    def to_dict(self):
+        return {
+            'exchange': self.order.exc.name,
+            'symbol': self.order.symbol,
+            'side': self.order.side,
+            'price': self.order.price,
+            'amount': self.order.amount,
+            'oid': self.oid,
+            'status': self.status,
+            'filled': self.filled,
+            'average': self.average,
+            'duration': self.done_at - self.placed_at if self.done_at and self.placed_at else None,
+        }
+
+
+class ExecutionEngine:
+    def __init__(self, symbol, rate_budget: SharedRateBudget = None):
+        self.symbol = symbol
+        self.rate_budget = rate_budget
+        self.logger = get_logger('Execution-{}'.format(symbol))
+        self.exposure_d = defaultdict(float)  # exchange name: notional of orders in flight
+        self.history = deque(maxlen=100)  # finished TrackedOrder, newest last
+        self._task_s = set()
+        self.store = get_store()
+        self.execution_counter = registry.counter('executions_total', symbol=symbol)
+        self.limited_counter = registry.counter('executions_limited_total', symbol=symbol)
+        self.hedge_counter = registry.counter('hedges_total', symbol=symbol)
+
+    @property
+    def inflight(self):
+        return len(self._task_s)
+
+    def submit(self, orders: List[Order]) -> bool:
+        """
+        schedule one opportunity without waiting for its orders.
+        :return: False if the opportunity is dropped by the exposure limit or the rate budget
+        """
+        if settings.MODE != 'prd' or not orders:
+            return False
+        if not self.exposure_allowed(orders) or not self.acquire_rate(orders):
+            self.limited_counter.inc()
+            return False
+
+        for o in orders:
+            self.exposure_d[o.exc.name] += o.amount * o.price
+        task = asyncio.ensure_future(self.execute(orders))
+        self._task_s.add(task)
+        task.add_done_callback(self._task_s.discard)
+        self.execution_counter.inc()
+        return True
+
+    def exposure_allowed(self, orders: List[Order]) -> bool:
+        for o in orders:
+            limit = settings.EXPOSURE_LIMIT.get(o.exc.name)
+            if limit is not None and self.exposure_d[o.exc.name] + o.amount * o.price > limit:
+                self.logger.warning(
+                    event='exposure_limited',
+                    exchange=o.exc.name,
+                    exposure=self.exposure_d[o.exc.name],
+                    limit=limit,
+                )
+                return False
+        return True
+
+    def acquire_rate(self, orders: List[Order]) -> bool:
+        """
+        one token per order, taken for all legs at once so that a refused opportunity spends nothing
+        """
+        if self.rate_budget is None:
+            return True
+        token_d = defaultdict(float)
+        for o in orders:
+            token_d[o.exc.name] += 1
+        if not self.rate_budget.acquire_many(token_d):
+            self.logger.warning(event='order_rate_limited', exchanges=sorted(token_d))
+            return False
+        return True
+
+    async def execute(self, orders: List[Order]):
+        tracked_l = [TrackedOrder(o) for o in orders]
+        try:
+            await asyncio.gather(*[self.place(t) for t in tracked_l])
+            if any(t.status == t.STATUS_FAILED for t in tracked_l):
+                # one leg is missing, do not leave the others resting on the book
+                await asyncio.gather(*[self.cancel(t) for t in tracked_l if not t.is_done])
+            else:
+                await asyncio.gather(*[self.track(t) for t in tracked_l])
+            await self.hedge(tracked_l)
+        except Exception:  # pylint: disable=broad-except
+            self.logger.exception(event='execute_error')
+        finally:
+            for o in orders:
+                self.exposure_d[o.exc.name] -= o.amount * o.price
+            for t in tracked_l:
+                await self.save_order_and_trade(t)
+
+    async def place(self, t: TrackedOrder):
+        exchange = t.order.exc
+        if t.order.side == Order.SIDE_BUY:
+            create_order = exchange.ccxt_exchange.create_limit_buy_order
+        else:
+            create_order = exchange.ccxt_exchange.create_limit_sell_order
+
+        t.changed = asyncio.Event()
+        rtt_hist = registry.histogram('order_rtt_seconds', exchange=exchange.name)
+        t1 = time.perf_counter()
+        try:
+            res = await create_order(self.symbol, t.order.amount, t.order.price)
+        except ccxt_errors.BaseError as e:
+            self.logger.exception(
+                event='place_order_error', exchange=exchange.name, error_class=e.__class__.__name__,
+            )
+            t.finish(t.STATUS_FAILED)
+            return
+        finally:
+            rtt_hist.record(time.perf_counter()-t1)
+
+        t.oid = res['id']
+        t.placed_at = time.monotonic()
+        exchange.inventory.lock(t.order.side, self.symbol, t.order.amount, t.order.price)
+        exchange.watch_order(t)
+        t.update(res)
+
+    async def track(self, t: TrackedOrder):
+        """
+        wait for fills until the order is done or ORDER_TIMEOUT, then cancel the rest.
+        pushed updates wake this up at once, otherwise the order is polled.
+        """
+        deadline = t.placed_at + settings.ORDER_TIMEOUT
+        while not t.is_done:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            t.changed.clear()
+            try:
+                await asyncio.wait_for(t.changed.wait(), min(settings.ORDER_POLL_INTERVAL, timeout))
+            except asyncio.TimeoutError:
+                await self.poll(t)
+
+        if not t.is_done:
+            await self.cancel(t)
+        else:
+            t.order.exc.unwatch_order(t.oid)
+
+    async def poll(self, t: TrackedOrder):
+        try:
+            t.update(await t.order.exc.ccxt_exchange.fetch_order(t.oid, symbol=self.symbol))
+        except ccxt_errors.BaseError as e:
+            self.logger.warning(
+                event='fetch_order_error', oid=t.oid, error_class=e.__class__.__name__,
+            )
+
+    async def cancel(self, t: TrackedOrder):
+        exchange = t.order.exc
+        retries = 0
+        while not t.is_done:
+            try:
+                await exchange.ccxt_exchange.cancel_order(t.oid, symbol=self.symbol)
+                self.logger.info(event='cancel_order_success', oid=t.oid, exchange=exchange.name)
+            except ccxt_errors.OrderNotFound:
+                pass
+            except ccxt_errors.BaseError as e:
+                self.logger.exception(event='cancel_order_error', error_class=e.__class__.__name__)
+                retries += 1
+                if retries >= settings.ORDER_CANCEL_RETRIES:
+                    # the order may still rest on the exchange, its fills and locked funds
+                    # come back with the next fetch_balance
+                    self.logger.error(
+                        event='order_unknown', oid=t.oid, exchange=exchange.name, filled=t.filled,
+                    )
+                    t.finish(t.STATUS_UNKNOWN)
+                    exchange.inventory.request_reconcile()
+                    break
+                await asyncio.sleep(settings.ORDER_POLL_INTERVAL)
+                continue
+            # the fills made before the cancel only show up in the final order state
+            await self.poll(t)
+            if not t.is_done:
+                t.finish(t.STATUS_CANCELED)
+        exchange.unwatch_order(t.oid)
+
+    async def hedge(self, tracked_l: List[TrackedOrder]):
+        """
+        close the difference between the bought and the sold amount with a market order
+        on the exchange whose leg was short of fills
+        """
+        bought = sum(t.filled for t in tracked_l if t.order.side == Order.SIDE_BUY)
+        sold = sum(t.filled for t in tracked_l if t.order.side == Order.SIDE_SELL)
+        unmatched = bought - sold
+        if not unmatched:
+            return
+
+        side = Order.SIDE_SELL if unmatched > 0 else Order.SIDE_BUY
+        legs = [t for t in tracked_l if t.order.side == side] or tracked_l
+        exchange = max(legs, key=lambda t: t.remaining).order.exc
+        amount = abs(unmatched)
+        if amount < exchange.market(self.symbol).min_amount:
+            self.logger.warning(
+                event='hedge_skipped', exchange=exchange.name, side=side, amount=amount,
+            )
+            return
+
+        self.hedge_counter.inc()
+        try:
+            if side == Order.SIDE_SELL:
+                res = await exchange.ccxt_exchange.create_market_sell_order(self.symbol, amount)
+            else:
+                res = await exchange.ccxt_exchange.create_market_buy_order(self.symbol, amount)
+        except ccxt_errors.BaseError as e:
+            self.logger.exception(
+                event='hedge_error', exchange=exchange.name, side=side, amount=amount,
+                error_class=e.__class__.__name__,
+            )
+            return
+        finally:
+            exchange.inventory.request_reconcile()  # market fills are not tracked
+        self.logger.info(
+            event='hedge', exchange=exchange.name, side=side, amount=amount, oid=res.get('id'),
+        )
+
+    async def save_order_and_trade(self, t: TrackedOrder):
+        self.history.append(t)
+        if t.status != t.STATUS_FAILED:
+            self.logger.info(event='order_done', **t.to_dict())
+        if self.store is not None:
+            self.store.append_order(t)
+
+    async def drain(self):
+        """
+        wait until every order in flight is filled or cancelled
+        """
+        if self._task_s:
+            await asyncio.wait(list(self._task_s))
+
+    def health(self) -> dict:
+        return {
+            'inflight': self.inflight,
+            'exposure': dict(self.exposure_d),
+        }
@@ -0,0 +1,362 @@
+# !/usr/bin/env python
+"""
+triangular and cross-quote opportunities over every cached book,
+e.g. BTC/USDT, ETH/USDT and ETH/BTC.
+a node is (exchange, currency) and every book gives two edges weighted -log(rate after taker fee),
+so a cycle of conversions ending with more than it started with is a negative cycle.
+the short cycles are indexed by edge and only those through the edges of an updated book are
+summed again, a log-space SPFA sweep over the whole graph catches the longer ones.
+"""
+__author__ = 'Rick Zhang'
+__time__ = '2018/10/12'
+
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+from arbcharm import settings
+from arbcharm.inventory import split_symbol
+from arbcharm.metrics import registry
+from arbcharm.models import BaseExchange, Order, OrderBook
+from arbcharm.tools import get_logger
+
+
+class Edge:
+    """
+    one conversion: sell base at the best bid or buy base at the best ask of a book,
+    or a transfer of the same currency between exchanges which costs nothing
+    (inventory is held on both)
+    """
+    __slots__ = (
+        'u', 'v', 'exchange', 'symbol', 'side', 'weight', 'rate', 'price', 'capacity', 'book',
+    )
+
+    def __init__(self, u, v, exchange: BaseExchange = None, symbol=None, side=None):
+        self.u = u
+        self.v = v
+        self.exchange = exchange
+        self.symbol = symbol  # None for a transfer
+        self.side = side
+        self.weight = 0.0 if symbol is None else math.inf  # no book yet
+        self.rate = 1.0
+        self.price = None
+        self.capacity = math.inf  # most currency of node u the top level converts
+        self.book = None
+
+    @property
+    def is_transfer(self):
+        return self.symbol is None
+
+    def update(self, ob: OrderBook, fee):
+        if self.side == Order.SIDE_SELL:
+            if not ob.bids:
+                self.weight = math.inf
+                return
+            price, amount = ob.bids.price(0), ob.bids.amount(0)
+            self.rate = price * (1-fee)
+            self.capacity = amount
+        else:
+            if not ob.asks:
+                self.weight = math.inf
+                return
+            price, amount = ob.asks.price(0), ob.asks.amount(0)
+            self.rate = (1-fee) / price
+            self.capacity = amount * price
+        self.price = price
+        self.book = ob
+        self.weight = -math.log(self.rate) if self.rate > 0 else math.inf
+
+    def to_dict(self):
+        if self.is_transfer:
+            return {'transfer': True}
+        return {
+            'exchange': self.exchange.name,
+            'symbol': self.symbol,
+            'side': self.side,
+            'price': self.price,
+        }
+
+
+class Cycle:
+    __slots__ = ('edges', 'weight')
+
+    def __init__(self, edges: List[Edge]):
+        self.edges = tuple(edges)
+        self.weight = math.inf
+
+    def refresh(self) -> float:
+        weight = 0.0
+        for e in self.edges:
+            weight += e.weight
+        self.weight = weight
+        return weight
+
+    @property
+    def profit_rate(self):
+        return math.exp(-self.weight) - 1
+
+    def start_amount(self) -> float:
+        """
+        the most currency of the first node the top levels of all books on the cycle can take
+        """
+        amount = math.inf
+        rate = 1.0  # of the first currency into the currency entering the edge
+        for e in self.edges:
+            amount = min(amount, e.capacity / rate)
+            rate *= e.rate
+        return amount
+
+    def is_fresh(self) -> bool:
+        for e in self.edges:
+            if e.book is not None and e.exchange.book_age(e.book) >= e.exchange.book_max_age:
+                return False
+        return True
+
+    def to_dict(self):
+        return {
+            'profit_rate': self.profit_rate,
+            'start_amount': self.start_amount(),
+            'path': [e.to_dict() for e in self.edges],
+        }
+
+
+class RateGraph:
+    def __init__(self, exchanges: List[BaseExchange], cross_exchange=None, max_cycle=None):
+        """
+        :param cross_exchange: link the same currency of different exchanges
+        :param max_cycle: longest cycle indexed for the incremental check
+        """
+        self.exchanges = list(exchanges)
+        if cross_exchange is None:
+            cross_exchange = settings.GRAPH_CROSS_EXCHANGE
+        self.cross_exchange = cross_exchange
+        self.max_cycle = max_cycle or settings.GRAPH_MAX_CYCLE
+        self.min_weight = -math.log(1 + settings.ARBITRAGE_OPPORTUNITY_RATE)
+        self.logger = get_logger('RateGraph')
+        self.is_running = False
+        self._wakeup = None
+        self._node_d = {}  # (exchange name, currency): node
+        self._nodes = []  # node: (exchange name, currency)
+        self._out_l = []  # node: [Edge]
+        self._book_edge_d = {}  # (exchange name, symbol): (sell Edge, buy Edge)
+        self._edge_cycle_d = {}  # Edge: [Cycle]
+        self._cycles = []
+        self._profitable_s = set()  # Cycle, reported once until it closes
+        self.update_hist = registry.histogram('graph_update_seconds')
+        self.scan_hist = registry.histogram('graph_scan_seconds')
+        self.cycle_counter = registry.counter('graph_cycles_total')
+
+    @property
+    def edge_count(self):
+        return sum(len(out) for out in self._out_l)
+
+    def watch(self):
+        """
+        follow every book update of the exchanges, including the books cached already
+        """
+        for e in self.exchanges:
+            if self.on_book not in e.book_listeners:
+                e.book_listeners.append(self.on_book)
+            for ob in list(e._orderbook_d.values()):  # pylint: disable=protected-access
+                if ob:
+                    self.on_book(ob)
+
+    def unwatch(self):
+        for e in self.exchanges:
+            if self.on_book in e.book_listeners:
+                e.book_listeners.remove(self.on_book)
+
+    def _node(self, exchange_name, currency) -> int:
+        key = (exchange_name, currency)
+        node = self._node_d.get(key)
+        if node is None:
+            node = self._node_d[key] = len(self._nodes)
+            self._nodes.append(key)
+            self._out_l.append([])
+            if self.cross_exchange:
+                for other, (_, cur) in enumerate(self._nodes[:-1]):
+                    if cur == currency:
+                        self._add_edge(Edge(node, other))
+                        self._add_edge(Edge(other, node))
+        return node
+
+    def _add_edge(self, edge: Edge):
+        self._out_l[edge.u].append(edge)
+        self._edge_cycle_d[edge] = []
+
+    def _add_book(self, exchange: BaseExchange, symbol):
+        base, quote = split_symbol(symbol)
+        b = self._node(exchange.name, base)
+        q = self._node(exchange.name, quote)
+        edges = (
+            Edge(b, q, exchange, symbol, Order.SIDE_SELL),
+            Edge(q, b, exchange, symbol, Order.SIDE_BUY),
+        )
+        for edge in edges:
+            self._add_edge(edge)
+        self._book_edge_d[(exchange.name, symbol)] = edges
+        self._index_cycles()
+        return edges
+
+    def _index_cycles(self):
+        """
+        enumerate the simple cycles up to max_cycle edges, each once from its smallest node.
+        a cycle does not use a book twice nor two transfers in a row (one transfer does the same)
+        """
+        cycles = []
+        max_cycle = self.max_cycle
+        out_l = self._out_l
+
+        def dfs(start, node, path, visited, books):
+            for e in out_l[node]:
+                if e.is_transfer and path and path[-1].is_transfer:
+                    continue
+                if not e.is_transfer and (e.exchange.name, e.symbol) in books:
+                    continue
+                if e.v == start:
+                    if len(path) >= 1 and not (e.is_transfer and path[0].is_transfer):
+                        cycles.append(Cycle(path + [e]))
+                    continue
+                if e.v < start or e.v in visited or len(path)+1 >= max_cycle:
+                    continue
+                visited.add(e.v)
+                if not e.is_transfer:
+                    books.add((e.exchange.name, e.symbol))
+                dfs(start, e.v, path + [e], visited, books)
+                visited.discard(e.v)
+                if not e.is_transfer:
+                    books.discard((e.exchange.name, e.symbol))
+
+        for start in range(len(self._nodes)):
+            dfs(start, start, [], {start}, set())
+
+        for cycle_l in self._edge_cycle_d.values():
+            del cycle_l[:]
+        for cycle in cycles:
+            cycle.refresh()
+            for e in cycle.edges:
+                self._edge_cycle_d[e].append(cycle)
+        self._cycles = cycles
+        self._profitable_s = set()
+
+    def on_book(self, ob: OrderBook):
+        """
+        book listener: update the two edges of ob and check the indexed cycles through them
+        """
+        t1 = time.perf_counter()
+        edges = self._book_edge_d.get((ob.exchange.name, ob.symbol))
+        if edges is None:
+            edges = self._add_book(ob.exchange, ob.symbol)
+        fee = ob.exchange.market(ob.symbol).taker_fee
+        for edge in edges:
+            weight = edge.weight
+            edge.update(ob, fee)
+            if edge.weight != weight:
+                for cycle in self._edge_cycle_d[edge]:
+                    self._check(cycle)
+        self.update_hist.record(time.perf_counter()-t1)
+
+    def _check(self, cycle: Cycle):
+        if cycle.refresh() < self.min_weight:
+            if cycle not in self._profitable_s and cycle.is_fresh():
+                self._profitable_s.add(cycle)
+                self.report(cycle, source='index')
+        else:
+            self._profitable_s.discard(cycle)
+
+    def report(self, cycle: Cycle, source):
+        self.cycle_counter.inc()
+        self.logger.info(event='found_cycle', source=source, **cycle.to_dict())
+
+    def find_negative_cycle(self) -> Optional[Cycle]:
+        """
+        SPFA from a virtual source linked to every node at weight 0.
+        a node relaxed through n edges closes a negative cycle,
+        found by walking back n predecessors.
+        the first negative cycle is returned, it may be too thin to trade
+        """
+        n = len(self._nodes)
+        if not n:
+            return None
+        dist = [0.0] * n
+        length = [0] * n
+        pred = [None] * n  # node: Edge
+        queue = deque(range(n))
+        in_queue = [True] * n
+        out_l = self._out_l
+        while queue:
+            u = queue.popleft()
+            in_queue[u] = False
+            du = dist[u]
+            for e in out_l[u]:
+                d = du + e.weight
+                v = e.v
+                if d < dist[v] - 1e-12:
+                    dist[v] = d
+                    pred[v] = e
+                    length[v] = length[u] + 1
+                    if length[v] >= n:
+                        return self._walk_cycle(pred, v, n)
+                    if not in_queue[v]:
+                        in_queue[v] = True
+                        queue.append(v)
+        return None
+
+    @staticmethod
+    def _walk_cycle(pred, node, n) -> Optional[Cycle]:
+        for _ in range(n):
+            if pred[node] is None:
+                return None
+            node = pred[node].u
+        edges = []
+        v = node
+        while True:
+            e = pred[v]
+            edges.append(e)
+            v = e.u
+            if v == node:
+                break
+        edges.reverse()
+        return Cycle(edges)
+
+    def scan(self) -> Optional[Cycle]:
+        """
+        full sweep for the cycles longer than the index, reported when profitable enough
+        """
+        t1 = time.perf_counter()
+        cycle = self.find_negative_cycle()
+        self.scan_hist.record(time.perf_counter()-t1)
+        if cycle is not None and cycle.refresh() < self.min_weight and cycle.is_fresh():
+            self.report(cycle, source='scan')
+            return cycle
+        return None
+
+    async def start(self):
+        self.is_running = True
+        self._wakeup = asyncio.Event()
+        self.watch()
+        self.logger.info(event='graph_start', nodes=len(self._nodes), edges=self.edge_count)
+        try:
+            while self.is_running:
+                self.scan()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), settings.GRAPH_SCAN_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.unwatch()
+
+    def close(self):
+        self.is_running = False
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def health(self) -> Dict:
+        return {
+            'nodes': len(self._nodes),
+            'edges': self.edge_count,
+            'cycles': len(self._cycles),
+            'profitable': len(self._profitable_s),
+        }
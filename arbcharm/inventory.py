@@ -0,0 +1,148 @@
+# !/usr/bin/env python
+"""
+free balances of one exchange kept in memory, so sizing an opportunity needs no REST call.
+orders lock funds when placed and move them on every fill, a private stream can push
+balances directly, and a background task reconciles everything against fetch_balance.
+"""
+__author__ = 'Rick Zhang'
+__time__ = '2018/10/12'
+
+import asyncio
+import time
+from typing import Optional, Tuple
+
+from arbcharm import settings
+from arbcharm.metrics import registry
+from arbcharm.tools import LazyModule, get_logger
+
+ccxt_errors = LazyModule('ccxt.base.errors')
+
+SIDE_BUY = 'buy'  # same values as models.Order, which imports this module
+
+
+def split_symbol(symbol) -> Tuple[str, str]:
+    base, quote = symbol.split('/')
+    return base, quote
+
+
+class Inventory:
+    def __init__(self, exchange):
+        """
+        :param exchange: models.BaseExchange
+        """
+        self.exchange = exchange
+        self.logger = get_logger('Inventory-{}'.format(exchange.name))
+        self.free_d = {}  # currency: free amount
+        self.synced_at = None  # time.time() of the last reconcile, None until the first one
+        self._version = 0  # bumped on every local change
+        self._task = None
+        self._wakeup = None  # asyncio.Event, set to reconcile now
+        self.reconcile_counter = registry.counter(
+            'inventory_reconcile_total', exchange=exchange.name)
+        self.stale_counter = registry.counter('inventory_stale_total', exchange=exchange.name)
+
+    def available(self, symbol) -> Optional[Tuple[float, float]]:
+        """
+        :return: (base, quote) free for trading symbol, None before the first reconcile
+        """
+        if self.synced_at is None:
+            return None
+        base, quote = split_symbol(symbol)
+        return self.free_d.get(base, 0.0), self.free_d.get(quote, 0.0)
+
+    def _add(self, currency, amount):
+        self.free_d[currency] = self.free_d.get(currency, 0.0) + amount
+        self._version += 1
+
+    def lock(self, side, symbol, amount, price):
+        """
+        funds held by a newly placed limit order
+        """
+        base, quote = split_symbol(symbol)
+        if side == SIDE_BUY:
+            self._add(quote, -amount * price)
+        else:
+            self._add(base, -amount)
+
+    def unlock(self, side, symbol, amount, price):
+        """
+        funds of the unfilled rest of a finished order
+        """
+        self.lock(side, symbol, -amount, price)
+
+    def fill(self, side, symbol, amount, price):
+        """
+        a locked order got amount filled at price, the taker fee is taken from what is received
+        """
+        base, quote = split_symbol(symbol)
+        fee = self.exchange.market(symbol).taker_fee
+        if side == SIDE_BUY:
+            self._add(base, amount * (1-fee))
+        else:
+            self._add(quote, amount * price * (1-fee))
+
+    def set_balance(self, currency, free):
+        """
+        authoritative balance, e.g. from a private stream
+        """
+        self.free_d[currency] = free
+        self._version += 1
+
+    def request_reconcile(self):
+        """
+        reconcile as soon as possible, e.g. after a market order whose fills are not tracked
+        """
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.ensure_future(self.run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def run(self):
+        while True:
+            await self.reconcile()
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), settings.INVENTORY_RECONCILE_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def reconcile(self):
+        """
+        replace the cache with fetch_balance, unless a local change raced with the request
+        """
+        for _ in range(3):
+            version = self._version
+            try:
+                balance = await self.exchange.ccxt_exchange.fetch_balance()
+            except ccxt_errors.BaseError as e:
+                self.logger.warning(event='fetch_balance_error', error_class=e.__class__.__name__)
+                return
+            if version == self._version:
+                break
+            await asyncio.sleep(settings.INVENTORY_RACE_DELAY)
+        else:
+            return
+
+        free_d = balance.get('free') or {}
+        rest_d = {cur: free for cur, free in free_d.items() if free is not None}
+        if self.synced_at is not None:
+            self.reconcile_counter.inc()
+            diff_d = {}
+            for cur in set(rest_d) | set(self.free_d):
+                rest, cached = rest_d.get(cur, 0.0), self.free_d.get(cur, 0.0)
+                if abs(rest-cached) > max(abs(rest)*settings.INVENTORY_TOLERANCE, 1e-8):
+                    diff_d[cur] = cached - rest
+            if diff_d:
+                self.stale_counter.inc()
+                self.logger.warning(event='inventory_stale', diff=diff_d)
+        self.free_d = rest_d
+        self.synced_at = time.time()
+        self._version += 1
@@ -6,6 +6,10 @@ __time__ = '2018/7/10'
 
 import json
 import logging
+import os
+import queue
+import threading
+import time
 import traceback
 
 
@@ -16,27 +20,39 @@ class JsonLogger(logging.Logger):
         self.propagate = False
 
     def debug(self, msg=None, **kwargs):
+        if not self.isEnabledFor(logging.DEBUG):
+            return None
         msg, _args, _kwargs = self._parse_arge(msg, **kwargs)
         return super().debug(msg, *_args, **_kwargs)
 
     def info(self, msg=None, **kwargs):
+        if not self.isEnabledFor(logging.INFO):
+            return None
         msg, _args, _kwargs = self._parse_arge(msg, **kwargs)
         return super().info(msg, *_args, **_kwargs)
 
     def warning(self, msg=None, **kwargs):
+        if not self.isEnabledFor(logging.WARNING):
+            return None
         msg, _args, _kwargs = self._parse_arge(msg, **kwargs)
         return super().warning(msg, *_args, **_kwargs)
 
     def error(self, msg=None, **kwargs):
+        if not self.isEnabledFor(logging.ERROR):
+            return None
         msg, _args, _kwargs = self._parse_arge(msg, **kwargs)
         return super().error(msg, *_args, **_kwargs)
 
     def exception(self, msg=None, **kwargs):
+        if not self.isEnabledFor(logging.ERROR):
+            return None
         kwargs['traceback'] = traceback.format_exc().splitlines()
         msg, _args, _kwargs = self._parse_arge(msg, **kwargs)
         return super().error(msg, *_args, **_kwargs)
 
     def critical(self, msg=None, **kwargs):
+        if not self.isEnabledFor(logging.CRITICAL):
+            return None
         msg, _args, _kwargs = self._parse_arge(msg, **kwargs)
         return super().critical(msg, *_args, **_kwargs)
 
@@ -48,8 +64,7 @@ class JsonLogger(logging.Logger):
         _kwargs = kwargs.pop('_kwargs', {})
         if msg is not None:
             kwargs['msg'] = msg
-        msg = format_msg(kwargs)
-        return msg, _args, _kwargs
+        return JsonMessage(kwargs), _args, _kwargs
 
     def addHandler(self, hdlr):
         if hasattr(self, 'formaater') and not isinstance(hdlr.formatter, JsonFormatter):
@@ -65,6 +80,99 @@ JsonLogger.manager = json_manager
 JsonLogger.root = root
 
 
+class JsonMessage:
+    """
+    kwargs of a log call, serialized when a handler formats the record.
+    with AsyncLogPipeline that happens on the log thread, so pass values, not live objects.
+    """
+    __slots__ = ('kwargs', '_text')
+
+    def __init__(self, kwargs):
+        self.kwargs = kwargs
+        self._text = None
+
+    def __str__(self):
+        if self._text is None:
+            self._text = format_msg(self.kwargs)
+        return self._text
+
+
+class DroppingQueueHandler(logging.Handler):
+    """
+    put records into a bounded queue without formatting them, count the records that do not fit
+    """
+    def __init__(self, pipeline: "AsyncLogPipeline"):
+        super().__init__()
+        self.pipeline = pipeline
+
+    def emit(self, record):
+        try:
+            self.pipeline.queue.put_nowait(record)
+        except queue.Full:
+            self.pipeline.dropped += 1
+
+
+class AsyncLogPipeline:
+    """
+    one background thread formats and writes the records of every logger.
+    a slow sink fills the queue and records are dropped and counted instead of blocking callers.
+    """
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._handlers_d = {}  # logger name: [handler]
+        self._start()
+        if hasattr(os, 'register_at_fork'):  # the thread does not survive a fork
+            os.register_at_fork(after_in_child=self._start)
+
+    def _start(self):
+        self.queue = queue.Queue(self.maxsize)
+        self.dropped = 0
+        self._reported_dropped = 0
+        self._report_time = 0
+        self._thread = threading.Thread(target=self._run, name='AsyncLogPipeline', daemon=True)
+        self._thread.start()
+
+    def add_handlers(self, name, handlers) -> DroppingQueueHandler:
+        """
+        :return: the handler to add to logger name instead of handlers
+        """
+        self._handlers_d[name] = list(handlers)
+        return DroppingQueueHandler(self)
+
+    def _run(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                return
+            self._handle(record)
+            if self.dropped != self._reported_dropped and (
+                    self.queue.empty() or time.monotonic()-self._report_time > 1):
+                self._handle(logging.makeLogRecord({
+                    'name': record.name,
+                    'levelno': logging.WARNING,
+                    'levelname': 'WARNING',
+                    'msg': JsonMessage({
+                        'event': 'log_records_dropped',
+                        'dropped': self.dropped-self._reported_dropped,
+                        'total_dropped': self.dropped,
+                    }),
+                }))
+                self._reported_dropped = self.dropped
+                self._report_time = time.monotonic()
+
+    def _handle(self, record):
+        for hdlr in self._handlers_d.get(record.name, ()):
+            if record.levelno >= hdlr.level:
+                hdlr.handle(record)
+
+    def stop(self, timeout=None):
+        """
+        write out queued records and stop the thread
+        """
+        self.queue.put(None)
+        self._thread.join(timeout)
+
+
 def get_json_logger(name=None):
     if name:
         return JsonLogger.manager.getLogger(name)
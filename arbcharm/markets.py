@@ -0,0 +1,143 @@
+# !/usr/bin/env python
+"""
+per exchange and symbol trading rules: precision, lot step, minimums and fees.
+loaded once through ccxt load_markets and persisted to settings.MARKET_CACHE_PATH,
+so a restart within MARKET_CACHE_TTL needs no REST call.
+"""
+__author__ = 'Rick Zhang'
+__time__ = '2018/10/12'
+
+import json
+import math
+import os
+import time
+from typing import Dict
+
+from arbcharm import settings
+
+
+class MarketMeta:
+    __slots__ = (
+        'symbol', 'amount_step', 'price_step', 'amount_digits', 'price_digits',
+        'min_amount', 'min_notional', 'maker_fee', 'taker_fee',
+    )
+
+    def __init__(self, *, symbol, amount_digits=None, price_digits=None, min_amount=0.0,
+                 min_notional=0.0, maker_fee=0.0, taker_fee=0.0):
+        """
+        :param amount_digits: decimal places of amounts, None if the exchange does not tell
+        :param price_digits: decimal places of prices
+        """
+        self.symbol = symbol
+        self.amount_digits = amount_digits
+        self.price_digits = price_digits
+        self.amount_step = 10 ** -amount_digits if amount_digits is not None else None
+        self.price_step = 10 ** -price_digits if price_digits is not None else None
+        self.min_amount = min_amount or 0.0
+        self.min_notional = min_notional or 0.0
+        self.maker_fee = maker_fee or 0.0
+        self.taker_fee = taker_fee or 0.0
+
+    @classmethod
+    def from_ccxt(cls, market: dict) -> "MarketMeta":
+        """
+        :param market: one value of ccxt exchange.markets
+        """
+        precision = market.get('precision') or {}
+        limits = market.get('limits') or {}
+        return cls(
+            symbol=market['symbol'],
+            amount_digits=precision.get('amount'),
+            price_digits=precision.get('price'),
+            min_amount=(limits.get('amount') or {}).get('min'),
+            min_notional=(limits.get('cost') or {}).get('min'),
+            maker_fee=market.get('maker'),
+            taker_fee=market.get('taker'),
+        )
+
+    def floor_amount(self, amount) -> float:
+        """
+        round amount down to the lot step
+        """
+        if self.amount_step is None:
+            return amount
+        steps = math.floor(amount / self.amount_step + 1e-9)
+        return round(steps * self.amount_step, self.amount_digits)
+
+    def min_order_amount(self, price) -> float:
+        """
+        the smallest amount the exchange accepts at price
+        """
+        minimum = self.min_amount
+        if self.min_notional and price:
+            minimum = max(minimum, self.min_notional / price)
+        return minimum
+
+    def fix_price(self, price, side) -> float:
+        """
+        round to the price step away from the book: a buy limit up and a sell limit down,
+        so the order still takes the level it was priced at
+        """
+        if self.price_digits is None:
+            return price
+        if side == 'buy':
+            steps = math.ceil(price / self.price_step - 1e-9)
+        else:
+            steps = math.floor(price / self.price_step + 1e-9)
+        return round(steps * self.price_step, self.price_digits)
+
+    def to_dict(self):
+        return {
+            'symbol': self.symbol,
+            'amount_digits': self.amount_digits,
+            'price_digits': self.price_digits,
+            'min_amount': self.min_amount,
+            'min_notional': self.min_notional,
+            'maker_fee': self.maker_fee,
+            'taker_fee': self.taker_fee,
+        }
+
+    def __str__(self):
+        return 'MarketMeta:[{}]'.format(self.to_dict())
+
+
+def load_market_cache(exchange_name, path=None, ttl=None) -> Dict[str, MarketMeta]:
+    """
+    :return: sym: MarketMeta of exchange_name, empty if the file is missing or older than ttl
+    """
+    path = path or settings.MARKET_CACHE_PATH
+    ttl = settings.MARKET_CACHE_TTL if ttl is None else ttl
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as f:
+            entry = json.load(f).get(exchange_name)
+    except (OSError, ValueError):
+        return {}
+    if not entry or time.time() - entry['time'] > ttl:
+        return {}
+    return {sym: MarketMeta(**meta) for sym, meta in entry['markets'].items()}
+
+
+def save_market_cache(exchange_name, market_d: Dict[str, MarketMeta], path=None):
+    """
+    replace the entry of exchange_name, other exchanges in the file are kept
+    """
+    path = path or settings.MARKET_CACHE_PATH
+    if not path:
+        return
+    data = {}
+    if os.path.exists(path):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+    data[exchange_name] = {
+        'time': time.time(),
+        'markets': {sym: meta.to_dict() for sym, meta in market_d.items()},
+    }
+    tmp_path = '{}.{}'.format(path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)  # workers may save at the same time
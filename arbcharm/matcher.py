@@ -0,0 +1,132 @@
+# !/usr/bin/env python
+__author__ = 'Rick Zhang'
+__time__ = '2018/10/12'
+
+import heapq
+from itertools import repeat
+from typing import Dict, List
+
+from arbcharm.models import OrderBook, Trade
+
+
+def crossing_books(ob_l: List[OrderBook], fee_d: Dict = None, rate=0.0) -> List[OrderBook]:
+    """
+    the books whose top of book beats the top of another exchange by more than rate after fees.
+    the trades size_opportunity keeps are never better than the tops they come from,
+    so only these books can take part in them and the others are left out of auto_match.
+    O(n) with the best two tops of each side
+    :param ob_l: books with an up to date OrderBook.top, one per exchange
+    """
+    n = len(ob_l)
+    bid_l = [None] * n  # net best bid
+    ask_l = [None] * n  # net best ask, raised by the rate the bid has to beat
+    for i, ob in enumerate(ob_l):
+        fee = fee_d.get(ob.exchange, 0.0) if fee_d else 0.0
+        bid, _, ask, _ = ob.top
+        if bid is not None:
+            bid_l[i] = bid * (1-fee)
+        if ask is not None:
+            ask_l[i] = ask * (1+fee) * (1+rate)
+
+    best_bid = best_bid2 = best_ask = best_ask2 = None  # indexes of the best two
+    for i in range(n):
+        if bid_l[i] is not None:
+            if best_bid is None or bid_l[i] > bid_l[best_bid]:
+                best_bid, best_bid2 = i, best_bid
+            elif best_bid2 is None or bid_l[i] > bid_l[best_bid2]:
+                best_bid2 = i
+        if ask_l[i] is not None:
+            if best_ask is None or ask_l[i] < ask_l[best_ask]:
+                best_ask, best_ask2 = i, best_ask
+            elif best_ask2 is None or ask_l[i] < ask_l[best_ask2]:
+                best_ask2 = i
+
+    res = []
+    for i, ob in enumerate(ob_l):
+        other_ask = best_ask2 if best_ask == i else best_ask
+        other_bid = best_bid2 if best_bid == i else best_bid
+        if (bid_l[i] is not None and other_ask is not None and bid_l[i] > ask_l[other_ask]) or (
+                ask_l[i] is not None and other_bid is not None and bid_l[other_bid] > ask_l[i]):
+            res.append(ob)
+    return res
+
+
+def auto_match(ob_l: List[OrderBook], fee_d: Dict = None) -> List[Trade]:
+    """
+    orderbook成交函数, 不修改传入的orderbook
+    each side is already sorted, so only the crossable levels are cut out with a binary search
+    and the books are k-way merged instead of re-sorting every row on each tick.
+    with fee_d levels are matched on their price net of taker fee, so the walk pairs
+    the best net bid with the best net ask and the edge of the trades never increases.
+    :param ob_l: 多个交易所和当前的orderbook, 相同价格下放在前面的交易所得到优先成交
+    :param fee_d: exchange: taker fee rate
+    :return: 成交列表, prices of the trades are the raw book prices
+    """
+    books = list(ob_l)
+    fees = [fee_d.get(ob.exchange, 0.0) for ob in books] if fee_d else [0.0] * len(books)
+    ask_tops = [ob.asks.price(0)*(1+fee) for ob, fee in zip(books, fees) if ob.asks]
+    bid_tops = [ob.bids.price(0)*(1-fee) for ob, fee in zip(books, fees) if ob.bids]
+    if not ask_tops or not bid_tops:
+        return []
+    best_ask = min(ask_tops)
+    best_bid = max(bid_tops)
+    if best_bid < best_ask:
+        return []
+
+    bid_streams = []
+    ask_streams = []
+    for ind, (ob, fee) in enumerate(zip(books, fees)):
+        # (net price, exchange priority, amount, price), tuples never tie on the first two fields
+        bid_depth = ob.bids.depth_at(best_ask/(1-fee))
+        if bid_depth:
+            prices, amounts = zip(*ob.bids.levels(bid_depth))
+            net_prices = [p*(1-fee) for p in prices] if fee else prices
+            bid_streams.append(zip(net_prices, repeat(-ind), amounts, prices))
+        ask_depth = ob.asks.depth_at(best_bid/(1+fee))
+        if ask_depth:
+            prices, amounts = zip(*ob.asks.levels(ask_depth))
+            net_prices = [p*(1+fee) for p in prices] if fee else prices
+            ask_streams.append(zip(net_prices, repeat(ind), amounts, prices))
+
+    bid_it = heapq.merge(*bid_streams, reverse=True)  # best bid first
+    ask_it = heapq.merge(*ask_streams)  # best ask first
+
+    trade_l = []
+    bid_net, bid_ind, bid_amount, bid_price = next(bid_it)
+    ask_net, ask_ind, ask_amount, ask_price = next(ask_it)
+    while bid_net >= ask_net:
+        if bid_amount < ask_amount:
+            amount = bid_amount
+            next_bid, next_ask = True, False
+        elif bid_amount == ask_amount:
+            amount = bid_amount
+            next_bid, next_ask = True, True
+        else:
+            amount = ask_amount
+            next_bid, next_ask = False, True
+
+        trade_l.append(
+            Trade(
+                bid_exc=books[-bid_ind].exchange,
+                ask_exc=books[ask_ind].exchange,
+                bid_price=bid_price,
+                ask_price=ask_price,
+                amount=amount,
+            )
+        )
+
+        if next_bid:
+            row = next(bid_it, None)
+            if row is None:
+                break
+            bid_net, bid_ind, bid_amount, bid_price = row
+        else:
+            bid_amount = bid_amount - amount
+        if next_ask:
+            row = next(ask_it, None)
+            if row is None:
+                break
+            ask_net, ask_ind, ask_amount, ask_price = row
+        else:
+            ask_amount = ask_amount - amount
+    return trade_l
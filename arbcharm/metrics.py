@@ -0,0 +1,197 @@
+# !/usr/bin/env python
+"""
+hot-path latency histograms and counters.
+usage:
+    hist = registry.histogram('decode_seconds', exchange='binance')  # keep the instance
+    t1 = time.perf_counter()
+    ...
+    hist.record(time.perf_counter()-t1)
+when disabled every metric is a shared no-op instance.
+"""
+__author__ = 'Rick Zhang'
+__time__ = '2018/10/12'
+
+import asyncio
+import json
+import time
+from typing import Dict
+
+from arbcharm import settings
+
+SUB_BUCKET_BITS = 6  # 64 sub buckets per power of two, < 1.6% relative error
+_LINEAR_LIMIT = 1 << (SUB_BUCKET_BITS+1)
+
+
+def _bucket_index(value: int) -> int:
+    if value < _LINEAR_LIMIT:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS - 1
+    return (
+        _LINEAR_LIMIT + ((shift-1) << SUB_BUCKET_BITS) + (value >> shift) - (1 << SUB_BUCKET_BITS)
+    )
+
+
+def _bucket_value(index: int) -> int:
+    """
+    lowest value of a bucket
+    """
+    if index < _LINEAR_LIMIT:
+        return index
+    shift, sub = divmod(index-_LINEAR_LIMIT, 1 << SUB_BUCKET_BITS)
+    return (sub + (1 << SUB_BUCKET_BITS)) << (shift+1)
+
+
+class Histogram:
+    """
+    HDR-style log-linear histogram of seconds, recorded with microsecond resolution
+    """
+    QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+    def __init__(self, name, labels: Dict):
+        self.name = name
+        self.labels = labels
+        self.bucket_d = {}  # bucket index: count
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        index = _bucket_index(int(seconds*1e6)) if seconds > 0 else 0
+        bucket_d = self.bucket_d
+        bucket_d[index] = bucket_d.get(index, 0) + 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q) -> float:
+        if not self.count:
+            return 0.0
+        rank = q*self.count
+        seen = 0
+        for index in sorted(self.bucket_d):
+            seen += self.bucket_d[index]
+            if seen >= rank:
+                return min(_bucket_value(index)/1e6, self.max)
+        return self.max
+
+    def snapshot(self) -> dict:
+        res = {'count': self.count, 'sum': self.sum, 'max': self.max}
+        for q in self.QUANTILES:
+            res['p{}'.format(q*100).rstrip('0').rstrip('.')] = self.quantile(q)
+        return res
+
+    def reset(self):
+        self.bucket_d = {}
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+
+class Counter:
+    def __init__(self, name, labels: Dict):
+        self.name = name
+        self.labels = labels
+        self.value = 0
+
+    def inc(self, value=1):
+        self.value += value
+
+    def snapshot(self):
+        return self.value
+
+
+class _NullMetric:
+    count = 0
+    value = 0
+
+    def record(self, seconds):
+        pass
+
+    def inc(self, value=1):
+        pass
+
+    def snapshot(self):
+        return None
+
+    def reset(self):
+        pass
+
+
+NULL_METRIC = _NullMetric()
+
+
+class MetricsRegistry:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.metric_d = {}  # (name, labels): metric
+
+    def _get(self, metric_cls, name, labels):
+        if not self.enabled:
+            return NULL_METRIC
+        key = (name, tuple(sorted(labels.items())))
+        metric = self.metric_d.get(key)
+        if metric is None:
+            metric = self.metric_d[key] = metric_cls(name, labels)
+        return metric
+
+    def histogram(self, name, **labels) -> Histogram:
+        return self._get(Histogram, name, labels)
+
+    def counter(self, name, **labels) -> Counter:
+        return self._get(Counter, name, labels)
+
+    def snapshot(self) -> list:
+        return [
+            {'name': m.name, 'labels': m.labels, 'value': m.snapshot()}
+            for m in self.metric_d.values()
+        ]
+
+    def render_text(self) -> str:
+        """
+        prometheus-like text exposition
+        """
+        lines = []
+        for m in self.metric_d.values():
+            labels = ','.join('{}="{}"'.format(k, v) for k, v in sorted(m.labels.items()))
+            if isinstance(m, Counter):
+                lines.append('{}{{{}}} {}'.format(m.name, labels, m.value))
+                continue
+            sep = ',' if labels else ''
+            for q in Histogram.QUANTILES:
+                lines.append('{}{{{}{}quantile="{}"}} {:.6f}'.format(
+                    m.name, labels, sep, q, m.quantile(q)))
+            lines.append('{}_count{{{}}} {}'.format(m.name, labels, m.count))
+            lines.append('{}_sum{{{}}} {:.6f}'.format(m.name, labels, m.sum))
+            lines.append('{}_max{{{}}} {:.6f}'.format(m.name, labels, m.max))
+        return '\n'.join(lines) + '\n'
+
+    async def serve(self, host='127.0.0.1', port=None):
+        """
+        plain HTTP endpoint, any request gets the text exposition
+        """
+        async def handle(reader, writer):
+            try:
+                await reader.readline()
+                body = self.render_text().encode()
+                writer.write(
+                    b'HTTP/1.0 200 OK\r\nContent-Type: text/plain; charset=utf-8\r\n'
+                    + 'Content-Length: {}\r\n\r\n'.format(len(body)).encode() + body
+                )
+                await writer.drain()
+            finally:
+                writer.close()
+
+        return await asyncio.start_server(handle, host, port or settings.METRICS_PORT)
+
+    async def dump_periodically(self, path, interval=None):
+        """
+        write a json snapshot to path every interval seconds
+        """
+        while True:
+            await asyncio.sleep(interval or settings.METRICS_SNAPSHOT_INTERVAL)
+            with open(path, 'w') as f:
+                json.dump({'time': time.time(), 'metrics': self.snapshot()}, f)
+
+
+registry = MetricsRegistry(enabled=settings.METRICS_ENABLED)
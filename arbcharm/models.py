@@ -4,46 +4,399 @@ __time__ = '2018/10/12'
 
 import asyncio
 import time
-from typing import Dict, List
-
-import ccxt.async_support as ccxt
-from arbcharm.tools import get_logger
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from typing import Dict, List, Optional, Tuple
+
+from arbcharm import settings
+from arbcharm.clock import ClockEstimator
+from arbcharm.exchange_api.codec import get_codec
+from arbcharm.exchange_api.connection import WsConnection
+from arbcharm.exchange_api.registry import get_ccxt_class, get_exchange_class
+from arbcharm.exchange_api.session import api_origins, make_http_session, warm_origin
+from arbcharm.inventory import Inventory
+from arbcharm.markets import MarketMeta, load_market_cache, save_market_cache
+from arbcharm.metrics import registry
+from arbcharm.store import get_store
+from arbcharm.tools import (
+    LazyModule, get_logger, is_clock_simulated, monotonic, now, rate_limit_generator,
+)
+
+ccxt_errors = LazyModule('ccxt.base.errors')
 
 
 class BaseExchange:
+    max_symbol_per_conn = 20
+
     def __init__(self, name, config: Dict):
         self.name = name
         self.logger = get_logger(self.name)
-        self.ccxt_exchange = getattr(ccxt, self.name)(config)
+        self.config = config
+        self._ccxt_exchange = None
+        self.http_session = None
+        self._http_user_s = set()
+        self._http_warm_task = None
+        self.codec = get_codec()
         self._orderbook_d = {}
-        self.alert_event_dict = {}  # sym: event
+        self._book_engine_d = {}  # sym: OrderBook, updated in place
+        self.recorder = None  # arbcharm.replay.FeedRecorder
+        self._conn_l = []  # shared WsConnection
+        self._down_since_d = {}  # sym: monotonic time the book became unavailable
+        self.warm_start_rate_limit = rate_limit_generator()
+        self.warm_start_rate_limit.send(None)
+        self.downtime_stat = {'count': 0, 'total': 0, 'max': 0, 'last': 0}
+        self.frame_hist = registry.histogram('frame_handle_seconds', exchange=name)
+        self.decode_hist = registry.histogram('decode_seconds', exchange=name)
+        self.frame_counter = registry.counter('frames_total', exchange=name)
+        self._book_update_counter_d = {}  # sym: Counter
+        # called with the book on every set_book, e.g. graph.RateGraph.on_book
+        self.book_listeners = []
+        store = get_store()
+        if store is not None:
+            self.book_listeners.append(store.on_book)
+        self.trade_counter = registry.counter('trades_total', exchange=name)
+        # trades which removed levels
+        self.prune_counter = registry.counter('trade_prunes_total', exchange=name)
+        self.pruned_level_counter = registry.counter('trade_pruned_levels_total', exchange=name)
+        self._watched_order_d = {}  # oid: arbcharm.execution.TrackedOrder
+        self.market_d = {}  # sym: MarketMeta
+        self.inventory = Inventory(self)
+        self.clock = ClockEstimator(name)
+        self.book_max_age = settings.BOOK_MAX_AGE.get(name, settings.BOOK_MAX_AGE_DEFAULT)
+        self._market_task = None
+
+    @property
+    def ccxt_exchange(self):
+        """
+        created on first use in the running loop, with our pooled session instead of ccxt's own
+        """
+        if self._ccxt_exchange is None:
+            self.http_session = make_http_session()
+            ccxt_cls = get_ccxt_class(self.name)
+            self._ccxt_exchange = ccxt_cls(dict(self.config, session=self.http_session))
+        return self._ccxt_exchange
 
-    def set_book(self, ob: "OrderBook"):
-        if ob.symbol in self.alert_event_dict:
-            self.alert_event_dict[ob.symbol].set()
+    def start_http(self, user):
+        """
+        keep the REST connections warm, and the balances reconciled in prd,
+        while any user (an ArbCharm) is running
+        """
+        self._http_user_s.add(user)
+        if self._http_warm_task is None:
+            self._http_warm_task = asyncio.ensure_future(self.keep_http_warm())
+        if settings.MODE == 'prd':
+            self.inventory.start()
+
+    async def stop_http(self, user):
+        self._http_user_s.discard(user)
+        if self._http_user_s:
+            return
+        if self._http_warm_task is not None:
+            self._http_warm_task.cancel()
+            self._http_warm_task = None
+        self.inventory.stop()
+        if self.http_session is not None:
+            await self.http_session.close()
+            self.http_session = None
+            self._ccxt_exchange = None
+
+    async def keep_http_warm(self):
+        """
+        open HTTP_WARM_CONNECTIONS connections to every api host at startup and touch them
+        more often than servers drop idle keep-alive connections
+        """
+        origins = api_origins(self.ccxt_exchange.urls.get('api'))
+        while True:
+            t1 = time.perf_counter()
+            results = await asyncio.gather(
+                *[
+                    warm_origin(self.http_session, origin)
+                    for origin in origins
+                    for _ in range(settings.HTTP_WARM_CONNECTIONS)
+                ],
+                return_exceptions=True
+            )
+            errors = [r for r in results if isinstance(r, Exception)]
+            if errors:
+                self.logger.warning(
+                    event='http_warm_error',
+                    errors=len(errors),
+                    error_class=errors[0].__class__.__name__,
+                )
+            self.logger.debug(event='http_warm', origins=origins, cost=time.perf_counter()-t1)
+            await asyncio.sleep(settings.HTTP_WARM_INTERVAL)
+
+    async def load_markets(self):
+        """
+        fill market_d once, from the cache file or ccxt load_markets.
+        safe to await from every charm.
+        """
+        if self._market_task is None:
+            self._market_task = asyncio.ensure_future(self._load_markets())
+        await self._market_task
+
+    async def _load_markets(self):
+        market_d = load_market_cache(self.name)
+        if market_d:
+            self.market_d.update(market_d)
+            self.logger.info(event='markets_loaded', source='cache', count=len(market_d))
+            return
+        try:
+            markets = await self.ccxt_exchange.load_markets()
+        except ccxt_errors.BaseError as e:
+            # an outdated cache is still better than the config fallback
+            market_d = load_market_cache(self.name, ttl=float('inf'))
+            self.market_d.update(market_d)
+            self.logger.exception(
+                event='load_markets_error',
+                error_class=e.__class__.__name__,
+                cache_count=len(market_d),
+            )
+            return
+        market_d = {sym: MarketMeta.from_ccxt(m) for sym, m in markets.items()}
+        self.market_d.update(market_d)
+        save_market_cache(self.name, market_d)
+        self.logger.info(event='markets_loaded', source='rest', count=len(market_d))
+
+    def market(self, symbol) -> MarketMeta:
+        """
+        trading rules of symbol,
+        falls back to the min_amount of the config if markets are not loaded
+        """
+        meta = self.market_d.get(symbol)
+        if meta is None:
+            meta = MarketMeta(symbol=symbol, min_amount=self.config.get('min_amount'))
+            self.market_d[symbol] = meta
+        return meta
+
+    def set_book(self, ob: "OrderBook", event_time=None):
+        """
+        publish ob after an update
+        :param event_time: exchange time of the update in seconds, if the message carries one
+        """
+        ob.touch()
+        ob.recv_time = monotonic()
+        ob.event_time = event_time
+        if event_time is not None:
+            ob.latency = self.clock.add_event(event_time, now())
+        else:
+            ob.latency = self.clock.latency
         self._orderbook_d[ob.symbol] = ob
+        counter = self._book_update_counter_d.get(ob.symbol)
+        if counter is None:
+            counter = self._book_update_counter_d[ob.symbol] = registry.counter(
+                'book_updates_total', exchange=self.name, symbol=ob.symbol,
+            )
+        counter.inc()
+        if self._down_since_d:
+            self._record_recovery(ob.symbol)
+        for listener in self.book_listeners:
+            listener(ob)
+        get_book_notifier(ob.symbol).notify()
+
+    def on_trade(self, symbol, price, event_time=None) -> int:
+        """
+        a public trade printed at price: levels better than price are stale and pruned from the
+        published book in place. the book is not republished, pruning can only remove opportunities
+        :param event_time: exchange time of the trade in seconds
+        :return: number of removed levels
+        """
+        if event_time is not None:
+            self.clock.add_event(event_time, now())
+        self.trade_counter.inc()
+        ob = self._orderbook_d.get(symbol)
+        if not ob:
+            return 0
+        removed = ob.remove_bad_price(price)
+        if removed:
+            ob.touch()
+            self.prune_counter.inc()
+            self.pruned_level_counter.inc(removed)
+        return removed
+
+    def book_age(self, ob: "OrderBook") -> float:
+        """
+        seconds since the exchange produced the data of ob: local age plus the one-way latency
+        """
+        return monotonic() - ob.recv_time + ob.latency
+
+    def mark_down(self, symbols):
+        """
+        the books of symbols are lost until the stream or a REST snapshot brings them back
+        """
+        down_since = monotonic()
+        for symbol in symbols:
+            self._down_since_d.setdefault(symbol, down_since)
+            self.clear_book(symbol)
+
+    def _record_recovery(self, symbol):
+        down_since = self._down_since_d.pop(symbol, None)
+        if down_since is None:
+            return
+        downtime = monotonic() - down_since
+        stat = self.downtime_stat
+        stat['count'] += 1
+        stat['total'] += downtime
+        stat['max'] = max(stat['max'], downtime)
+        stat['last'] = downtime
+        self.logger.info(event='book_recovered', symbol=symbol, downtime=downtime, **stat)
+
+    async def warm_start(self, symbol):
+        """
+        seed the book from a REST depth snapshot while the stream catches up.
+        the snapshot is dropped if the stream delivered a newer book first.
+        a flapping connection resubscribes often: a fresh book is kept and a symbol gets
+        one snapshot per WARM_START_INTERVAL at most
+        """
+        if is_clock_simulated():
+            return
+        ob = self.get_book(symbol)
+        if ob is not None and self.book_age(ob) < self.book_max_age:
+            return
+        if not self.warm_start_rate_limit.send((symbol, settings.WARM_START_INTERVAL)):
+            return
+        try:
+            snapshot = await self.ccxt_exchange.fetch_order_book(
+                symbol, settings.CACHE_ORDER_ROW_LENGTH)
+        except ccxt_errors.BaseError as e:
+            self.logger.exception(
+                event='warm_start_error', symbol=symbol, error_class=e.__class__.__name__,
+            )
+            return
+        ob = self.book_engine(symbol)
+        sequence = snapshot.get('nonce')
+        if ob.asks or ob.bids:
+            if sequence is None or ob.sequence is None or sequence <= ob.sequence:
+                return
+        ob.load(asks=snapshot['asks'], bids=snapshot['bids'])
+        ob.sequence = sequence
+        self.set_book(ob)
 
     def get_book(self, symbol) -> "OrderBook":
         return self._orderbook_d.get(symbol)
 
     def clear_book(self, symbol):
         self._orderbook_d[symbol] = None
+        if symbol in self._book_engine_d:
+            self._book_engine_d[symbol].clear()
 
-    async def wait_book_update(self, symbol):
-        event = self.alert_event_dict.get(symbol)
-        if not event:
-            self.alert_event_dict[symbol] = asyncio.Event()
-        await self.alert_event_dict[symbol].wait()
+    def book_engine(self, symbol) -> "OrderBook":
+        """
+        the in-place orderbook of symbol, call set_book with it after every update
+        """
+        ob = self._book_engine_d.get(symbol)
+        if ob is None:
+            ob = OrderBook(exchange=self, symbol=symbol)
+            self._book_engine_d[symbol] = ob
+        return ob
 
-    def reset_book_update(self, symbol):
-        self.alert_event_dict[symbol].clear()
+    def record_frame(self, source, frame):
+        if self.recorder is not None:
+            self.recorder.write(self.name, source, frame)
+
+    def record_subscribe(self, source, symbol):
+        if self.recorder is not None:
+            self.recorder.write_subscribe(self.name, source, symbol)
+
+    def record_snapshot(self, symbol, snapshot):
+        if self.recorder is not None:
+            self.recorder.write_snapshot(self.name, symbol, snapshot)
 
     async def set_orderbook_d(self, symbol):
+        """
+        subscribe symbol on one of the shared connections of this exchange
+        """
+        if symbol in self._orderbook_d:
+            return
+        self.mark_down([symbol])
+
+        conn_l = [c for c in self._conn_l if len(c.symbols) < self.max_symbol_per_conn]
+        if conn_l:
+            conn = min(conn_l, key=lambda c: len(c.symbols))
+        else:
+            conn = WsConnection(self, '{}#{}'.format(self.name, len(self._conn_l)))
+            self._conn_l.append(conn)
+            conn.start()
+        await conn.subscribe(symbol)
+
+    async def remove_orderbook_d(self, symbol):
+        for conn in list(self._conn_l):
+            if symbol not in conn.symbols:
+                continue
+            await conn.unsubscribe(symbol)
+            if not conn.symbols:
+                self._conn_l.remove(conn)
+                await conn.close()
+        self._orderbook_d.pop(symbol, None)
+        self._book_engine_d.pop(symbol, None)
+        self._down_since_d.pop(symbol, None)
+
+    def ws_url(self) -> str:
+        raise NotImplementedError()
+
+    def register_symbol(self, conn: WsConnection, symbol):
+        """
+        prepare demultiplexing of symbol on conn, no I/O
+        """
+        raise NotImplementedError()
+
+    async def send_subscribe(self, conn: WsConnection, symbol):
+        raise NotImplementedError()
+
+    async def send_unsubscribe(self, conn: WsConnection, symbol):
+        raise NotImplementedError()
+
+    def decode(self, frame):
+        t1 = time.perf_counter()
+        msg = self.decode_frame(frame)
+        self.decode_hist.record(time.perf_counter()-t1)
+        return msg
+
+    def decode_frame(self, frame):
+        return self.codec.loads(frame)
+
+    async def handle_frame(self, conn: WsConnection, frame) -> bool:
+        """
+        decode one raw websocket frame and update the books of the symbols it belongs to
+        :param conn: conn.ws is None on replay
+        :return: False if the connection should be reconnected
+        """
         raise NotImplementedError()
 
+    async def keepalive(self, conn: WsConnection):
+        pass
+
     async def cancel_all(self):
         raise NotImplementedError()
 
+    def available(self, symbol) -> Optional[Tuple[float, float]]:
+        """
+        :return: (base, quote) free for trading symbol, None while the balance is unknown
+        """
+        return self.inventory.available(symbol)
+
+    def on_balance_update(self, currency, free):
+        """
+        called by an adapter's private stream with the free balance of currency
+        """
+        self.inventory.set_balance(currency, free)
+
+    def watch_order(self, tracked_order):
+        self._watched_order_d[tracked_order.oid] = tracked_order
+
+    def unwatch_order(self, oid):
+        self._watched_order_d.pop(oid, None)
+
+    def on_order_update(self, info: dict):
+        """
+        called by an adapter's private stream with a ccxt order structure,
+        wakes up the execution engine instead of waiting for the next poll
+        """
+        tracked_order = self._watched_order_d.get(info.get('id'))
+        if tracked_order is not None:
+            tracked_order.update(info)
+
     def __str__(self):
         return self.name
 
@@ -54,17 +407,7 @@ def _get_exchange_factory():
 
     def _get_exchange(name, config) -> BaseExchange:
         if name not in single_instance:
-            if name == 'bitfinex':
-                from arbcharm.exchange_api.bitfinex import Bitfinex
-                exc_cls = Bitfinex
-            elif name == 'huobipro':
-                from arbcharm.exchange_api.huobipro import HuoBiPro
-                exc_cls = HuoBiPro
-            elif name == 'binance':
-                from arbcharm.exchange_api.binance import Binance
-                exc_cls = Binance
-            else:
-                exc_cls = BaseExchange
+            exc_cls = get_exchange_class(name) or BaseExchange
             single_instance[name] = exc_cls(name, config)
         return single_instance[name]
 
@@ -74,7 +417,67 @@ def _get_exchange_factory():
 get_exchange = _get_exchange_factory()
 
 
+class BookNotifier:
+    """
+    book update signal of one symbol, shared by all exchanges.
+    bursts are coalesced, so at most one evaluation is pending at a time,
+    and the time of the first update since the last wait is kept for latency metrics.
+    """
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self._event = asyncio.Event()
+        self._first_update_time = None
+        self.update_count = 0
+        self.coalesced_count = 0
+
+    def notify(self):
+        self.update_count += 1
+        if self._first_update_time is None:
+            self._first_update_time = monotonic()
+            self._event.set()
+        else:
+            self.coalesced_count += 1
+
+    @property
+    def pending(self) -> bool:
+        return self._first_update_time is not None
+
+    def take(self) -> float:
+        """
+        mark pending updates as seen
+        :return: tools.monotonic time of the first update not seen yet
+        """
+        self._event.clear()
+        first_update_time, self._first_update_time = self._first_update_time, None
+        return first_update_time
+
+    async def wait(self) -> float:
+        """
+        wait for a book update of any exchange
+        :return: tools.monotonic time of the first update not seen yet
+        """
+        await self._event.wait()
+        return self.take()
+
+
+def _get_book_notifier_factory():
+
+    notifier_d = {}
+
+    def _get_book_notifier(symbol) -> BookNotifier:
+        if symbol not in notifier_d:
+            notifier_d[symbol] = BookNotifier(symbol)
+        return notifier_d[symbol]
+
+    return _get_book_notifier
+
+
+get_book_notifier = _get_book_notifier_factory()
+
+
 class Trade:
+    __slots__ = ('bid_exc', 'ask_exc', 'bid_price', 'ask_price', 'amount')
+
     def __init__(
             self,
             *,
@@ -99,13 +502,20 @@ class Trade:
         self.amount = amount
 
     def __str__(self):
-        return 'Trade:[{}]'.format(self.__dict__)
+        return 'Trade:[{}]'.format(self.to_dict())
 
     def to_dict(self):
-        return self.__dict__
+        return {
+            'bid_exc': self.bid_exc.name,
+            'ask_exc': self.ask_exc.name,
+            'bid_price': self.bid_price,
+            'ask_price': self.ask_price,
+            'amount': self.amount,
+        }
 
 
 class Order:
+    __slots__ = ('exc', 'symbol', 'side', 'price', 'amount', 'otype')
     SIDE_BUY = 'buy'
     SIDE_SELL = 'sell'
 
@@ -119,35 +529,258 @@ class Order:
         self.otype = otype
 
     def to_dict(self):
-        return self.__dict__
+        return {
+            'exc': self.exc.name,
+            'symbol': self.symbol,
+            'side': self.side,
+            'price': self.price,
+            'amount': self.amount,
+            'otype': self.otype,
+        }
 
     def __str__(self):
         return 'Order:[{}]'.format(self.to_dict())
 
 
-class OrderRow:
-    def __init__(self, *, price: float, amount: float, count: int):
-        self.price = price
-        self.count = count
-        self.amount = amount
+class OrderRow(namedtuple('OrderRow', ('price', 'amount', 'count'))):
+    """
+    one price level, immutable: books are changed through BookSide.set_level
+    """
+    __slots__ = ()
+
+
+class BookSide:
+    """
+    one side of an orderbook, kept best price first.
+    prices, amounts and counts live in contiguous parallel arrays and are updated in place.
+    bids store negated prices as the search key, so both sides are ascending for bisect.
+    levels before _head were pruned by trades: pruning only moves the head [O(logn), no copy],
+    the dead prefix is reused by the next better level or dropped when it grows too long.
+    indexing returns a fresh OrderRow, the side itself is a read-only view for readers.
+    """
+    __slots__ = ('_sign', '_keys', '_amounts', '_counts', '_head')
+
+    def __init__(self, *, reverse: bool):
+        """
+        :param reverse: True for bids (high to low), False for asks (low to high)
+        """
+        self._sign = -1.0 if reverse else 1.0
+        self._keys = array('d')
+        self._amounts = array('d')
+        self._counts = array('l')
+        self._head = 0
+
+    def __len__(self):
+        return len(self._keys) - self._head
+
+    def __bool__(self):
+        return len(self._keys) > self._head
+
+    def _index(self, index) -> int:
+        if index < 0:
+            index += len(self)
+            if index < 0:
+                raise IndexError('BookSide index out of range')
+        return self._head + index
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        i = self._index(index)
+        return OrderRow(self._keys[i]*self._sign, self._amounts[i], self._counts[i])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def price(self, index) -> float:
+        return self._keys[self._index(index)]*self._sign
+
+    def amount(self, index) -> float:
+        return self._amounts[self._index(index)]
+
+    def levels(self, depth=None):
+        """
+        :param depth: only the first depth levels
+        :return: iterator of (price, amount), best price first
+        """
+        sign = self._sign
+        head = self._head
+        stop = len(self._keys) if depth is None else head + depth
+        return zip((k*sign for k in self._keys[head:stop]), self._amounts[head:stop])
+
+    def top(self, depth):
+        """
+        :return: (prices, amounts) lists of the first depth levels, best price first
+        """
+        head = self._head
+        keys = self._keys[head:head+depth]
+        prices = keys.tolist() if self._sign > 0 else [-k for k in keys]
+        return prices, self._amounts[head:head+depth].tolist()
+
+    def depth_at(self, price: float) -> int:
+        """
+        searchsorted: number of levels priced at or better than price
+        """
+        return bisect_right(self._keys, price*self._sign, self._head) - self._head
+
+    def clear(self):
+        del self._keys[:]
+        del self._amounts[:]
+        del self._counts[:]
+        self._head = 0
+
+    def load(self, rows, cast=None):
+        """
+        replace the whole side with a snapshot
+        :param rows: iterable of [price, amount] or [price, amount, count], sorted best price first
+        :param cast: optional converter for price and amount, e.g. float for string payloads
+        """
+        self.clear()
+        keys, amounts, counts = self._keys, self._amounts, self._counts
+        sign = self._sign
+        for row in rows:
+            if cast is None:
+                keys.append(row[0]*sign)
+                amounts.append(row[1])
+            else:
+                keys.append(cast(row[0])*sign)
+                amounts.append(cast(row[1]))
+            counts.append(1)
+
+    def set_level(self, price: float, amount: float, count: int = 1):
+        """
+        insert or replace one price level [O(logn) search + memmove]
+        """
+        keys = self._keys
+        key = price*self._sign
+        head = self._head
+        ind = bisect_left(keys, key, head)
+        if ind < len(keys) and keys[ind] == key:
+            self._amounts[ind] = amount
+            self._counts[ind] = count
+        elif ind == head and head:
+            # a new best level takes the slot of the last pruned one, nothing moves
+            self._head = head = head - 1
+            keys[head] = key
+            self._amounts[head] = amount
+            self._counts[head] = count
+        else:
+            if head > len(keys) - head:
+                self._compact()
+                ind -= head
+            keys.insert(ind, key)
+            self._amounts.insert(ind, amount)
+            self._counts.insert(ind, count)
+
+    def remove_level(self, price: float) -> bool:
+        keys = self._keys
+        key = price*self._sign
+        ind = bisect_left(keys, key, self._head)
+        if ind < len(keys) and keys[ind] == key:
+            if ind == self._head:
+                self._head += 1
+            else:
+                del keys[ind]
+                del self._amounts[ind]
+                del self._counts[ind]
+            return True
+        return False
+
+    def better_than(self, price: float) -> List[float]:
+        """
+        prices of the levels remove_better_than(price) drops
+        """
+        head = self._head
+        return self.top(bisect_left(self._keys, price*self._sign, head) - head)[0]
+
+    def remove_better_than(self, price: float) -> int:
+        """
+        drop levels which are better than price (they can not exist after a trade at price).
+        only the head moves [O(logn)]
+        :return: number of removed levels
+        """
+        head = self._head
+        ind = bisect_left(self._keys, price*self._sign, head)
+        self._head = ind
+        return ind - head
+
+    def truncate(self, depth: int):
+        stop = self._head + depth
+        del self._keys[stop:]
+        del self._amounts[stop:]
+        del self._counts[stop:]
+
+    def _compact(self):
+        head = self._head
+        del self._keys[:head]
+        del self._amounts[:head]
+        del self._counts[:head]
+        self._head = 0
 
 
 class OrderBook:
+    """
+    incremental orderbook, one instance per exchange and symbol is updated in place.
+    """
+    __slots__ = (
+        'exchange', 'symbol', 'asks', 'bids', 'sequence', 'event_time', 'recv_time', 'latency',
+        'version', 'top',
+    )
+
     def __init__(
             self,
             *,
             exchange: BaseExchange,
             symbol: str,
-            asks: List[OrderRow],
-            bids: List[OrderRow],
-            timestamp: float
+            asks: List[OrderRow] = (),
+            bids: List[OrderRow] = (),
+            recv_time: float = None
     ):
         self.exchange = exchange
         self.symbol = symbol
-        self.asks = asks
-        self.bids = bids
-        self.timestamp = timestamp if timestamp else time.time()
+        self.asks = BookSide(reverse=False)
+        self.bids = BookSide(reverse=True)
+        self.sequence = None  # exchange update id of the current state, if the exchange has one
+        for side, rows in ((self.asks, asks), (self.bids, bids)):
+            for row in rows:
+                side.set_level(row.price, row.amount, row.count)
+        self.event_time = None  # exchange time of the current state, if the exchange sends one
+        self.recv_time = recv_time if recv_time else monotonic()  # tools.monotonic
+        self.latency = 0.0  # estimated one-way latency of the current state
+        self.version = 0  # bumped by touch on every published change
+        # (best bid, bid amount, best ask, ask amount), prices None on an empty side
+        self.top = None
+        self.touch()
+
+    def touch(self):
+        """
+        after a change: bump the version and refresh the top of book summary
+        """
+        self.version += 1
+        bids, asks = self.bids, self.asks
+        self.top = (
+            bids.price(0) if bids else None,
+            bids.amount(0) if bids else 0.0,
+            asks.price(0) if asks else None,
+            asks.amount(0) if asks else 0.0,
+        )
+
+    def load(self, *, asks, bids, cast=None):
+        """
+        replace both sides with a snapshot
+        """
+        self.asks.load(asks, cast)
+        self.bids.load(bids, cast)
 
-    def remove_bad_price(self, price):
-        self.asks = [row for row in self.asks if row.price >= price]
-        self.bids = [row for row in self.bids if row.price <= price]
+    def clear(self):
+        self.asks.clear()
+        self.bids.clear()
+        self.sequence = None
+
+    def remove_bad_price(self, price) -> int:
+        """
+        a trade printed at price, so no ask below it and no bid above it can still rest on the book
+        :return: number of removed levels
+        """
+        return self.asks.remove_better_than(price) + self.bids.remove_better_than(price)
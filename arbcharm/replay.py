@@ -0,0 +1,208 @@
+# !/usr/bin/env python
+"""
+record raw websocket frames and replay them through the exchange handlers offline.
+usage: python -m arbcharm.replay feed.rec [--speed 1]
+"""
+__author__ = 'Rick Zhang'
+__time__ = '2018/10/12'
+
+import argparse
+import asyncio
+import json
+import struct
+import time
+from typing import Iterator
+
+from arbcharm.charm import ArbCharm
+from arbcharm.exchange_api.connection import WsConnection
+from arbcharm.models import get_book_notifier, get_exchange
+from arbcharm.tools import get_logger, now, rate_limit_generator, set_clock
+
+# recv_time, len(exchange), len(source connection), payload kind, len(payload)
+FRAME_HEADER = struct.Struct('<dBBBI')
+KIND_TEXT = 0
+KIND_BYTES = 1
+KIND_SUBSCRIBE = 2  # payload is the symbol attached to the source connection
+KIND_SNAPSHOT = 3  # payload is the json {'symbol', 'bids', 'asks', 'nonce'} of a REST book snapshot
+SNAPSHOT_SOURCE = 'rest'
+
+
+class Frame:
+    __slots__ = ('recv_time', 'exchange', 'source', 'kind', 'payload')
+
+    def __init__(self, recv_time, exchange, source, kind, payload):
+        self.recv_time = recv_time
+        self.exchange = exchange
+        self.source = source
+        self.kind = kind
+        self.payload = payload
+
+
+class FeedRecorder:
+    """
+    append-only frame file, shared by all exchanges of a process
+    """
+    def __init__(self, path, buffering=1 << 16):
+        self.path = path
+        self._file = open(path, 'ab', buffering=buffering)
+        self.frame_count = 0
+        self._flush_limit = rate_limit_generator()
+        self._flush_limit.send(None)
+
+    def write(self, exchange, source, frame):
+        if isinstance(frame, str):
+            self._write(exchange, source, KIND_TEXT, frame.encode())
+        else:
+            self._write(exchange, source, KIND_BYTES, frame)
+
+    def write_subscribe(self, exchange, source, symbol):
+        self._write(exchange, source, KIND_SUBSCRIBE, symbol.encode())
+
+    def write_snapshot(self, exchange, symbol, snapshot):
+        """
+        the REST snapshot is part of the feed: diff events recorded after it only apply to it
+        """
+        payload = json.dumps({
+            'symbol': symbol,
+            'bids': snapshot['bids'],
+            'asks': snapshot['asks'],
+            'nonce': snapshot.get('nonce'),
+        })
+        self._write(exchange, SNAPSHOT_SOURCE, KIND_SNAPSHOT, payload.encode())
+
+    def _write(self, exchange, source, kind, payload):
+        exchange, source = exchange.encode(), source.encode()
+        self._file.write(
+            FRAME_HEADER.pack(now(), len(exchange), len(source), kind, len(payload))
+            + exchange + source + payload
+        )
+        self.frame_count += 1
+        if self._flush_limit.send(('flush', 1)):
+            self._file.flush()
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def read_frames(path) -> Iterator[Frame]:
+    """
+    a partly written frame at the end of file is ignored
+    """
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(FRAME_HEADER.size)
+            if len(header) < FRAME_HEADER.size:
+                return
+            recv_time, exc_len, src_len, kind, payload_len = FRAME_HEADER.unpack(header)
+            names = f.read(exc_len+src_len)
+            payload = f.read(payload_len)
+            if len(payload) < payload_len:
+                return
+            if kind != KIND_BYTES:
+                payload = payload.decode()
+            exchange, source = names[:exc_len].decode(), names[exc_len:].decode()
+            yield Frame(recv_time, exchange, source, kind, payload)
+
+
+class FeedReplayer:
+    """
+    feed recorded frames into the exchange handlers and evaluate ArbCharm on a simulated clock.
+    no order is placed and no REST request is sent, snapshots come from the feed.
+    """
+    def __init__(self, path, speed=0.0):
+        """
+        :param speed: 0 replays as fast as possible, 1 at recorded speed, 2 twice as fast...
+        """
+        self.path = path
+        self.speed = speed
+        self.logger = get_logger('FeedReplayer')
+        self.sim_time = 0.0
+        self.charm_d = {}  # sym: ArbCharm
+        self.conn_d = {}  # (exchange name, source): WsConnection
+
+    def get_connection(self, exchange, source) -> WsConnection:
+        """
+        a detached connection (never started, ws is None) per recorded source
+        """
+        key = (exchange.name, source)
+        if key not in self.conn_d:
+            self.conn_d[key] = WsConnection(exchange, source)
+        return self.conn_d[key]
+
+    def attach(self, conn, symbol):
+        conn.attach(symbol)
+        charm = self.charm_d.get(symbol)
+        if charm is None:
+            charm = self.charm_d[symbol] = ArbCharm(symbol, [])
+        if conn.exchange not in charm.exchanges:
+            charm.exchanges.append(conn.exchange)
+
+    async def run(self) -> dict:
+        set_clock(lambda: self.sim_time)
+        frame_count = 0
+        evaluation_count = 0
+        opportunity_count = 0
+        first_recv_time = None
+        start = time.monotonic()
+        try:
+            for frame in read_frames(self.path):
+                exchange = get_exchange(frame.exchange, {})
+                if frame.kind == KIND_SUBSCRIBE:
+                    self.attach(self.get_connection(exchange, frame.source), frame.payload)
+                    continue
+
+                if first_recv_time is None:
+                    first_recv_time = frame.recv_time
+                if self.speed:
+                    delay = (frame.recv_time-first_recv_time)/self.speed - (time.monotonic()-start)
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                self.sim_time = frame.recv_time
+                if frame.kind == KIND_SNAPSHOT:
+                    snapshot = json.loads(frame.payload)
+                    symbols = (snapshot['symbol'],)
+                    exchange.apply_snapshot(snapshot['symbol'], snapshot)
+                else:
+                    conn = self.get_connection(exchange, frame.source)
+                    await exchange.handle_frame(conn, frame.payload)
+                    symbols = conn.symbols
+                frame_count += 1
+
+                for symbol in symbols:
+                    notifier = get_book_notifier(symbol)
+                    if notifier.pending:
+                        evaluation_count += 1
+                        if self.charm_d[symbol].evaluate(notifier.take()):
+                            opportunity_count += 1
+        finally:
+            set_clock()
+
+        cost = time.monotonic() - start
+        res = {
+            'frames': frame_count,
+            'evaluations': evaluation_count,
+            'opportunities': opportunity_count,
+            # evaluations which ran auto_match
+            'matched': sum(c.match_hist.count for c in self.charm_d.values()),
+            'wall_seconds': cost,
+            'feed_seconds': self.sim_time-first_recv_time if first_recv_time else 0,
+            'ticks_per_second': frame_count/cost if cost else 0,
+        }
+        self.logger.info(event='replay_done', **res)
+        return res
+
+
+def main():
+    parser = argparse.ArgumentParser(description='replay a recorded feed through ArbCharm')
+    parser.add_argument('path')
+    parser.add_argument('--speed', type=float, default=0.0, help='0 for as fast as possible')
+    args = parser.parse_args()
+    lp = asyncio.get_event_loop()
+    lp.run_until_complete(FeedReplayer(args.path, args.speed).run())
+
+
+if __name__ == '__main__':
+    main()
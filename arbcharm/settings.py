@@ -6,12 +6,140 @@ import os
 
 MODE = os.getenv('ARBCHARM_MODE', 'test')  # or prd
 
-ARBITRAGE_OPPORTUNITY_RATE = 0.004
+# format and write logs on a background thread
+LOG_ASYNC = os.getenv('ARBCHARM_LOG_ASYNC', '1') == '1'
+
+LOG_QUEUE_SIZE = 10000  # records beyond this are dropped and counted
+
+ARBITRAGE_OPPORTUNITY_RATE = 0.004  # profit rate left after the taker fees of both sides
 
 ARBCHARM_AMOUNT_MULTIPLIER = 0.01
 
 CACHE_ORDER_ROW_LENGTH = 20
 
+BITFINEX_BOOK_CHECKSUM = True  # verify the crc32 of the top 25 levels sent after every book update
+
+BITFINEX_BOOK_PREC = os.getenv('ARBCHARM_BITFINEX_PREC', 'P0')  # or R0, raw orders by id
+
+# seconds checksums wait for the exchange to delete the levels a trade pruned
+BITFINEX_PRUNE_GRACE = 1
+
+BITFINEX_RESUBSCRIBE_DELAY = 10  # seconds before a channel the exchange refused is subscribed again
+
+# diff stream on a REST snapshot instead of the top 20 levels
+BINANCE_DIFF_DEPTH = os.getenv('ARBCHARM_BINANCE_DIFF_DEPTH', '0') == '1'
+
+BINANCE_BOOK_DEPTH = 1000  # levels per side of the snapshot and the local diff book, 5000 at most
+
+BINANCE_DIFF_BUFFER = 1000  # diff events kept while the snapshot loads
+
+BINANCE_SNAPSHOT_INTERVAL = 1  # seconds between two snapshot requests of a symbol
+
+BOOK_MAX_AGE_DEFAULT = 1  # seconds since the exchange produced a book before it is ignored
+
+BOOK_MAX_AGE = {
+    'binance': 1,
+    'huobipro': 1,
+    'bitfinex': 1,
+}
+
+# triangular / cross-quote scan over all books
+GRAPH_ENABLED = os.getenv('ARBCHARM_GRAPH', '0') == '1'
+
+GRAPH_CROSS_EXCHANGE = True  # a currency held on several exchanges links their books
+
+GRAPH_MAX_CYCLE = 4  # longest cycle checked on every book update, longer ones wait for the sweep
+
+GRAPH_SCAN_INTERVAL = 1  # seconds between full negative cycle sweeps
+
+CLOCK_WINDOW = 256  # samples of the clock offset estimators
+
+MARKET_CACHE_PATH = os.getenv('ARBCHARM_MARKET_CACHE', 'markets.json')  # empty disables the file
+
+MARKET_CACHE_TTL = 24 * 3600
+
+JSON_CODEC = os.getenv('ARBCHARM_JSON_CODEC', 'auto')  # auto, orjson, ujson or json
+
+RECORD_PATH = os.getenv('ARBCHARM_RECORD_PATH')  # record raw websocket frames for replay
+
+STORE_PATH = os.getenv('ARBCHARM_STORE_PATH')  # columnar store of books, opportunities and orders
+
+STORE_BOOK_DEPTH = 5  # levels per side of the stored book snapshots
+
+STORE_BATCH_ROWS = 10000  # rows of one table buffered before a write
+
+STORE_FLUSH_INTERVAL = 1  # seconds, buffered rows are written at least this often while appending
+
+STORE_SEGMENT_SECONDS = 3600  # time span of one segment directory
+
+METRICS_ENABLED = os.getenv('ARBCHARM_METRICS', '1') == '1'
+
+METRICS_PORT = int(os.getenv('ARBCHARM_METRICS_PORT', '0'))  # 0 disables the text endpoint
+
+METRICS_SNAPSHOT_PATH = os.getenv('ARBCHARM_METRICS_SNAPSHOT_PATH')  # periodic json snapshot
+
+METRICS_SNAPSHOT_INTERVAL = 10
+
+RECONNECT_BASE_DELAY = 0.05  # seconds, doubled on every failure with full jitter
+
+RECONNECT_MAX_DELAY = 10
+
+CIRCUIT_BREAKER_FAILURES = 8  # consecutive failures before the breaker opens
+
+CIRCUIT_BREAKER_COOLDOWN = 60
+
+RECONNECT_HEALTHY_TIME = 30  # seconds a connection stays up before its backoff starts over
+
+WARM_START_INTERVAL = 30  # seconds between two REST snapshots a resubscribe asks for a symbol
+
+WORKER_NUM = int(os.getenv('ARBCHARM_WORKERS', '0'))  # 0 runs every symbol in this process
+
+WORKER_HEARTBEAT_INTERVAL = 5
+
+WORKER_HEARTBEAT_TIMEOUT = 30
+
+WORKER_RESTART_BASE_DELAY = 1  # seconds before a dead worker is started again, doubled per crash
+
+WORKER_RESTART_MAX_DELAY = 60
+
+WORKER_RESTART_COOLDOWN = 300  # after CIRCUIT_BREAKER_FAILURES crashes in a row
+
+HTTP_POOL_SIZE = 10  # connections per api host kept by the shared connector
+
+HTTP_KEEPALIVE_TIMEOUT = 60  # seconds an idle pooled connection is kept on our side
+
+HTTP_DNS_CACHE_TTL = 300
+
+HTTP_WARM_CONNECTIONS = 2  # connections per api host opened ahead of the first order
+
+HTTP_WARM_INTERVAL = 20  # below the idle timeout of the exchanges' load balancers
+
+HTTP_WARM_TIMEOUT = 5
+
+INVENTORY_RECONCILE_INTERVAL = 30  # seconds between fetch_balance reconciles
+
+INVENTORY_TOLERANCE = 0.001  # relative difference from fetch_balance counted as stale
+
+INVENTORY_RACE_DELAY = 0.5  # retry delay when fills raced with fetch_balance
+
+ORDER_TIMEOUT = 3  # seconds an order may rest before the unfilled part is cancelled
+
+ORDER_POLL_INTERVAL = 0.2  # fetch_order interval while no private stream update arrives
+
+ORDER_CANCEL_RETRIES = 5  # failed cancels before the order is left to the balance reconcile
+
+EXPOSURE_LIMIT = {  # notional in quote currency of orders in flight per exchange and symbol
+    'binance': 2000,
+    'huobipro': 2000,
+    'bitfinex': 2000,
+}
+
+ORDER_RATE_LIMIT = {  # orders per second of each exchange, shared by all workers
+    'binance': 10,
+    'huobipro': 10,
+    'bitfinex': 1.5,
+}
+
 ARB_CONF = {
     'BTC/USDT': {
         'binance': {
@@ -0,0 +1,436 @@
+# !/usr/bin/env python
+"""
+append-only columnar store of book snapshots, opportunities and orders for offline research.
+a table is cut into segments by time, a segment is a directory with one file of fixed-width values
+per column, so a reader maps a column and scans it without parsing or copying.
+rows are buffered on the loop and written in batches by a background thread.
+layout: <settings.STORE_PATH>/<table>/<segment start>-<pid>/<column>.bin and schema.json
+usage:
+    reader = StoreReader('/data/arbcharm')
+    for cols in reader.scan('book', start=t1, end=t2, exchange='binance'):
+        cols['time'], cols['bid_price'][:, 0] ...
+"""
+__author__ = 'Rick Zhang'
+__time__ = '2018/10/12'
+
+import json
+import math
+import mmap
+import os
+import queue
+import threading
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterator, List
+
+from arbcharm import settings
+from arbcharm.tools import get_logger, now, rate_limit_generator
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+_TYPECODE_D = {'f8': 'd', 'i8': 'q'}  # numpy dtype: array typecode of the numeric columns
+
+
+class Column:
+    __slots__ = ('name', 'dtype', 'count')
+
+    def __init__(self, name, dtype, count=1):
+        """
+        :param dtype: numpy dtype string, 'f8', 'i8' or 'S<width>' for zero padded bytes
+        :param count: values per row, e.g. the depth of a book side
+        """
+        self.name = name
+        self.dtype = dtype
+        self.count = count
+
+    @property
+    def width(self):
+        """
+        bytes per row
+        """
+        return (int(self.dtype[1:]) if self.dtype[0] == 'S' else 8) * self.count
+
+    def encode(self, values: list) -> bytes:
+        if self.dtype[0] == 'S':
+            width = int(self.dtype[1:])
+            return b''.join(v.encode()[:width].ljust(width, b'\0') for v in values)
+        return array(_TYPECODE_D[self.dtype], values).tobytes()
+
+    def to_list(self):
+        return [self.name, self.dtype, self.count]
+
+
+def _book_columns(depth):
+    return [
+        Column('time', 'f8'),
+        Column('exchange', 'S16'),
+        Column('symbol', 'S16'),
+        Column('event_time', 'f8'),  # nan if the exchange does not send one
+        Column('latency', 'f8'),
+        Column('bid_price', 'f8', depth),  # nan beyond the depth of the book
+        Column('bid_amount', 'f8', depth),
+        Column('ask_price', 'f8', depth),
+        Column('ask_amount', 'f8', depth),
+    ]
+
+
+OPPORTUNITY_COLUMNS = [  # one row per leg
+    Column('time', 'f8'),
+    Column('opportunity_id', 'i8'),
+    Column('symbol', 'S16'),
+    Column('exchange', 'S16'),
+    Column('side', 'S4'),
+    Column('amount', 'f8'),
+    Column('price', 'f8'),
+    Column('vwap', 'f8'),
+    Column('profit', 'f8'),
+    Column('edge', 'f8'),
+]
+
+ORDER_COLUMNS = [
+    Column('time', 'f8'),
+    Column('exchange', 'S16'),
+    Column('symbol', 'S16'),
+    Column('side', 'S4'),
+    Column('oid', 'S32'),
+    Column('status', 'S8'),
+    Column('price', 'f8'),
+    Column('amount', 'f8'),
+    Column('filled', 'f8'),
+    Column('average', 'f8'),
+    Column('duration', 'f8'),
+]
+
+
+class _TableBuffer:
+    """
+    rows of one table not handed to the writer yet, kept per column
+    """
+    __slots__ = ('columns', 'values_l', 'row_count')
+
+    def __init__(self, columns: List[Column]):
+        self.columns = columns
+        self.values_l = [[] for _ in columns]
+        self.row_count = 0
+
+    def append(self, row):
+        for col, values, value in zip(self.columns, self.values_l, row):
+            if col.count == 1:
+                values.append(value)
+            else:
+                values.extend(value)
+        self.row_count += 1
+
+    def take(self):
+        values_l, self.values_l = self.values_l, [[] for _ in self.columns]
+        self.row_count = 0
+        return values_l
+
+
+class TickStore:
+    def __init__(self, root, book_depth=None):
+        self.root = root
+        self.book_depth = book_depth or settings.STORE_BOOK_DEPTH
+        self.logger = get_logger('TickStore')
+        self.schema_d = {
+            'book': _book_columns(self.book_depth),
+            'opportunity': OPPORTUNITY_COLUMNS,
+            'order': ORDER_COLUMNS,
+        }
+        self._opportunity_count = 0
+        self._flush_limit = rate_limit_generator()
+        self._flush_limit.send(None)
+        self._start()
+        if hasattr(os, 'register_at_fork'):  # the thread does not survive a fork
+            os.register_at_fork(after_in_child=self._start)
+
+    def _start(self):
+        self._buffer_d = {table: _TableBuffer(columns) for table, columns in self.schema_d.items()}
+        self.queue = queue.Queue()
+        self.written_rows = 0
+        self.error_count = 0
+        self._last_time_d = {}  # table: time of the last written row
+        self._thread = threading.Thread(target=self._run, name='TickStore', daemon=True)
+        self._thread.start()
+
+    def append(self, table, row):
+        """
+        :param row: values in the column order of the table, time first
+        """
+        buf = self._buffer_d[table]
+        buf.append(row)
+        if buf.row_count >= settings.STORE_BATCH_ROWS:
+            self.flush()
+        elif self._flush_limit.send(('flush', settings.STORE_FLUSH_INTERVAL)):
+            self.flush()
+
+    def on_book(self, ob):
+        """
+        book listener: top book_depth levels of both sides
+        """
+        depth = self.book_depth
+        bid_prices, bid_amounts = ob.bids.top(depth)
+        ask_prices, ask_amounts = ob.asks.top(depth)
+        for values in (bid_prices, bid_amounts, ask_prices, ask_amounts):
+            if len(values) < depth:
+                values.extend([math.nan] * (depth-len(values)))
+        self.append('book', (
+            now(),
+            ob.exchange.name,
+            ob.symbol,
+            math.nan if ob.event_time is None else ob.event_time,
+            ob.latency,
+            bid_prices,
+            bid_amounts,
+            ask_prices,
+            ask_amounts,
+        ))
+
+    def append_opportunity(self, opportunity):
+        """
+        :param opportunity: evaluator.Opportunity
+        """
+        self._opportunity_count += 1
+        opportunity_id = (os.getpid() << 32) + self._opportunity_count
+        t = now()
+        for leg in opportunity.leg_d.values():
+            self.append('opportunity', (
+                t, opportunity_id, opportunity.symbol, leg.exchange.name, leg.side,
+                leg.amount, leg.price, leg.vwap, opportunity.profit, opportunity.edge,
+            ))
+
+    def append_order(self, t):
+        """
+        :param t: execution.TrackedOrder, when it is done
+        """
+        o = t.order
+        duration = t.done_at - t.placed_at if t.done_at and t.placed_at else None
+        self.append('order', (
+            now(), o.exc.name, o.symbol, o.side, str(t.oid or ''), t.status,
+            o.price, o.amount, t.filled,
+            math.nan if t.average is None else t.average,
+            math.nan if duration is None else duration,
+        ))
+
+    def flush(self, wait=False):
+        """
+        hand the buffered rows to the writer thread
+        :param wait: block until they are on disk, e.g. on exit
+        """
+        for table, buf in self._buffer_d.items():
+            if buf.row_count:
+                self.queue.put((table, buf.take()))
+        if wait:
+            self.queue.join()
+
+    def _run(self):
+        while True:
+            table, values_l = self.queue.get()
+            try:
+                self._write(table, values_l)
+            except Exception:  # pylint: disable=broad-except
+                # the batch is lost, the thread must live on or flush(wait=True) never returns.
+                # the columns of a segment may differ in length now, later rows go to a new one
+                self.error_count += 1
+                self.logger.exception(event='store_write_error', table=table)
+            finally:
+                self.queue.task_done()
+
+    def _order_times(self, table, times):
+        """
+        the wall clock may step back, time is kept ascending per table as the readers search it
+        """
+        last = self._last_time_d.get(table, -math.inf)
+        clamped = 0
+        for i, t in enumerate(times):
+            if t < last:
+                times[i] = last
+                clamped += 1
+            else:
+                last = t
+        self._last_time_d[table] = last
+        if clamped:
+            self.logger.warning(event='store_clock_backwards', table=table, rows=clamped)
+
+    def _write(self, table, values_l):
+        columns = self.schema_d[table]
+        times = values_l[0]
+        self._order_times(table, times)
+        seconds = settings.STORE_SEGMENT_SECONDS
+        lo = 0
+        while lo < len(times):
+            segment_start = int(times[lo] // seconds * seconds)
+            hi = bisect_left(times, segment_start + seconds, lo)
+            # encode every column first, a bad value must not leave the segment half written
+            data_l = [
+                col.encode(values[lo*col.count:hi*col.count])
+                for col, values in zip(columns, values_l)
+            ]
+            path = self._segment_path(table, segment_start, columns)
+            for col, data in zip(columns, data_l):
+                with open(os.path.join(path, col.name + '.bin'), 'ab') as f:
+                    f.write(data)
+            self.written_rows += hi - lo
+            lo = hi
+
+    def _segment_path(self, table, segment_start, columns):
+        name = '{}-{}'.format(segment_start, os.getpid())
+        if self.error_count:
+            name = '{}-{}'.format(name, self.error_count)
+        path = os.path.join(self.root, table, name)
+        if not os.path.isdir(path):
+            os.makedirs(path, exist_ok=True)
+            with open(os.path.join(path, 'schema.json'), 'w') as f:
+                json.dump({'start': segment_start, 'columns': [c.to_list() for c in columns]}, f)
+        return path
+
+
+def _get_store_factory():
+
+    store_d = {}
+
+    def _get_store():
+        """
+        :return: the TickStore of settings.STORE_PATH, None when the store is disabled
+        """
+        if not settings.STORE_PATH:
+            return None
+        if 'store' not in store_d:
+            store_d['store'] = TickStore(settings.STORE_PATH)
+        return store_d['store']
+
+    return _get_store
+
+
+get_store = _get_store_factory()
+
+
+class Segment:
+    """
+    read-only view of one segment, the columns are memory-mapped.
+    a column is a numpy array when numpy is installed, else a memoryview (numeric columns only)
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'schema.json')) as f:
+            schema = json.load(f)
+        self.start = schema['start']
+        self.columns = [Column(*c) for c in schema['columns']]
+        self._mmap_d = {}
+        # a batch is written column by column, so a crash can leave the last rows partial
+        self.row_count = min(self._size(c) // c.width for c in self.columns)
+
+    def _size(self, col):
+        try:
+            return os.path.getsize(os.path.join(self.path, col.name + '.bin'))
+        except OSError:
+            return 0
+
+    def _map(self, col):
+        mm = self._mmap_d.get(col.name)
+        if mm is None:
+            with open(os.path.join(self.path, col.name + '.bin'), 'rb') as f:
+                mm = self._mmap_d[col.name] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return mm
+
+    def column(self, name):
+        col = next(c for c in self.columns if c.name == name)
+        if not self.row_count:
+            return [] if numpy is None else numpy.empty(0, dtype=col.dtype)
+        mm = self._map(col)
+        size = self.row_count * col.width
+        if numpy is not None:
+            arr = numpy.frombuffer(mm, dtype=col.dtype, count=self.row_count*col.count)
+            return arr.reshape(self.row_count, col.count) if col.count > 1 else arr
+        if col.dtype[0] == 'S':
+            raise TypeError('bytes columns need numpy, use Segment.rows')
+        return memoryview(mm)[:size].cast(_TYPECODE_D[col.dtype])
+
+    def time_range(self, start=None, end=None):
+        """
+        :return: (lo, hi) row slice with start <= time < end, time is ascending within a segment
+        """
+        times = self.column('time')
+        if numpy is not None:
+            lo = 0 if start is None else int(numpy.searchsorted(times, start))
+            hi = len(times) if end is None else int(numpy.searchsorted(times, end))
+            return lo, max(lo, hi)
+        lo = 0 if start is None else bisect_left(times, start)
+        hi = len(times) if end is None else bisect_left(times, end, lo)
+        return lo, hi
+
+    def rows(self, lo=0, hi=None) -> Iterator[Dict]:
+        """
+        decoded rows as dicts, slow, for a quick look without numpy
+        """
+        hi = self.row_count if hi is None else hi
+        views = {c.name: memoryview(self._map(c)) for c in self.columns}
+        for i in range(lo, hi):
+            row = {}
+            for c in self.columns:
+                raw = views[c.name][i*c.width:(i+1)*c.width]
+                if c.dtype[0] == 'S':
+                    size = int(c.dtype[1:])
+                    values = [
+                        bytes(raw[j*size:(j+1)*size]).rstrip(b'\0').decode() for j in range(c.count)
+                    ]
+                else:
+                    values = list(raw.cast(_TYPECODE_D[c.dtype]))
+                row[c.name] = values[0] if c.count == 1 else values
+            yield row
+
+    def close(self):
+        for mm in self._mmap_d.values():
+            try:
+                mm.close()
+            except BufferError:  # an array still points into the map, it closes with the last one
+                pass
+        self._mmap_d = {}
+
+
+class StoreReader:
+    def __init__(self, root=None):
+        self.root = root or settings.STORE_PATH
+
+    def segments(self, table, start=None, end=None) -> List[Segment]:
+        """
+        segments of table which may hold rows with start <= time < end, oldest first
+        """
+        table_path = os.path.join(self.root, table)
+        if not os.path.isdir(table_path):
+            return []
+        seconds = settings.STORE_SEGMENT_SECONDS
+        res = []
+        for name in os.listdir(table_path):
+            segment_start = int(name.split('-')[0])
+            if end is not None and segment_start >= end:
+                continue
+            if start is not None and segment_start + seconds <= start:
+                continue
+            res.append((segment_start, name))
+        return [Segment(os.path.join(table_path, name)) for _, name in sorted(res)]
+
+    def scan(self, table, start=None, end=None, exchange=None) -> Iterator[Dict]:
+        """
+        :return: per segment, column name: rows with start <= time < end.
+                 views into the maps, copies when filtered by exchange (needs numpy)
+        """
+        if exchange is not None and numpy is None:
+            raise TypeError('filtering by exchange needs numpy')
+        for seg in self.segments(table, start, end):
+            lo, hi = seg.time_range(start, end)
+            if lo == hi:
+                continue
+            cols = {c.name: seg.column(c.name)[lo:hi] for c in seg.columns
+                    if numpy is not None or c.dtype[0] != 'S'}
+            if exchange is not None:
+                mask = cols['exchange'] == exchange.encode()
+                cols = {name: values[mask] for name, values in cols.items()}
+            yield cols
+
+    def count(self, table, start=None, end=None) -> int:
+        ranges = (seg.time_range(start, end) for seg in self.segments(table, start, end))
+        return sum(hi-lo for lo, hi in ranges)
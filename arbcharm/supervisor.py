@@ -0,0 +1,190 @@
+# !/usr/bin/env python
+"""
+run the symbols of settings.ARB_CONF sharded across worker processes.
+every worker owns its event loop and its get_exchange singletons,
+the supervisor restarts dead or silent workers with backoff and logs an aggregated health view.
+a worker records its frames to RECORD_PATH.<worker id> and scans the graph of its own symbols only.
+"""
+__author__ = 'Rick Zhang'
+__time__ = '2018/10/12'
+
+import asyncio
+import multiprocessing
+import os
+import queue
+import time
+from typing import Dict, List
+
+from arbcharm import settings
+from arbcharm.exchange_api.connection import ReconnectPolicy
+from arbcharm.tools import SharedRateBudget, get_logger, rate_limit_generator
+
+
+def partition_symbols(symbols: List[str], worker_num: int) -> List[List[str]]:
+    shards = [[] for _ in range(min(worker_num, len(symbols)))]
+    for i, sym in enumerate(sorted(symbols)):
+        shards[i % len(shards)].append(sym)
+    return shards
+
+
+def run_worker(worker_id, arb_conf: Dict, rate_budget: SharedRateBudget, health_queue):
+    """
+    entry of a forked worker process
+    """
+    from arbcharm.charm import ArbCharm
+    from arbcharm.metrics import registry
+    from arbcharm.models import get_exchange
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    recorder = None
+    if settings.RECORD_PATH:
+        from arbcharm.replay import FeedRecorder
+        recorder = FeedRecorder('{}.{}'.format(settings.RECORD_PATH, worker_id))
+
+    charms = []
+    exchanges = []
+    for sym, exc_dict in arb_conf.items():
+        excs = [get_exchange(e, config) for e, config in exc_dict.items()]
+        for e in excs:
+            e.recorder = recorder
+            if e not in exchanges:
+                exchanges.append(e)
+        charms.append(ArbCharm(sym, excs, rate_budget))
+    graph = None
+    if settings.GRAPH_ENABLED:
+        from arbcharm.graph import RateGraph
+        # cycles through symbols of other workers are not seen
+        graph = RateGraph(exchanges)
+
+    async def heartbeat():
+        while True:
+            health_queue.put({
+                'worker': worker_id,
+                'pid': os.getpid(),
+                'time': time.time(),
+                'charms': [c.health() for c in charms],
+                'metrics': registry.snapshot(),
+            })
+            await asyncio.sleep(settings.WORKER_HEARTBEAT_INTERVAL)
+
+    asyncio.ensure_future(heartbeat())
+    if settings.METRICS_SNAPSHOT_PATH:
+        path = '{}.{}'.format(settings.METRICS_SNAPSHOT_PATH, worker_id)
+        asyncio.ensure_future(registry.dump_periodically(path))
+    tasks = [c.start() for c in charms]
+    if graph is not None:
+        tasks.append(graph.start())
+    loop.run_until_complete(asyncio.gather(*tasks))
+
+
+class Supervisor:
+    def __init__(self, arb_conf: Dict, worker_num: int):
+        # fork: workers must not re-run the __main__ module of python -m arbcharm
+        self.ctx = multiprocessing.get_context('fork')
+        self.logger = get_logger('Supervisor')
+        self.shards = [
+            {sym: arb_conf[sym] for sym in syms}
+            for syms in partition_symbols(list(arb_conf), worker_num)
+        ]
+        self.rate_budget = SharedRateBudget(settings.ORDER_RATE_LIMIT, ctx=self.ctx)
+        self.health_queue = self.ctx.Queue()
+        self.process_d = {}  # worker_id: Process
+        self.heartbeat_d = {}  # worker_id: last heartbeat
+        self.restart_count_d = {}  # worker_id: count
+        self.start_time_d = {}  # worker_id: time of the last start
+        self.restart_at_d = {}  # worker_id: time a dead worker is started again
+        self.restart_policy_d = {}  # worker_id: ReconnectPolicy
+        self.log_limit = rate_limit_generator()
+        self.log_limit.send(None)
+
+    def start_worker(self, worker_id):
+        proc = self.ctx.Process(
+            target=run_worker,
+            args=(worker_id, self.shards[worker_id], self.rate_budget, self.health_queue),
+            name='arbcharm-worker-{}'.format(worker_id),
+            daemon=True,
+        )
+        proc.start()
+        self.process_d[worker_id] = proc
+        self.start_time_d[worker_id] = time.time()
+        self.heartbeat_d[worker_id] = {'time': time.time(), 'charms': [], 'metrics': []}
+        self.logger.info(
+            event='worker_start',
+            worker=worker_id,
+            pid=proc.pid,
+            symbols=list(self.shards[worker_id]),
+        )
+
+    def restart_policy(self, worker_id) -> ReconnectPolicy:
+        policy = self.restart_policy_d.get(worker_id)
+        if policy is None:
+            policy = self.restart_policy_d[worker_id] = ReconnectPolicy(
+                base_delay=settings.WORKER_RESTART_BASE_DELAY,
+                max_delay=settings.WORKER_RESTART_MAX_DELAY,
+                breaker_cooldown=settings.WORKER_RESTART_COOLDOWN,
+            )
+        return policy
+
+    def on_heartbeat(self, beat):
+        worker_id = beat['worker']
+        self.heartbeat_d[worker_id] = beat
+        up_time = beat['time'] - self.start_time_d.get(worker_id, beat['time'])
+        if up_time > settings.WORKER_HEARTBEAT_TIMEOUT:
+            # up long enough, the next crash starts from the base delay again
+            self.restart_policy(worker_id).reset()
+
+    def check_workers(self):
+        cur_time = time.time()
+        deadline = cur_time - settings.WORKER_HEARTBEAT_TIMEOUT
+        for worker_id, proc in list(self.process_d.items()):
+            restart_at = self.restart_at_d.get(worker_id)
+            if restart_at is not None:
+                if cur_time >= restart_at:
+                    del self.restart_at_d[worker_id]
+                    self.restart_count_d[worker_id] = self.restart_count_d.get(worker_id, 0) + 1
+                    self.start_worker(worker_id)
+                continue
+            silent = self.heartbeat_d[worker_id]['time'] < deadline
+            if proc.is_alive() and not silent:
+                continue
+            if proc.is_alive():
+                proc.terminate()
+            proc.join(timeout=5)
+            # a worker crashing at startup must not become a fork loop
+            delay = self.restart_policy(worker_id).next_delay()
+            self.restart_at_d[worker_id] = cur_time + delay
+            self.logger.error(
+                event='worker_restart', worker=worker_id, pid=proc.pid,
+                exitcode=proc.exitcode, silent=silent, delay=delay,
+            )
+
+    def health(self) -> dict:
+        cur_time = time.time()
+        return {
+            'workers': {
+                worker_id: {
+                    'pid': proc.pid,
+                    'alive': proc.is_alive(),
+                    'restarts': self.restart_count_d.get(worker_id, 0),
+                    'restart_at': self.restart_at_d.get(worker_id),
+                    'heartbeat_age': cur_time-self.heartbeat_d[worker_id]['time'],
+                    'charms': self.heartbeat_d[worker_id]['charms'],
+                    'metrics': self.heartbeat_d[worker_id]['metrics'],
+                }
+                for worker_id, proc in self.process_d.items()
+            },
+        }
+
+    def run(self):
+        for worker_id in range(len(self.shards)):
+            self.start_worker(worker_id)
+        while True:
+            try:
+                self.on_heartbeat(self.health_queue.get(timeout=1))
+            except queue.Empty:
+                pass
+            self.check_workers()
+            if self.log_limit.send(('health', 60)):
+                self.logger.info(event='supervisor_health', **self.health())
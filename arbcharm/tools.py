@@ -2,11 +2,17 @@
 __author__ = 'Rick Zhang'
 __time__ = '2018/10/12'
 
+import atexit
+import functools
+import importlib
 import logging
+import multiprocessing
 import sys
 import time
+from typing import Dict
 
-from arbcharm.json_logger import JsonFormatter, get_json_logger
+from arbcharm import settings
+from arbcharm.json_logger import AsyncLogPipeline, JsonFormatter, get_json_logger
 
 
 def bisect_right(a, x, key=None, lo=0, hi=None, rv=False):  # pylint: disable=too-many-arguments
@@ -63,17 +69,86 @@ def get_logger(name='root'):
         sh_i = logging.StreamHandler(sys.stdout)
         sh_i.setLevel(logging.INFO)
         sh_i.setFormatter(formatter)
-        sh_i.addFilter(LevelFilter(logging.INFO))
+        sh_i.addFilter(LevelFilter(logging.WARNING))
 
         sh_e = logging.StreamHandler(sys.stderr)
         sh_e.setFormatter(formatter)
         sh_e.setLevel(logging.ERROR)
 
-        logger.addHandler(sh_i)
-        logger.addHandler(sh_e)
+        if settings.LOG_ASYNC:
+            logger.addHandler(get_log_pipeline().add_handlers(name, [sh_i, sh_e]))
+        else:
+            logger.addHandler(sh_i)
+            logger.addHandler(sh_e)
     return logger
 
 
+def _get_log_pipeline_factory():
+
+    single_instance = []
+
+    def _get_log_pipeline() -> AsyncLogPipeline:
+        if not single_instance:
+            pipeline = AsyncLogPipeline(settings.LOG_QUEUE_SIZE)
+            atexit.register(pipeline.stop, 5)
+            single_instance.append(pipeline)
+        return single_instance[0]
+
+    return _get_log_pipeline
+
+
+get_log_pipeline = _get_log_pipeline_factory()
+
+
+class LazyModule:
+    """
+    a module imported on first attribute access, for heavy optional imports like ccxt and aiohttp.
+    usage: ccxt_errors = LazyModule('ccxt.base.errors'); except ccxt_errors.BaseError: ...
+    """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+_clock = time.time
+_monotonic_clock = time.monotonic
+
+
+def now() -> float:
+    """
+    wall clock to compare with exchange timestamps, replaced by a simulated clock on replay
+    """
+    return _clock()
+
+
+def monotonic() -> float:
+    """
+    local clock of book receive times and ages, replaced by the same simulated clock on replay
+    """
+    return _monotonic_clock()
+
+
+def is_clock_simulated() -> bool:
+    """
+    True while set_clock replaces the clocks, i.e. on replay: nothing may be asked to an exchange
+    """
+    return _clock is not time.time
+
+
+def set_clock(clock=None):
+    """
+    :param clock: callable returning epoch seconds, None to restore time.time and time.monotonic
+    """
+    global _clock, _monotonic_clock  # pylint: disable=global-statement
+    _clock = clock if clock else time.time
+    _monotonic_clock = clock if clock else time.monotonic
+
+
 def rate_limit_generator():
     """
     usage:
@@ -99,10 +174,65 @@ def rate_limit_generator():
         key, min_time_interval = yield access
 
 
+class SharedRateBudget:
+    """
+    token bucket per key kept in shared memory, so forked workers share one budget.
+    usage:
+        budget = SharedRateBudget({'binance': 10})  # 10 tokens per second
+        budget.acquire('binance')  # True while the budget allows
+    """
+    def __init__(self, rate_d: Dict[str, float], burst_seconds=1.0, ctx=multiprocessing):
+        keys = sorted(rate_d)
+        self._index_d = {k: i for i, k in enumerate(keys)}
+        self._rate_l = [float(rate_d[k]) for k in keys]
+        self._burst_l = [max(1.0, rate_d[k]*burst_seconds) for k in keys]
+        self._state = ctx.Array('d', 2*len(keys))  # [tokens, last refill time] per key
+        for i, burst in enumerate(self._burst_l):
+            self._state[2*i] = burst
+            self._state[2*i+1] = time.monotonic()
+
+    def acquire(self, key, tokens=1.0) -> bool:
+        """
+        a key without configured rate is never limited
+        """
+        return self.acquire_many({key: tokens})
+
+    def acquire_many(self, token_d: Dict[str, float]) -> bool:
+        """
+        take the tokens of every key or none of them, e.g. all legs of one opportunity
+        :return: False if any key lacks tokens, nothing is consumed then
+        """
+        want_l = [(self._index_d[k], tokens) for k, tokens in token_d.items() if k in self._index_d]
+        if not want_l:
+            return True
+        state = self._state
+        with state.get_lock():
+            now_time = time.monotonic()
+            available_l = []
+            for i, tokens in want_l:
+                available = min(
+                    self._burst_l[i],
+                    state[2*i] + (now_time-state[2*i+1])*self._rate_l[i],
+                )
+                state[2*i] = available
+                state[2*i+1] = now_time
+                available_l.append(available)
+            if any(available < tokens for available, (_i, tokens) in zip(available_l, want_l)):
+                return False
+            for available, (i, tokens) in zip(available_l, want_l):
+                state[2*i] = available - tokens
+            return True
+
+
 def print_cost_time(func):
+    """
+    decorator printing the seconds each call of func takes, for ad hoc timing.
+    the benchmarks of the hot path live in benchmarks/suite.py
+    """
+    @functools.wraps(func)
     def _func(*args, **kwargs):
-        t1 = time.time()
+        t1 = time.perf_counter()
         res = func(*args, **kwargs)
-        print(time.time() - t1)
+        print('{} {:.6f}'.format(func.__qualname__, time.perf_counter() - t1))
         return res
-    return _func()
+    return _func
@@ -0,0 +1,83 @@
+# !/usr/bin/env python
+"""
+usage: python -m benchmarks.bench_checksum [messages]
+cpu cost per book message of the bitfinex checksum: the incremental BookChecksum against
+formatting and hashing the 25 levels from scratch. updates land uniformly on books of 25 to 100
+levels per side, the deeper the book the more of them leave the top 25 alone
+"""
+__author__ = 'Rick Zhang'
+__time__ = '2018/10/12'
+
+import random
+import sys
+import time
+import zlib
+
+from arbcharm.exchange_api.bitfinex import BookChecksum, js_number
+from arbcharm.models import OrderBook
+from benchmarks.bench_orderbook import make_bitfinex_frames
+
+
+class _Exchange:
+    name = 'bench'
+
+
+def full_checksum(bid_keys, bid_amounts, ask_keys, ask_amounts):
+    cs = []
+    for i in range(25):
+        if i < len(bid_keys):
+            cs.append(js_number(bid_keys[i]))
+            cs.append(js_number(bid_amounts[i]))
+        if i < len(ask_keys):
+            cs.append(js_number(ask_keys[i]))
+            cs.append(js_number(-ask_amounts[i]))
+    crc = zlib.crc32(':'.join(cs).encode())
+    return crc - 0x100000000 if crc & 0x80000000 else crc
+
+
+def apply(ob, data):
+    if len(data) == 2:
+        ob.clear()
+        for p, c, a in data[1]:
+            (ob.bids if a >= 0 else ob.asks).set_level(p, abs(a), c)
+    else:
+        _chan_id, price, count, amount = data
+        side = ob.bids if amount >= 0 else ob.asks
+        if count == 0:
+            side.remove_level(price)
+        else:
+            side.set_level(price, abs(amount), count)
+
+
+def run(label, frames):
+    ob = OrderBook(exchange=_Exchange(), symbol='BTC/USD')
+    books = []
+    for data in frames:
+        apply(ob, data)
+        books.append(ob.bids.top(25) + ob.asks.top(25))
+
+    cs = BookChecksum()
+    for book in books:
+        assert cs.compute(*book) == full_checksum(*book)
+
+    cost_d = {}
+    for name, func in (('full', full_checksum), ('incremental', BookChecksum().compute)):
+        t1 = time.perf_counter()
+        for book in books:
+            func(*book)
+        cost_d[name] = (time.perf_counter()-t1) / len(books) * 1e6
+    print('{:<12} {:>10.2f} {:>14.2f} {:>8.1f}x'.format(
+        label, cost_d['full'], cost_d['incremental'], cost_d['full']/cost_d['incremental']))
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    random.seed(0)
+    print('{:<12} {:>10} {:>14} {:>9}'.format('book', 'full us', 'incremental us', 'speedup'))
+    run('depth 25', make_bitfinex_frames(n, depth=25))
+    run('depth 50', make_bitfinex_frames(n, depth=50))
+    run('depth 100', make_bitfinex_frames(n, depth=100))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+# !/usr/bin/env python
+"""
+usage: python -m benchmarks.bench_codec
+decode + book update cost per websocket frame, stdlib path against the codec layer
+"""
+__author__ = 'Rick Zhang'
+__time__ = '2018/10/12'
+
+import gzip
+import json
+import random
+import time
+
+from arbcharm.exchange_api.codec import CODEC_CLASSES, GzipDecoder
+from arbcharm.models import OrderBook
+from benchmarks import legacy
+
+
+class _Exchange:
+    name = 'bench'
+
+
+def binance_frames(n, depth=20, mid=6500.0):
+    frames = []
+    for _ in range(n):
+        mid += random.uniform(-1, 1)
+        frames.append(json.dumps({
+            'stream': 'btcusdt@depth20',
+            'data': {
+                'lastUpdateId': 1,
+                'asks': [['%.8f' % (mid+0.01*(i+1)), '%.8f' % random.uniform(0.01, 2), []]
+                         for i in range(depth)],
+                'bids': [['%.8f' % (mid-0.01*(i+1)), '%.8f' % random.uniform(0.01, 2), []]
+                         for i in range(depth)],
+            },
+        }))
+    return frames
+
+
+def huobipro_frames(n, depth=150, mid=6500.0):
+    frames = []
+    for i in range(n):
+        mid += random.uniform(-1, 1)
+        frames.append(gzip.compress(json.dumps({
+            'ch': 'market.btcusdt.depth.step0',
+            'ts': 1539683812143+i,
+            'tick': {
+                'asks': [[round(mid+0.01*(j+1), 2), round(random.uniform(0.01, 2), 4)]
+                         for j in range(depth)],
+                'bids': [[round(mid-0.01*(j+1), 2), round(random.uniform(0.01, 2), 4)]
+                         for j in range(depth)],
+                'ts': 1539683812143+i,
+            },
+        }).encode()))
+    return frames
+
+
+def bitfinex_frames(n, mid=6500.0):
+    frames = []
+    for _ in range(n):
+        amount = random.uniform(0.01, 2)
+        frames.append(json.dumps([
+            17, round(mid+random.uniform(-5, 5), 1), random.randint(0, 3),
+            amount if random.random() < 0.5 else -amount,
+        ]))
+    return frames
+
+
+def timeit(label, func, frames):
+    t1 = time.perf_counter()
+    for frame in frames:
+        func(frame)
+    cost = time.perf_counter() - t1
+    print('{:<36} {:>10.2f} us/frame'.format(label, cost/len(frames)*1e6))
+
+
+def main():
+    random.seed(0)
+    exc = _Exchange()
+    ob = OrderBook(exchange=exc, symbol='BTC/USDT')
+    frame_d = {
+        'binance': binance_frames(5000),
+        'huobipro': huobipro_frames(2000),
+        'bitfinex': bitfinex_frames(50000),
+    }
+
+    def binance_legacy(frame):
+        legacy.binance_book(exc, 'BTC/USDT', json.loads(frame)['data'], 0)
+
+    def huobipro_legacy(frame):
+        tick = json.loads(gzip.decompress(frame).decode())['tick']
+        legacy.OrderBook(
+            exchange=exc,
+            symbol='BTC/USDT',
+            asks=[legacy.OrderRow(price=p, amount=a, count=1) for p, a in tick['asks']],
+            bids=[legacy.OrderRow(price=p, amount=a, count=1) for p, a in tick['bids']],
+            timestamp=tick['ts']/1000,
+        )
+
+    timeit('binance stdlib + rebuild', binance_legacy, frame_d['binance'])
+    timeit('huobipro gzip + stdlib + rebuild', huobipro_legacy, frame_d['huobipro'])
+    timeit('bitfinex stdlib decode', json.loads, frame_d['bitfinex'])
+
+    gzip_decoder = GzipDecoder()
+    for codec_cls in CODEC_CLASSES:
+        try:
+            codec = codec_cls()
+        except ImportError:
+            print('{:<36} not installed'.format(codec_cls.name))
+            continue
+
+        def binance_codec(frame, loads=codec.loads):
+            data = loads(frame)['data']
+            ob.load(asks=data['asks'], bids=data['bids'], cast=float)
+
+        def huobipro_codec(frame, loads=codec.loads):
+            tick = loads(gzip_decoder.decompress(frame))['tick']
+            ob.load(asks=tick['asks'], bids=tick['bids'])
+            ob.event_time = tick['ts']/1000
+
+        timeit('binance {} + engine'.format(codec.name), binance_codec, frame_d['binance'])
+        name = 'huobipro zlib + {} + engine'.format(codec.name)
+        timeit(name, huobipro_codec, frame_d['huobipro'])
+        timeit('bitfinex {} decode'.format(codec.name), codec.loads, frame_d['bitfinex'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+# !/usr/bin/env python
+"""
+usage: python -m benchmarks.bench_depth_stream [ticks]
+binance depth20 partial frames against depth@100ms diff frames of the same simulated book:
+bytes per frame, decode + book update cost per frame through Binance.handle_frame, and depth held
+"""
+__author__ = 'Rick Zhang'
+__time__ = '2018/10/12'
+
+import asyncio
+import json
+import random
+import sys
+import time
+
+from arbcharm.exchange_api.binance import Binance
+
+
+class _Conn:
+    name = 'bench#0'
+    symbols = {'BTC/USDT'}
+
+
+def simulate(ticks, depth=1000, changes=12, mid=6500.0):
+    """
+    a book of depth levels per side at 0.01 steps,
+    every tick changes a few levels, mostly near the top
+    :return: (snapshot, partial frames, diff frames)
+    """
+    bids = {round(mid-0.01*(i+1), 2): random.uniform(0.01, 2) for i in range(depth)}
+    asks = {round(mid+0.01*(i+1), 2): random.uniform(0.01, 2) for i in range(depth)}
+    snapshot = {
+        'nonce': 1, 'bids': sorted(bids.items(), reverse=True), 'asks': sorted(asks.items()),
+    }
+    update_id = 1
+    partial_l, diff_l = [], []
+    for tick in range(ticks):
+        b, a = [], []
+        for _ in range(changes):
+            is_bid = random.random() < 0.5
+            near = random.random() < 0.7
+            off = 0.01 * (random.randint(1, 20) if near else random.randint(21, depth))
+            price = round(mid-off if is_bid else mid+off, 2)
+            amount = 0.0 if random.random() < 0.2 else random.uniform(0.01, 2)
+            (bids if is_bid else asks)[price] = amount
+            (b if is_bid else a).append(['%.8f' % price, '%.8f' % amount])
+        first_id, update_id = update_id + 1, update_id + len(b) + len(a)
+        diff_l.append(json.dumps({
+            'stream': 'btcusdt@depth@100ms',
+            'data': {
+                'e': 'depthUpdate', 'E': 1539683812143 + tick*100, 's': 'BTCUSDT',
+                'U': first_id, 'u': update_id, 'b': b, 'a': a,
+            },
+        }))
+        top_bids = sorted((p for p, q in bids.items() if q), reverse=True)[:20]
+        top_asks = sorted(p for p, q in asks.items() if q)[:20]
+        partial_l.append(json.dumps({
+            'stream': 'btcusdt@depth20',
+            'data': {
+                'lastUpdateId': update_id,
+                'bids': [['%.8f' % p, '%.8f' % bids[p], []] for p in top_bids],
+                'asks': [['%.8f' % p, '%.8f' % asks[p], []] for p in top_asks],
+            },
+        }))
+    return snapshot, partial_l, diff_l
+
+
+def run(label, exchange, frames):
+    conn = _Conn()
+    lp = asyncio.get_event_loop()
+
+    async def apply():
+        for frame in frames:
+            await exchange.handle_frame(conn, frame)
+
+    t1 = time.perf_counter()
+    lp.run_until_complete(apply())
+    cost = (time.perf_counter()-t1) / len(frames)
+    ob = exchange.get_book('BTC/USDT')
+    print('{:<10} {:>12.0f} {:>12.2f} {:>12}'.format(
+        label, sum(len(f) for f in frames)/len(frames), cost*1e6, len(ob.bids)))
+
+
+def main():
+    ticks = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    random.seed(0)
+    snapshot, partial_l, diff_l = simulate(ticks)
+    print('{:<10} {:>12} {:>12} {:>12}'.format('stream', 'bytes/frame', 'us/frame', 'bid levels'))
+
+    partial = Binance('binance', {})
+    partial.register_symbol(_Conn(), 'BTC/USDT')
+    run('depth20', partial, partial_l)
+
+    diff = Binance('binance', {})
+    diff.diff_depth, diff.depth_stream = True, 'depth@100ms'
+    diff.register_symbol(_Conn(), 'BTC/USDT')
+    ob = diff.book_engine('BTC/USDT')
+    ob.load(asks=snapshot['asks'], bids=snapshot['bids'])
+    ob.sequence = snapshot['nonce']
+    run('diff', diff, diff_l)
+
+
+if __name__ == '__main__':
+    main()
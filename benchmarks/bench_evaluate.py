@@ -0,0 +1,50 @@
+# !/usr/bin/env python
+"""
+usage: python -m benchmarks.bench_evaluate
+time of a full evaluation, fee-aware auto_match plus size_opportunity, as exchanges are added,
+and of the crossing_books check which skips it when no top of book crosses
+"""
+__author__ = 'Rick Zhang'
+__time__ = '2018/10/12'
+
+import random
+import time
+
+from arbcharm.evaluator import size_opportunity
+from arbcharm.matcher import auto_match, crossing_books
+from benchmarks.bench_matcher import make_books
+
+
+def main():
+    random.seed(0)
+    print('{:>9} {:>6} {:>8} {:>12} {:>12} {:>12}'.format(
+        'exchanges', 'levels', 'trades', 'match us', 'size us', 'cross us'))
+    for n_exchange in (3, 5, 10, 15, 20):
+        for depth in (20, 100):
+            books = make_books(n_exchange, depth)
+            for ob in books:
+                ob.touch()
+            fee_d = {ob.exchange: random.choice((0.0, 0.0004, 0.001, 0.002)) for ob in books}
+            loops = max(20, 20000//(n_exchange*depth))
+
+            t1 = time.perf_counter()
+            for _ in range(loops):
+                trades = auto_match(books, fee_d)
+            t2 = time.perf_counter()
+            for _ in range(loops):
+                opportunity = size_opportunity('BTC/USDT', trades, fee_d, 0.0001, 0.01)
+            t3 = time.perf_counter()
+            for _ in range(loops):
+                cross_l = crossing_books(books, fee_d, 0.0001)
+            t4 = time.perf_counter()
+            assert opportunity.profit >= 0
+            # the books left out can not change the opportunity
+            part = size_opportunity('BTC/USDT', auto_match(cross_l, fee_d), fee_d, 0.0001, 0.01)
+            assert abs(part.profit - opportunity.profit) < 1e-9
+            print('{:>9} {:>6} {:>8} {:>12.1f} {:>12.1f} {:>12.1f}'.format(
+                n_exchange, depth, len(trades),
+                (t2-t1)/loops*1e6, (t3-t2)/loops*1e6, (t4-t3)/loops*1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+# !/usr/bin/env python
+"""
+usage: python -m benchmarks.bench_graph
+time of the incremental cycle check on one book update and of a full SPFA sweep, as the graph grows
+"""
+__author__ = 'Rick Zhang'
+__time__ = '2018/10/12'
+
+import random
+import time
+
+from arbcharm.graph import RateGraph
+from arbcharm.markets import MarketMeta
+from arbcharm.models import BaseExchange, OrderBook
+
+PRICE_D = {
+    'BTC': 6500.0, 'ETH': 200.0, 'LTC': 50.0, 'XRP': 0.45, 'EOS': 5.5, 'BNB': 10.0, 'USDT': 1.0,
+}
+QUOTES = ('USDT', 'BTC', 'ETH')
+
+
+def make_symbols(n_symbol):
+    """
+    pairs against every quote in turn, so that the first symbols already form triangles
+    """
+    symbols = []
+    for base in PRICE_D:
+        for quote in QUOTES:
+            if base == quote or base in QUOTES[:QUOTES.index(quote)]:
+                continue
+            if len(symbols) < n_symbol:
+                symbols.append('{}/{}'.format(base, quote))
+    return symbols
+
+
+def make_graph(n_exchange, symbols, spread=0.001):
+    exchanges = [BaseExchange('exc{}'.format(i), {}) for i in range(n_exchange)]
+    books = []
+    for e in exchanges:
+        for sym in symbols:
+            e.market_d[sym] = MarketMeta(symbol=sym, taker_fee=0.001)
+            base, quote = sym.split('/')
+            mid = PRICE_D[base] / PRICE_D[quote]
+            ob = OrderBook(exchange=e, symbol=sym)
+            ob.load(asks=[[mid*(1+spread), 1.0]], bids=[[mid*(1-spread), 1.0]])
+            e._orderbook_d[sym] = ob  # pylint: disable=protected-access
+            books.append(ob)
+    graph = RateGraph(exchanges)
+    graph.watch()
+    return graph, books
+
+
+def update(ob, move):
+    ask, bid = ob.asks.price(0)*(1+move), ob.bids.price(0)*(1+move)
+    ob.load(asks=[[ask, random.uniform(0.1, 2)]], bids=[[bid, random.uniform(0.1, 2)]])
+    ob.exchange.set_book(ob)
+
+
+def check_planted():
+    """
+    a cheap ETH/BTC on one exchange must be found by the index and by the sweep
+    """
+    graph, books = make_graph(1, ['BTC/USDT', 'ETH/USDT', 'ETH/BTC'])
+    found = []
+    graph.report = lambda cycle, source: found.append((source, cycle))
+    ob = next(ob for ob in books if ob.symbol == 'ETH/BTC')
+    update(ob, -0.05)
+    assert [source for source, _ in found] == ['index'], found
+    assert graph.scan() is not None and found[-1][0] == 'scan'
+    path = [(e.symbol, e.side) for e in found[0][1].edges]
+    assert ('ETH/BTC', 'buy') in path, path
+
+
+def main():
+    random.seed(0)
+    check_planted()
+    print('{:>9} {:>7} {:>6} {:>6} {:>7} {:>11} {:>11} {:>10}'.format(
+        'exchanges', 'symbols', 'nodes', 'edges', 'cycles', 'update us', 'p99 us', 'sweep us'))
+    for n_exchange, n_symbol in ((1, 6), (3, 6), (3, 12), (5, 12), (8, 15)):
+        graph, books = make_graph(n_exchange, make_symbols(n_symbol))
+        graph.report = lambda cycle, source: None
+        cost_l = []
+        for _ in range(5000):
+            ob = random.choice(books)
+            t1 = time.perf_counter()
+            update(ob, random.uniform(-0.0005, 0.0005))
+            cost_l.append(time.perf_counter()-t1)
+        cost_l.sort()
+
+        loops = 20
+        t1 = time.perf_counter()
+        for _ in range(loops):
+            graph.find_negative_cycle()
+        sweep = (time.perf_counter()-t1) / loops
+
+        health = graph.health()
+        print('{:>9} {:>7} {:>6} {:>6} {:>7} {:>11.1f} {:>11.1f} {:>10.1f}'.format(
+            n_exchange, n_symbol, health['nodes'], health['edges'], health['cycles'],
+            sum(cost_l)/len(cost_l)*1e6, cost_l[int(len(cost_l)*0.99)]*1e6, sweep*1e6))
+
+
+if __name__ == '__main__':
+    main()
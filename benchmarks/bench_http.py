@@ -0,0 +1,88 @@
+# !/usr/bin/env python
+"""
+usage: python -m benchmarks.bench_http
+latency of the first order request on a cold session vs a pre-warmed one,
+against a local https stub of an exchange api (dns + tcp + tls setup vs a pooled connection)
+"""
+__author__ = 'Rick Zhang'
+__time__ = '2018/10/12'
+
+import asyncio
+import os
+import ssl
+import subprocess
+import tempfile
+import time
+
+from aiohttp import web
+from arbcharm.exchange_api.session import make_http_session, warm_origin
+
+
+def make_cert(directory):
+    cert, key = os.path.join(directory, 'cert.pem'), os.path.join(directory, 'key.pem')
+    subprocess.run(
+        [
+            'openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+            '-subj', '/CN=localhost', '-keyout', key, '-out', cert,
+        ],
+        check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    return cert, key
+
+
+async def start_stub(cert, key, port):
+    async def order(_):
+        return web.json_response({'orderId': 1, 'status': 'NEW', 'executedQty': '0'})
+
+    async def root(_):
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post('/api/v3/order', order)
+    app.router.add_get('/', root)
+    server_ctx = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    server_ctx.load_cert_chain(cert, key)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, 'localhost', port, ssl_context=server_ctx).start()
+    return runner
+
+
+async def first_order(client_ctx, origin, warm):
+    session = make_http_session(client_ctx)
+    try:
+        if warm:
+            await warm_origin(session, origin)
+        t1 = time.perf_counter()
+        async with session.post(origin + '/api/v3/order', data={'symbol': 'BTCUSDT'}) as resp:
+            await resp.read()
+        return time.perf_counter() - t1
+    finally:
+        await session.close()
+
+
+async def run(rounds=50, port=18443):
+    with tempfile.TemporaryDirectory() as directory:
+        cert, key = make_cert(directory)
+        runner = await start_stub(cert, key, port)
+        client_ctx = ssl.create_default_context(cafile=cert)
+        origin = 'https://localhost:{}'.format(port)
+        try:
+            print('{:<6} {:>12} {:>12}'.format('mode', 'median ms', 'p90 ms'))
+            for mode in ('cold', 'warm'):
+                costs = sorted([
+                    await first_order(client_ctx, origin, mode == 'warm') for _ in range(rounds)
+                ])
+                print('{:<6} {:>12.3f} {:>12.3f}'.format(
+                    mode, costs[len(costs)//2]*1e3, costs[int(len(costs)*0.9)]*1e3,
+                ))
+        finally:
+            await runner.cleanup()
+
+
+def main():
+    asyncio.get_event_loop().run_until_complete(run())
+
+
+if __name__ == '__main__':
+    main()
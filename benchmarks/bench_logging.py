@@ -0,0 +1,83 @@
+# !/usr/bin/env python
+"""
+usage: python -m benchmarks.bench_logging
+event loop stall of a logging trading loop writing to a slow sink: logging off, sync and async
+"""
+__author__ = 'Rick Zhang'
+__time__ = '2018/10/12'
+
+import asyncio
+import logging
+import time
+
+from arbcharm.json_logger import AsyncLogPipeline, JsonFormatter, get_json_logger
+
+
+class SlowSink:
+    """
+    a stream which takes write_cost seconds per write, like a congested pipe or disk
+    """
+    def __init__(self, write_cost=0.0005):
+        self.write_cost = write_cost
+
+    def write(self, _):
+        time.sleep(self.write_cost)
+
+    def flush(self):
+        pass
+
+
+def make_logger(mode):
+    logger = get_json_logger('bench_logging_{}'.format(mode))
+    logger.propagate = False
+    handler = logging.StreamHandler(SlowSink())
+    handler.setFormatter(JsonFormatter({'logger': logger.name, 'message': '%(message)s'}))
+    if mode == 'off':
+        logger.setLevel(logging.WARNING)
+        logger.addHandler(handler)
+    elif mode == 'sync':
+        logger.setLevel(logging.INFO)
+        logger.addHandler(handler)
+    else:
+        logger.setLevel(logging.INFO)
+        logger.addHandler(AsyncLogPipeline(1000).add_handlers(logger.name, [handler]))
+    return logger
+
+
+async def ticker(ticks, interval=0.001):
+    """
+    how late the loop wakes this task up: the stall other tasks cause
+    """
+    stalls = []
+    for _ in range(ticks):
+        expect = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        stalls.append(time.perf_counter() - expect)
+    return stalls
+
+
+async def trading_loop(logger, ticks, interval=0.001):
+    book = {'binance': [6500.1, 0.5], 'huobipro': [6500.4, 1.2], 'bitfinex': [6499.9, 0.3]}
+    for i in range(ticks):
+        await asyncio.sleep(interval)
+        logger.info(event='arbitrage', tick=i, market_price=book, time_delay={'binance': 0.01})
+
+
+def main():
+    lp = asyncio.get_event_loop()
+    print('{:<6} {:>12} {:>12} {:>12}'.format('mode', 'mean us', 'p99 us', 'max us'))
+    for mode in ('off', 'sync', 'async'):
+        stalls, _ = lp.run_until_complete(asyncio.gather(
+            ticker(2000), trading_loop(make_logger(mode), 2000),
+        ))
+        stalls.sort()
+        print('{:<6} {:>12.1f} {:>12.1f} {:>12.1f}'.format(
+            mode,
+            sum(stalls)/len(stalls)*1e6,
+            stalls[int(len(stalls)*0.99)]*1e6,
+            stalls[-1]*1e6,
+        ))
+
+
+if __name__ == '__main__':
+    main()
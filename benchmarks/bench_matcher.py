@@ -0,0 +1,89 @@
+# !/usr/bin/env python
+"""
+usage: python -m benchmarks.bench_matcher
+check arbcharm.matcher.auto_match against the original implementation and time both
+"""
+__author__ = 'Rick Zhang'
+__time__ = '2018/10/12'
+
+import random
+import time
+
+from arbcharm.matcher import auto_match
+from arbcharm.models import OrderBook
+from benchmarks import legacy
+
+
+class _Exchange:
+    def __init__(self, name):
+        self.name = name
+
+
+def make_books(n_exchange, depth, tick=0.5):
+    books = []
+    for i in range(n_exchange):
+        mid = 6500 + random.uniform(-5, 5)
+        # coarse ticks so that equal prices across exchanges are common
+        asks = [[round((mid+tick*(j+1))/tick)*tick, random.choice((0.5, 1.0, random.random()))]
+                for j in range(depth)]
+        bids = [[round((mid-tick*(j+1))/tick)*tick, random.choice((0.5, 1.0, random.random()))]
+                for j in range(depth)]
+        ob = OrderBook(exchange=_Exchange('exc{}'.format(i)), symbol='BTC/USDT')
+        ob.load(asks=asks, bids=bids)
+        books.append(ob)
+    return books
+
+
+def to_legacy(books):
+    return [
+        legacy.OrderBook(
+            exchange=ob.exchange,
+            symbol=ob.symbol,
+            asks=[legacy.OrderRow(price=p, amount=a, count=1) for p, a in ob.asks.levels()],
+            bids=[legacy.OrderRow(price=p, amount=a, count=1) for p, a in ob.bids.levels()],
+            timestamp=ob.recv_time,
+        )
+        for ob in books
+    ]
+
+
+def trade_tuples(trades):
+    return [(t.bid_exc.name, t.ask_exc.name, t.bid_price, t.ask_price, t.amount) for t in trades]
+
+
+def check_equivalence(rounds=2000):
+    for _ in range(rounds):
+        books = make_books(random.randint(1, 8), random.randint(1, 30))
+        snapshot = [(list(ob.asks.levels()), list(ob.bids.levels())) for ob in books]
+        expect = trade_tuples(legacy.auto_match(to_legacy(books)))
+        assert trade_tuples(auto_match(books)) == expect
+        assert [(list(ob.asks.levels()), list(ob.bids.levels())) for ob in books] == snapshot
+
+
+def main():
+    random.seed(0)
+    check_equivalence()
+    print('{:>9} {:>6} {:>14} {:>14}'.format('exchanges', 'levels', 'legacy us', 'matcher us'))
+    for n_exchange in (3, 5, 10, 20):
+        for depth in (20, 100, 500):
+            books = make_books(n_exchange, depth)
+            loops = max(10, 20000//(n_exchange*depth))
+
+            cost_legacy = 0
+            for _ in range(loops):
+                legacy_books = to_legacy(books)  # legacy mutates its input
+                t1 = time.perf_counter()
+                legacy.auto_match(legacy_books)
+                cost_legacy += time.perf_counter() - t1
+
+            t1 = time.perf_counter()
+            for _ in range(loops):
+                auto_match(books)
+            cost_new = time.perf_counter() - t1
+
+            print('{:>9} {:>6} {:>14.1f} {:>14.1f}'.format(
+                n_exchange, depth, cost_legacy/loops*1e6, cost_new/loops*1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+# !/usr/bin/env python
+"""
+usage: python -m benchmarks.bench_metrics
+cost of one instrumented span, metrics enabled and disabled
+"""
+__author__ = 'Rick Zhang'
+__time__ = '2018/10/12'
+
+import time
+
+from arbcharm.metrics import MetricsRegistry
+
+
+def main(loops=1000000):
+    def bare():
+        for _ in range(loops):
+            pass
+
+    for label, enabled in (('enabled', True), ('disabled', False)):
+        hist = MetricsRegistry(enabled).histogram('bench_seconds', exchange='bench')
+        counter = MetricsRegistry(enabled).counter('bench_total', exchange='bench')
+        t1 = time.perf_counter()
+        for _ in range(loops):
+            t2 = time.perf_counter()
+            hist.record(time.perf_counter()-t2)
+            counter.inc()
+        cost = time.perf_counter() - t1
+        print('{:<10} {:>8.1f} ns/span'.format(label, cost/loops*1e9))
+
+    t1 = time.perf_counter()
+    bare()
+    print('{:<10} {:>8.1f} ns/loop'.format('empty', (time.perf_counter()-t1)/loops*1e9))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+# !/usr/bin/env python
+"""
+usage: python -m benchmarks.bench_models
+memory per instance and construction time of the slot models against the original dict based classes
+"""
+__author__ = 'Rick Zhang'
+__time__ = '2018/10/12'
+
+import time
+import tracemalloc
+
+from arbcharm.models import Order, OrderRow, Trade
+from benchmarks import legacy
+
+
+class _Exchange:
+    name = 'binance'
+
+
+EXC = _Exchange()
+
+CASES = [
+    (
+        'OrderRow',
+        lambda: legacy.OrderRow(price=6500.1, amount=0.5, count=1),
+        lambda: OrderRow(6500.1, 0.5, 1),
+    ),
+    (
+        'Trade',
+        lambda: legacy.Trade(
+            bid_exc=EXC, ask_exc=EXC, bid_price=6501.0, ask_price=6500.1, amount=0.5),
+        lambda: Trade(bid_exc=EXC, ask_exc=EXC, bid_price=6501.0, ask_price=6500.1, amount=0.5),
+    ),
+    (
+        'Order',
+        lambda: legacy.Order(exc=EXC, symbol='BTC/USDT', price=6500.1, amount=0.5, side='buy'),
+        lambda: Order(exc=EXC, symbol='BTC/USDT', price=6500.1, amount=0.5, side='buy'),
+    ),
+]
+
+
+def memory_per_instance(make, n=20000):
+    tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+    keep = [make() for _ in range(n)]
+    end, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del keep
+    return (end - start) / n
+
+
+def construct_ns(make, n=200000):
+    t1 = time.perf_counter()
+    for _ in range(n):
+        make()
+    return (time.perf_counter() - t1) / n * 1e9
+
+
+def main():
+    print('{:<9} {:>12} {:>12} {:>12} {:>12}'.format(
+        'model', 'old bytes', 'new bytes', 'old ns', 'new ns'))
+    for name, make_old, make_new in CASES:
+        print('{:<9} {:>12.0f} {:>12.0f} {:>12.0f} {:>12.0f}'.format(
+            name,
+            memory_per_instance(make_old), memory_per_instance(make_new),
+            construct_ns(make_old), construct_ns(make_new),
+        ))
+
+
+if __name__ == '__main__':
+    main()
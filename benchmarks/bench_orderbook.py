@@ -0,0 +1,153 @@
+# !/usr/bin/env python
+"""
+usage: python -m benchmarks.bench_orderbook
+compare the in-place orderbook engine with the per-message OrderBook/OrderRow rebuild
+"""
+__author__ = 'Rick Zhang'
+__time__ = '2018/10/12'
+
+import random
+import time
+import tracemalloc
+
+from arbcharm.models import OrderBook
+from benchmarks import legacy
+
+
+class _Exchange:
+    name = 'bench'
+
+
+def make_binance_frames(n, depth=20, mid=6500.0):
+    frames = []
+    for _ in range(n):
+        mid += random.uniform(-1, 1)
+        frames.append({
+            'lastUpdateId': 1,
+            'asks': [['%.8f' % (mid+0.01*(i+1)), '%.8f' % random.uniform(0.01, 2), []]
+                     for i in range(depth)],
+            'bids': [['%.8f' % (mid-0.01*(i+1)), '%.8f' % random.uniform(0.01, 2), []]
+                     for i in range(depth)],
+        })
+    return frames
+
+
+def make_bitfinex_frames(n, depth=25, mid=6500.0):
+    snapshot = [[round(mid-0.1*(i+1), 1), 1, random.uniform(0.01, 2)] for i in range(depth)]
+    snapshot += [[round(mid+0.1*(i+1), 1), 1, -random.uniform(0.01, 2)] for i in range(depth)]
+    frames = [[0, snapshot]]
+    for _ in range(n):
+        is_bid = random.random() < 0.5
+        off = 0.1*random.randint(1, depth)
+        price = round(mid-off if is_bid else mid+off, 1)
+        count = random.choice((0, 1, 2))
+        amount = random.uniform(0.01, 2)
+        if count == 0:
+            amount = 1
+        frames.append([0, price, count, amount if is_bid else -amount])
+    return frames
+
+
+def make_trade_prices(n, mid=6500.0):
+    """
+    aggTrade prints around the top, most of them prune nothing
+    """
+    return [mid + random.choice((-1, 1))*random.uniform(0, 0.03) for _ in range(n)]
+
+
+def run(label, func, frames):
+    tracemalloc.start()
+    t1 = time.perf_counter()
+    func(frames)
+    cost = time.perf_counter() - t1
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    t1 = time.perf_counter()
+    func(frames)
+    cost = time.perf_counter() - t1
+    print('{:<28} {:>10.2f} us/msg {:>10.1f} KiB peak'.format(
+        label, cost/len(frames)*1e6, peak/1024))
+
+
+def main():
+    random.seed(0)
+    exc = _Exchange()
+    binance_frames = make_binance_frames(5000)
+    bitfinex_frames = make_bitfinex_frames(50000)
+    trade_prices = make_trade_prices(50000)
+    depth_frame = make_binance_frames(1)[0]
+
+    def binance_legacy(frames):
+        for data in frames:
+            legacy.binance_book(exc, 'BTC/USDT', data, 0)
+
+    def binance_engine(frames):
+        ob = OrderBook(exchange=exc, symbol='BTC/USDT')
+        for data in frames:
+            ob.load(asks=data['asks'], bids=data['bids'], cast=float)
+
+    def bitfinex_legacy(frames):
+        asks, bids = [], []
+        for data in frames:
+            legacy.bitfinex_book(exc, 'BTC/USDT', data, asks, bids, 0)
+        return asks, bids
+
+    def bitfinex_engine(frames):
+        ob = OrderBook(exchange=exc, symbol='BTC/USDT')
+        for data in frames:
+            if len(data) == 2:
+                ob.clear()
+                for p, c, a in data[1]:
+                    if a >= 0:
+                        ob.bids.set_level(p, a, c)
+                    else:
+                        ob.asks.set_level(p, -a, c)
+            else:
+                _, price, count, amount = data
+                side = ob.bids if amount >= 0 else ob.asks
+                if count == 0:
+                    side.remove_level(price)
+                else:
+                    side.set_level(price, abs(amount), count)
+        return ob
+
+    # a depth snapshot every 10 trades, so the book has something to prune
+    def prune_legacy(prices):
+        ob = None
+        for i, price in enumerate(prices):
+            if i % 10 == 0:
+                ob = legacy.binance_book(exc, 'BTC/USDT', depth_frame, 0)
+            ob.remove_bad_price(price)
+        return ob
+
+    def prune_engine(prices):
+        ob = OrderBook(exchange=exc, symbol='BTC/USDT')
+        for i, price in enumerate(prices):
+            if i % 10 == 0:
+                ob.load(asks=depth_frame['asks'], bids=depth_frame['bids'], cast=float)
+            ob.remove_bad_price(price)
+        return ob
+
+    ob_legacy, ob = prune_legacy(trade_prices), prune_engine(trade_prices)
+    assert [(r.price, r.amount) for r in ob_legacy.asks] == list(ob.asks.levels())
+    assert [(r.price, r.amount) for r in ob_legacy.bids] == list(ob.bids.levels())
+
+    # the engine must end with the same book as the legacy code,
+    # except the phantom levels legacy inserts when deleting an unknown price
+    asks, bids = bitfinex_legacy(bitfinex_frames)
+    ob = bitfinex_engine(bitfinex_frames)
+    assert [(r.price, r.amount) for r in asks if r.count] == list(ob.asks.levels())
+    assert [(r.price, r.amount) for r in bids if r.count] == list(ob.bids.levels())
+
+    run('binance snapshot legacy', binance_legacy, binance_frames)
+    run('binance snapshot engine', binance_engine, binance_frames)
+    run('bitfinex delta legacy', bitfinex_legacy, bitfinex_frames)
+    run('bitfinex delta engine', bitfinex_engine, bitfinex_frames)
+    # includes the snapshot of every 10th trade
+    run('trade prune legacy', prune_legacy, trade_prices)
+    run('trade prune engine', prune_engine, trade_prices)
+
+
+if __name__ == '__main__':
+    main()
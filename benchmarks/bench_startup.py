@@ -0,0 +1,60 @@
+# !/usr/bin/env python
+"""
+usage: python -m benchmarks.bench_startup
+startup cost of python -m arbcharm as exchanges are configured, each run in a fresh interpreter:
+importing the charm and adapters, then the first REST use which imports the ccxt classes,
+next to the eager import of ccxt.async_support and aiohttp done before adapters were lazy
+"""
+__author__ = 'Rick Zhang'
+__time__ = '2018/10/12'
+
+import statistics
+import subprocess
+import sys
+
+EXCHANGES = ('binance', 'huobipro', 'bitfinex')
+
+STARTUP = '''
+import asyncio, time
+t1 = time.perf_counter()
+from arbcharm.charm import ArbCharm
+from arbcharm.models import get_exchange
+excs = [get_exchange(name, {{}}) for name in {names!r}]
+t2 = time.perf_counter()
+async def first_use():
+    for e in excs:
+        e.ccxt_exchange
+asyncio.get_event_loop().run_until_complete(first_use())
+t3 = time.perf_counter()
+print(t2-t1, t3-t2)
+'''
+
+EAGER = '''
+import time
+t1 = time.perf_counter()
+import aiohttp
+import ccxt.async_support
+print(time.perf_counter()-t1)
+'''
+
+
+def run(code, rounds):
+    results = []
+    for _ in range(rounds):
+        out = subprocess.run(
+            [sys.executable, '-c', code], check=True, stdout=subprocess.PIPE).stdout
+        results.append([float(v) for v in out.split()])
+    return [statistics.median(col) for col in zip(*results)]
+
+
+def main(rounds=7):
+    eager, = run(EAGER, rounds)
+    print('eager import of ccxt.async_support and aiohttp: {:.1f} ms'.format(eager*1e3))
+    print('{:>9} {:>12} {:>14}'.format('exchanges', 'import ms', 'first use ms'))
+    for n in range(len(EXCHANGES)+1):
+        import_cost, first_use_cost = run(STARTUP.format(names=EXCHANGES[:n]), rounds)
+        print('{:>9} {:>12.1f} {:>14.1f}'.format(n, import_cost*1e3, first_use_cost*1e3))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+# !/usr/bin/env python
+"""
+usage: python -m benchmarks.bench_store [rows]
+loop-side cost of storing a book snapshot, and scan speed of the mapped columns
+against reading the same books back from json log lines
+"""
+__author__ = 'Rick Zhang'
+__time__ = '2018/10/12'
+
+import json
+import shutil
+import sys
+import tempfile
+import time
+
+from arbcharm.models import OrderBook
+from arbcharm.store import StoreReader, TickStore, numpy
+
+
+class _Exchange:
+    name = 'binance'
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    root = tempfile.mkdtemp()
+    try:
+        store = TickStore(root)
+        ob = OrderBook(exchange=_Exchange(), symbol='BTC/USDT')
+        ob.load(asks=[[6500+i, 1.0] for i in range(20)], bids=[[6499-i, 1.0] for i in range(20)])
+
+        t1 = time.perf_counter()
+        for _ in range(rows):
+            store.on_book(ob)
+        append = time.perf_counter() - t1
+        store.flush(wait=True)
+        print('{:<28} {:>10.2f} us/row on the loop'.format('store append', append/rows*1e6))
+
+        lines = [json.dumps({'event': 'book', 'exchange': 'binance', 'time': i,
+                             'bids': list(ob.bids.levels(5)), 'asks': list(ob.asks.levels(5))})
+                 for i in range(min(rows, 100000))]
+        t1 = time.perf_counter()
+        total = 0.0
+        for line in lines:
+            total += json.loads(line)['bids'][0][0]
+        cost = time.perf_counter() - t1
+        print('{:<28} {:>10.0f} rows/s'.format('json log scan', len(lines)/cost))
+
+        t1 = time.perf_counter()
+        count = 0
+        for cols in StoreReader(root).scan('book'):
+            if numpy is not None:
+                total += float(cols['bid_price'][:, 0].sum())
+            else:
+                total += sum(cols['latency'])
+            count += len(cols['time'])
+        cost = time.perf_counter() - t1
+        print('{:<28} {:>10.0f} rows/s ({})'.format(
+            'store scan', count/cost, 'numpy' if numpy is not None else 'memoryview'))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
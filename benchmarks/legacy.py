@@ -0,0 +1,132 @@
+# !/usr/bin/env python
+"""
+the original per-message implementations, kept only as a baseline for the benchmarks
+"""
+__author__ = 'Rick Zhang'
+__time__ = '2018/10/12'
+
+from arbcharm.tools import bisect_right
+
+
+class OrderRow:
+    def __init__(self, *, price: float, amount: float, count: int):
+        self.price = price
+        self.count = count
+        self.amount = amount
+
+
+class OrderBook:
+    def __init__(self, *, exchange, symbol, asks, bids, timestamp):
+        self.exchange = exchange
+        self.symbol = symbol
+        self.asks = asks
+        self.bids = bids
+        self.timestamp = timestamp
+
+    def remove_bad_price(self, price):
+        self.asks = [row for row in self.asks if row.price >= price]
+        self.bids = [row for row in self.bids if row.price <= price]
+
+
+def binance_book(exchange, symbol, data, timestamp):
+    return OrderBook(
+        exchange=exchange,
+        symbol=symbol,
+        asks=[OrderRow(price=float(p), amount=float(a), count=1) for p, a, _ in data['asks']],
+        bids=[OrderRow(price=float(p), amount=float(a), count=1) for p, a, _ in data['bids']],
+        timestamp=timestamp,
+    )
+
+
+def bitfinex_book(exchange, symbol, data, asks, bids, timestamp):
+    if len(data) == 2:
+        _, ows = data
+        asks.clear()
+        bids.clear()
+        for p, c, a in ows:
+            if a >= 0:
+                bids.append(OrderRow(price=p, count=c, amount=a))
+            else:
+                asks.append(OrderRow(price=p, count=c, amount=-a))
+    elif len(data) == 4:
+        _conn_id, price, count, amount = data
+        side_ows = bids if amount >= 0 else asks
+        amount = abs(amount)
+        ow = OrderRow(price=price, count=count, amount=amount)
+        ind = bisect_right(side_ows, ow, key=lambda o: o.price, rv=side_ows is bids)
+        l_ind = ind-1
+        if l_ind >= 0 and side_ows[l_ind].price == ow.price:
+            if count == 0:
+                side_ows.pop(l_ind)
+            else:
+                side_ows[l_ind] = ow
+        else:
+            side_ows.insert(ind, ow)
+    return OrderBook(exchange=exchange, symbol=symbol, bids=bids, asks=asks, timestamp=timestamp)
+
+
+class Trade:
+    def __init__(self, *, bid_exc, ask_exc, bid_price, ask_price, amount):
+        self.bid_exc = bid_exc
+        self.ask_exc = ask_exc
+        self.bid_price = bid_price
+        self.ask_price = ask_price
+        self.amount = amount
+
+
+def auto_match(ob_l):
+    bid_row_l = []
+    for ob in ob_l[::-1]:
+        bid_row_l.extend([[ob.exchange, ow] for ow in ob.bids])
+    bid_row_l = sorted(bid_row_l, key=lambda i: i[1].price)
+
+    ask_row_l = []
+    for ob in ob_l[::-1]:
+        ask_row_l.extend([[ob.exchange, ow] for ow in ob.asks])
+    ask_row_l = sorted(ask_row_l, key=lambda i: i[1].price, reverse=True)
+
+    trade_l = []
+    bid_retain_row = None
+    ask_retain_row = None
+    while bid_row_l and ask_row_l:
+        bid_exc, bid_ow = bid_retain_row if bid_retain_row else bid_row_l.pop()
+        ask_exc, ask_ow = ask_retain_row if ask_retain_row else ask_row_l.pop()
+        if bid_ow.price < ask_ow.price:
+            break
+
+        if bid_ow.amount < ask_ow.amount:
+            amount = bid_ow.amount
+            ask_ow.amount = ask_ow.amount - amount
+            bid_retain_row, ask_retain_row = None, [ask_exc, ask_ow]
+        elif bid_ow.amount == ask_ow.amount:
+            amount = bid_ow.amount
+            bid_retain_row, ask_retain_row = None, None
+        else:
+            amount = ask_ow.amount
+            bid_ow.amount = bid_ow.amount - amount
+            bid_retain_row, ask_retain_row = [bid_exc, bid_ow], None
+
+        trade_l.append(
+            Trade(
+                bid_exc=bid_exc,
+                ask_exc=ask_exc,
+                bid_price=bid_ow.price,
+                ask_price=ask_ow.price,
+                amount=amount,
+            )
+        )
+    return trade_l
+
+
+class Order:
+    def __init__(self, *, exc, symbol, price, amount, side, otype='limit'):
+        self.exc = exc
+        assert side in ('sell', 'buy')
+        self.symbol = symbol
+        self.side = side
+        self.price = price
+        self.amount = amount
+        self.otype = otype
+
+    def to_dict(self):
+        return self.__dict__
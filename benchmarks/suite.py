@@ -0,0 +1,295 @@
+# !/usr/bin/env python
+"""
+offline benchmark suite of the hot path, on synthetic books and optionally a recorded feed.
+usage:
+    python -m benchmarks.suite --output result.json  # run and save
+    python -m benchmarks.suite --baseline result.json [--tolerance 0.25]  # exit 1 on a regression
+    python -m benchmarks.suite --feed feed.rec --only replay  # a recorded feed, see arbcharm.replay
+every case reports ns per operation, the minimum over the repeats is compared to the baseline.
+"""
+__author__ = 'Rick Zhang'
+__time__ = '2018/10/12'
+
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import random
+import sys
+import time
+from typing import Callable, Dict, List, Tuple
+
+from arbcharm.charm import ArbCharm
+from arbcharm.exchange_api.binance import Binance
+from arbcharm.exchange_api.bitfinex import Bitfinex, BookChecksum
+from arbcharm.exchange_api.huobipro import HuoBiPro
+from arbcharm.json_logger import JsonFormatter, JsonLogger, JsonMessage
+from arbcharm.markets import MarketMeta
+from arbcharm.matcher import auto_match
+from arbcharm.models import BaseExchange
+from benchmarks.bench_codec import huobipro_frames
+from benchmarks.bench_depth_stream import simulate as simulate_depth
+from benchmarks.bench_matcher import make_books
+from benchmarks.bench_orderbook import make_binance_frames, make_bitfinex_frames
+
+CASES = []  # (name, setup), setup(args) returns (run, ops): run() does ops operations
+
+
+def case(name):
+    def _register(setup: Callable[..., Tuple[Callable, int]]):
+        CASES.append((name, setup))
+        return setup
+    return _register
+
+
+def _exchange_books(n_exchange, depth):
+    """
+    make_books with real exchanges and fees, as ArbCharm sees them
+    """
+    books = make_books(n_exchange, depth)
+    for ob in books:
+        ob.exchange = BaseExchange(ob.exchange.name, {})
+        ob.exchange.market_d['BTC/USDT'] = MarketMeta(symbol='BTC/USDT', taker_fee=0.001)
+    fee_d = {ob.exchange: 0.001 for ob in books}
+    return books, fee_d
+
+
+@case('auto_match')
+def setup_auto_match(_args):
+    books, fee_d = _exchange_books(5, 20)
+    loops = 2000
+
+    def run():
+        for _ in range(loops):
+            auto_match(books, fee_d)
+    return run, loops
+
+
+@case('find_opportunity_from_trade')
+def setup_find_opportunity(_args):
+    books, fee_d = _exchange_books(5, 20)
+    charm = ArbCharm('BTC/USDT', [ob.exchange for ob in books])
+    trades = auto_match(books, fee_d)
+    loops = 5000
+
+    def run():
+        for _ in range(loops):
+            charm.find_opportunity_from_trade(trades, fee_d)
+    return run, loops
+
+
+def _bitfinex_v2_frames(n):
+    """
+    make_bitfinex_frames as the v2 channel sends them, an update is [chanId, [PRICE, COUNT, AMOUNT]]
+    """
+    return [data if len(data) == 2 else [data[0], data[1:]] for data in make_bitfinex_frames(n)]
+
+
+@case('bitfinex_handle_ws_book')
+def setup_bitfinex_book(_args):
+    exchange = Bitfinex('bitfinex', {})
+    frames = _bitfinex_v2_frames(20000)
+    lp = asyncio.get_event_loop()
+
+    async def apply():
+        for data in frames:
+            await exchange._handle_ws_book(data, 'BTC/USDT')  # pylint: disable=protected-access
+
+    def run():
+        lp.run_until_complete(apply())
+    return run, len(frames)
+
+
+@case('bitfinex_book_checksum')
+def setup_bitfinex_checksum(_args):
+    """
+    verify_book after every update, the books are replayed ahead so only the checksum is timed
+    """
+    exchange = Bitfinex('bitfinex', {})
+    ob = exchange.book_engine('BTC/USDT')
+    lp = asyncio.get_event_loop()
+    books = []
+
+    async def apply():
+        for data in _bitfinex_v2_frames(5000):
+            await exchange._handle_ws_book(data, 'BTC/USDT')  # pylint: disable=protected-access
+            books.append(ob.bids.top(25) + ob.asks.top(25))
+    lp.run_until_complete(apply())
+    checksum = BookChecksum()
+
+    def run():
+        for book in books:
+            checksum.compute(*book)
+    return run, len(books)
+
+
+@case('binance_deal_book_event')
+def setup_binance_book(_args):
+    exchange = Binance('binance', {})
+    frames = make_binance_frames(2000)
+    for i, data in enumerate(frames):
+        data['lastUpdateId'] = i + 1
+    ob = exchange.book_engine('BTC/USDT')
+
+    def run():
+        ob.sequence = None
+        for data in frames:
+            exchange.deal_book_event('BTC/USDT', data)
+    return run, len(frames)
+
+
+@case('binance_deal_diff_event')
+def setup_binance_diff(_args):
+    exchange = Binance('binance', {})
+    snapshot, _partial_l, diff_l = simulate_depth(2000)
+    frames = [json.loads(frame)['data'] for frame in diff_l]
+    ob = exchange.book_engine('BTC/USDT')
+
+    def run():
+        ob.load(asks=snapshot['asks'], bids=snapshot['bids'])
+        ob.sequence = snapshot['nonce']
+        for data in frames:
+            exchange.deal_diff_event('BTC/USDT', data)
+    return run, len(frames)
+
+
+@case('huobipro_decompress_msg')
+def setup_huobipro_decompress(_args):
+    exchange = HuoBiPro('huobipro', {})
+    frames = huobipro_frames(500)
+
+    def run():
+        for frame in frames:
+            exchange.decompress_msg(frame)
+    return run, len(frames)
+
+
+@case('json_logger_format')
+def setup_json_logger(_args):
+    formatter = JsonFormatter(
+        {'logger': '%(name)s', 'asctime': '%(asctime)s', 'message': '%(message)s'})
+    kwargs = {
+        'event': 'found_opportunity',
+        'symbol': 'BTC/USDT',
+        'profit': 1.25,
+        'legs': [{'exchange': 'binance', 'side': 'buy', 'amount': 0.5, 'price': 6500.1}] * 2,
+        'book_age': {'binance': 0.01, 'huobipro': 0.02},
+    }
+    loops = 5000
+
+    def run():
+        for _ in range(loops):
+            record = logging.LogRecord(
+                'bench', logging.INFO, __file__, 0, JsonMessage(dict(kwargs)), None, None)
+            formatter.format(record)
+    return run, loops
+
+
+@case('replay')
+def setup_replay(args):
+    """
+    a recorded feed through the exchange handlers and ArbCharm.evaluate, per frame
+    """
+    if not args.feed:
+        return None
+    from arbcharm.replay import FeedReplayer
+    lp = asyncio.get_event_loop()
+    frame_count = [0]
+
+    def run():
+        frame_count[0] = lp.run_until_complete(FeedReplayer(args.feed).run())['frames']
+    run()
+    return run, frame_count[0]
+
+
+def measure(run, ops, repeat) -> Dict:
+    run()  # warm up caches and lazy imports
+    costs = []
+    for _ in range(repeat):
+        t1 = time.perf_counter()
+        run()
+        costs.append((time.perf_counter()-t1) / ops * 1e9)
+    costs.sort()
+    return {
+        'ns_per_op': costs[0],
+        'median_ns_per_op': costs[len(costs)//2],
+        'ops': ops,
+        'repeat': repeat,
+    }
+
+
+def run_suite(args) -> Dict:
+    results = {}
+    for name, setup in CASES:
+        if args.only and name not in args.only:
+            continue
+        random.seed(0)
+        prepared = setup(args)
+        if prepared is None:
+            continue
+        run, ops = prepared
+        results[name] = measure(run, ops, args.repeat)
+        print('{:<30} {:>12.0f} ns/op {:>12.0f} median'.format(
+            name, results[name]['ns_per_op'], results[name]['median_ns_per_op']))
+    return {
+        'meta': {
+            'time': time.time(),
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'machine': platform.machine(),
+        },
+        'results': results,
+    }
+
+
+def compare(result: Dict, baseline: Dict, tolerance) -> List[str]:
+    """
+    :return: the regressed cases, slower than the baseline by more than tolerance
+    """
+    regressions = []
+    print('{:<30} {:>12} {:>12} {:>8}'.format('case', 'baseline ns', 'current ns', 'ratio'))
+    for name, base in sorted(baseline['results'].items()):
+        cur = result['results'].get(name)
+        if cur is None:
+            continue
+        ratio = cur['ns_per_op'] / base['ns_per_op']
+        flag = ''
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print('{:<30} {:>12.0f} {:>12.0f} {:>8.2f}{}'.format(
+            name, base['ns_per_op'], cur['ns_per_op'], ratio, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='arbcharm hot path benchmarks')
+    parser.add_argument('--output', help='write the results as json')
+    parser.add_argument('--baseline', help='json results of an earlier run to compare with')
+    parser.add_argument(
+        '--tolerance', type=float, default=0.25, help='allowed slowdown, 0.25 is 25%%')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--feed', help='recorded feed for the replay case')
+    parser.add_argument('--only', nargs='*', help='case names')
+    args = parser.parse_args(argv)
+
+    # handlers would dominate the timings, the json loggers have a manager of their own
+    logging.disable(logging.CRITICAL)
+    JsonLogger.manager.disable = logging.CRITICAL
+    result = run_suite(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(result, baseline, args.tolerance)
+        if regressions:
+            print('performance regression: {}'.format(', '.join(regressions)), file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
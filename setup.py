@@ -43,7 +43,8 @@ setup(
     extras_require={
         'dev': [
         ],
-        'test': ['coverage'],
+        'test': ['coverage', 'pytest'],
+        'research': ['numpy'],  # arbcharm.store reads columns as arrays
     },
     package_data={
         '': ['*.*'],
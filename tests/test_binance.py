@@ -0,0 +1,116 @@
+# !/usr/bin/env python
+"""
+binance diff depth: U/u sequencing of the diff events on a REST snapshot
+"""
+__author__ = 'Rick Zhang'
+__time__ = '2018/10/12'
+
+import asyncio
+
+import pytest
+
+from arbcharm import settings
+from arbcharm.exchange_api.binance import Binance
+
+
+class FakeCcxt:
+    def __init__(self, nonce):
+        self.nonce = nonce
+        self.calls = 0
+
+    async def fetch_order_book(self, _symbol, _limit):
+        self.calls += 1
+        await asyncio.sleep(0)
+        return snapshot(self.nonce)
+
+
+def snapshot(nonce):
+    return {
+        'nonce': nonce,
+        'bids': [[100.0 - i, 1.0] for i in range(5)],
+        'asks': [[101.0 + i, 1.0] for i in range(5)],
+    }
+
+
+def diff(first, last, bids=(), asks=()):
+    return {
+        'e': 'depthUpdate', 'E': 1539683812143, 's': 'BTCUSDT', 'U': first, 'u': last,
+        'b': [list(row) for row in bids], 'a': [list(row) for row in asks],
+    }
+
+
+@pytest.fixture(name='exchange')
+def exchange_fixture(monkeypatch):
+    monkeypatch.setattr(settings, 'BINANCE_DIFF_DEPTH', True)
+    monkeypatch.setattr(settings, 'BINANCE_SNAPSHOT_INTERVAL', 0)
+    exchange = Binance('binance', {})
+    # snapshots are applied by hand unless a test runs the event loop
+    exchange.request_snapshot = lambda symbol: None
+    return exchange
+
+
+def test_events_before_the_snapshot_are_buffered_and_replayed(exchange):
+    exchange.deal_diff_event('BTC/USDT', diff(95, 99, bids=[('99.5', '3')]))
+    exchange.deal_diff_event('BTC/USDT', diff(100, 102, bids=[('100.5', '2')], asks=[('101', '0')]))
+    exchange.deal_diff_event('BTC/USDT', diff(103, 103, asks=[('101.5', '0.5')]))
+    assert exchange.get_book('BTC/USDT') is None
+
+    exchange.apply_snapshot('BTC/USDT', snapshot(100))
+    ob = exchange.get_book('BTC/USDT')
+    # the first event is older than the snapshot, the second one straddles it
+    assert ob.sequence == 103
+    assert ob.bids.top(2) == ([100.5, 100.0], [2.0, 1.0])
+    assert ob.asks.top(2) == ([101.5, 102.0], [0.5, 1.0])
+    assert 'BTC/USDT' not in exchange._diff_buffer_d
+
+
+def test_stale_events_are_dropped(exchange):
+    exchange.apply_snapshot('BTC/USDT', snapshot(100))
+    exchange.deal_diff_event('BTC/USDT', diff(101, 101, bids=[('100', '5')]))
+    exchange.deal_diff_event('BTC/USDT', diff(98, 101, bids=[('100', '7')]))
+    ob = exchange.get_book('BTC/USDT')
+    assert ob.sequence == 101 and ob.bids.top(1) == ([100.0], [5.0])
+
+
+def test_a_gap_loses_the_book_until_the_next_snapshot(exchange):
+    requested = []
+    exchange.request_snapshot = requested.append
+    exchange.apply_snapshot('BTC/USDT', snapshot(100))
+    gaps = exchange.gap_counter.value
+    exchange.deal_diff_event('BTC/USDT', diff(103, 104, bids=[('90', '1')]))
+    assert exchange.get_book('BTC/USDT') is None
+    assert exchange.gap_counter.value == gaps + 1
+    assert requested == ['BTC/USDT']
+
+    exchange.deal_diff_event('BTC/USDT', diff(105, 111, bids=[('100.2', '1')]))
+    exchange.apply_snapshot('BTC/USDT', snapshot(110))
+    ob = exchange.get_book('BTC/USDT')
+    assert ob.sequence == 111 and ob.bids.top(2) == ([100.2, 100.0], [1.0, 1.0])
+    assert 90.0 not in ob.bids.top(10)[0]
+
+
+def test_book_is_kept_to_the_snapshot_depth(exchange, monkeypatch):
+    monkeypatch.setattr(settings, 'BINANCE_BOOK_DEPTH', 6)
+    exchange.apply_snapshot('BTC/USDT', snapshot(100))
+    exchange.deal_diff_event(
+        'BTC/USDT', diff(101, 101, bids=[('50', '1'), ('51', '1'), ('99.9', '1')]))
+    ob = exchange.get_book('BTC/USDT')
+    assert ob.bids.top(10)[0] == [100.0, 99.9, 99.0, 98.0, 97.0, 96.0]
+
+
+def test_warm_start_fetches_one_snapshot(monkeypatch):
+    monkeypatch.setattr(settings, 'BINANCE_DIFF_DEPTH', True)
+    monkeypatch.setattr(settings, 'BINANCE_SNAPSHOT_INTERVAL', 0)
+    exchange = Binance('binance', {})
+    exchange._ccxt_exchange = FakeCcxt(100)
+
+    async def run():
+        await exchange.warm_start('BTC/USDT')
+        # events arriving while it loads wait in the buffer instead of asking again
+        exchange.deal_diff_event('BTC/USDT', diff(100, 101, bids=[('100.5', '2')]))
+        await asyncio.sleep(0.01)
+
+    asyncio.run(run())
+    assert exchange._ccxt_exchange.calls == 1
+    ob = exchange.get_book('BTC/USDT')
+    assert ob.sequence == 101 and ob.bids.price(0) == 100.5
@@ -0,0 +1,260 @@
+# !/usr/bin/env python
+"""
+bitfinex websocket demultiplexing on a connection shared by several symbols, book checksums
+and raw R0 books
+"""
+__author__ = 'Rick Zhang'
+__time__ = '2018/10/12'
+
+import asyncio
+import functools
+import json
+import random
+import zlib
+
+import pytest
+
+from arbcharm import settings, tools
+from arbcharm.exchange_api.bitfinex import Bitfinex, BookChecksum, RawBook, js_number
+from arbcharm.exchange_api.connection import WsConnection
+from arbcharm.models import OrderBook
+
+
+class FakeWs:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, msg):
+        self.sent.append(json.loads(msg))
+
+
+def connect(exchange, *symbols):
+    conn = WsConnection(exchange, 'bitfinex#0')
+    conn.ws = FakeWs()
+    for symbol in symbols:
+        conn.attach(symbol)
+    return conn
+
+
+async def subscribed(exchange, conn, channel, chan_id, pair):
+    await exchange.handle_frame(conn, json.dumps({
+        'event': 'subscribed', 'channel': channel, 'chanId': chan_id,
+        'symbol': 't' + pair, 'pair': pair,
+    }))
+
+
+async def push(exchange, conn, data):
+    await exchange.handle_frame(conn, json.dumps(data))
+
+
+def test_channel_error_keeps_the_connection(monkeypatch):
+    monkeypatch.setattr(settings, 'BITFINEX_RESUBSCRIBE_DELAY', 0)
+
+    async def run():
+        exchange = Bitfinex('bitfinex', {})
+        conn = connect(exchange, 'BTC/USDT', 'ETH/USDT')
+        await subscribed(exchange, conn, 'book', 1, 'BTCUSD')
+        await subscribed(exchange, conn, 'trades', 2, 'BTCUSD')
+        await exchange.handle_frame(conn, json.dumps([1, [[6500, 1, 0.5], [6501, 1, -0.5]]]))
+
+        error = {
+            'event': 'error', 'msg': 'subscribe: error', 'code': 10300,
+            'channel': 'book', 'symbol': 'tETHUSD', 'pair': 'ETHUSD',
+        }
+        assert await exchange.handle_frame(conn, json.dumps(error)) is True
+        assert exchange.get_book('BTC/USDT') is not None
+        assert exchange.get_book('ETH/USDT') is None
+
+        # the channels of the other symbol keep updating
+        await exchange.handle_frame(conn, json.dumps([1, [6499, 1, 0.2]]))
+        assert exchange.get_book('BTC/USDT').bids.top(2) == ([6500, 6499], [0.5, 0.2])
+
+        # only the refused channel is subscribed again
+        await asyncio.sleep(0.01)
+        assert conn.ws.sent == [exchange.book_subscription('ETH/USDT')]
+
+        # a second error while the resubscribe is pending does not stack another one
+        conn.ws.sent.clear()
+        await exchange.handle_frame(conn, json.dumps(error))
+        await exchange.handle_frame(conn, json.dumps(error))
+        await asyncio.sleep(0.01)
+        assert len(conn.ws.sent) == 1
+
+    asyncio.run(run())
+
+
+def test_permanent_and_harmless_channel_errors():
+    async def run():
+        exchange = Bitfinex('bitfinex', {})
+        conn = connect(exchange, 'BTC/USDT')
+        await subscribed(exchange, conn, 'book', 1, 'BTCUSD')
+        await exchange.handle_frame(conn, json.dumps([1, [[6500, 1, 0.5], [6501, 1, -0.5]]]))
+
+        error = {'event': 'error', 'channel': 'book', 'symbol': 'tBTCUSD', 'pair': 'BTCUSD'}
+        await exchange.handle_frame(conn, json.dumps(dict(error, code=10301)))  # already subscribed
+        assert exchange.get_book('BTC/USDT') is not None
+
+        # unknown pair
+        await exchange.handle_frame(conn, json.dumps(dict(error, channel='trades', code=10001)))
+        await asyncio.sleep(0.01)
+        assert not conn.ws.sent and exchange.get_book('BTC/USDT') is not None
+
+        # a failed unsubscribe of a resyncing book: the book is subscribed again
+        conn.channel_d[1] = ('resync', 'BTC/USDT')
+        await exchange.handle_frame(conn, json.dumps(
+            {'event': 'error', 'code': 10400, 'chanId': 1}
+        ))
+        assert 1 not in conn.channel_d
+        assert conn.ws.sent == [exchange.book_subscription('BTC/USDT')]
+
+    asyncio.run(run())
+
+
+class _Exchange:
+    name = 'bitfinex'
+
+
+def naive_checksum(bids, asks):
+    """
+    the crc32 of the bitfinex docs, recomputed from scratch
+    :param bids: [[price, amount], ...] best first
+    :param asks: [[price, amount], ...] best first, negative amounts
+    :return: signed int32
+    """
+    values = []
+    for i in range(25):
+        for levels in (bids, asks):
+            if i < len(levels):
+                values.extend(js_number(x) for x in levels[i])
+    crc = zlib.crc32(':'.join(values).encode())
+    return crc - (1 << 32) if crc >= 1 << 31 else crc
+
+
+@pytest.mark.parametrize('x, expect', [
+    (6500.0, '6500'),
+    (-0.0, '0'),
+    (123.456, '123.456'),
+    (0.1 + 0.2, '0.30000000000000004'),
+    (12345678.123, '12345678.123'),
+    (0.000001, '0.000001'),
+    (2.5e-6, '0.0000025'),
+    (-0.00005, '-0.00005'),
+    (9.99e-7, '9.99e-7'),
+    (1e-7, '1e-7'),
+    (1.5e-7, '1.5e-7'),
+    (1e21, '1e+21'),
+    (1.5e21, '1.5e+21'),
+])
+def test_js_number(x, expect):
+    # Number.prototype.toString, as the exchange formats the checksum string
+    assert js_number(x) == expect
+
+
+def test_checksum_vectors():
+    # reference values from node
+    bids, asks = [[6500, 0.5], [6499.5, 1e-7], [6499, 2]], [[6501, -0.7], [6502, -0.0000025]]
+    assert naive_checksum(bids, asks) == -678900930
+    checksum = BookChecksum()
+    assert checksum.compute([6500, 6499.5, 6499], [0.5, 1e-7, 2], [6501, 6502], [0.7, 2.5e-6]) \
+        == -678900930
+    assert checksum.compute([11, 12], [0.5, 0.25], [13], [0.7]) == 571917981
+    assert checksum.compute([], [], [], []) == naive_checksum([], [])
+
+
+def test_incremental_checksum_matches_a_full_recompute():
+    rnd = random.Random(7)
+    ob = OrderBook(exchange=_Exchange(), symbol='BTC/USD')
+    checksum = BookChecksum()
+    for _ in range(500):
+        side = rnd.choice((ob.bids, ob.asks))
+        sign = 1 if side is ob.bids else -1
+        price = round(6500 - sign*rnd.randint(1, 40)*0.1, 1)
+        if rnd.random() < 0.3:
+            side.remove_level(price)
+        else:
+            side.set_level(price, round(rnd.uniform(0.00001, 3), rnd.choice((2, 5, 8))), 1)
+        bid_keys, bid_amounts = ob.bids.top(25)
+        ask_keys, ask_amounts = ob.asks.top(25)
+        assert checksum.compute(bid_keys, bid_amounts, ask_keys, ask_amounts) == naive_checksum(
+            list(zip(bid_keys, bid_amounts)), [[p, -a] for p, a in zip(ask_keys, ask_amounts)]
+        )
+
+
+def test_raw_book_sums_the_orders_of_a_level():
+    raw = RawBook(OrderBook(exchange=_Exchange(), symbol='BTC/USD'))
+    raw.load([[1, 100, 0.5], [2, 100, 0.25], [3, 101, -1.0]])
+    assert raw.ob.bids.top(5) == ([100.0], [0.75])
+    assert raw.ob.asks.top(5) == ([101.0], [1.0])
+    raw.update(1, 0, 0)
+    raw.update(4, 99, 1.0)
+    raw.update(2, 98, 0.1)  # the order moved
+    assert raw.ob.bids.top(5) == ([99.0, 98.0], [1.0, 0.1])
+    assert not raw.has_level(100)
+    # the checksum of R0 books runs over order ids
+    assert raw.top(True, 25) == ([4, 2], [1.0, 0.1])
+    raw.update(3, 0, 0)
+    assert not raw.ob.asks
+
+
+def test_checksums_wait_for_the_deletes_of_swept_levels():
+    async def run():
+        exchange = Bitfinex('bitfinex', {})
+        conn = connect(exchange, 'BTC/USDT')
+        await subscribed(exchange, conn, 'book', 5, 'BTCUSD')
+        await subscribed(exchange, conn, 'trades', 6, 'BTCUSD')
+        frame = functools.partial(push, exchange, conn)
+        await frame([5, [[6500, 1, 0.5], [6499, 2, 1.0], [6501, 1, -0.7]]])
+        await frame([5, [6500.5, 1, 0.2]])
+        ob = exchange.get_book('BTC/USDT')
+
+        # a sell trade sweeps two bids before the book deletes them
+        await frame([6, 'te', [1, 1539000000000, -0.1, 6499.5]])
+        assert ob.bids.price(0) == 6499
+        await frame([5, 'cs', 12345])
+        await frame([5, [6500.5, 0, 1]])
+        await frame([5, 'cs', 12345])
+        assert not conn.ws.sent
+        await frame([5, [6500, 0, 1]])
+        await frame([5, 'cs', BookChecksum().compute(*ob.bids.top(25), *ob.asks.top(25))])
+        assert not conn.ws.sent and 'BTC/USDT' not in exchange._pruned_d
+
+        # a swept level the exchange never deletes is verified after the grace
+        await frame([6, 'te', [2, 1539000000000, -0.1, 6498]])
+        t0 = tools.monotonic()
+        tools.set_clock(lambda: t0 + settings.BITFINEX_PRUNE_GRACE + 1)
+        try:
+            await frame([5, 'cs', 12345])
+        finally:
+            tools.set_clock()
+        assert conn.ws.sent == [{'event': 'unsubscribe', 'chanId': 5}]
+        assert exchange.get_book('BTC/USDT') is None
+
+    asyncio.run(run())
+
+
+def test_raw_book_checksums_wait_for_the_last_order_of_a_level():
+    async def run():
+        exchange = Bitfinex('bitfinex', {})
+        exchange.book_prec = 'R0'
+        conn = connect(exchange, 'BTC/USDT')
+        await subscribed(exchange, conn, 'book', 5, 'BTCUSD')
+        await subscribed(exchange, conn, 'trades', 6, 'BTCUSD')
+        frame = functools.partial(push, exchange, conn)
+        await frame([5, [[11, 6500, 0.5], [12, 6500, 0.25], [13, 6501, -0.7]]])
+        await frame([5, [12, 0, 1]])
+        assert exchange.get_book('BTC/USDT').bids.top(5) == ([6500.0], [0.5])
+        await frame([5, 'cs', BookChecksum().compute([11], [0.5], [13], [0.7])])
+        assert not conn.ws.sent
+
+        await frame([5, [14, 6499, 0.3]])
+        await frame([6, 'te', [1, 1539000000000, -0.1, 6498]])
+        assert exchange._pruned_d['BTC/USDT'][0] == {6500, 6499}
+        await frame([5, [11, 0, 1]])
+        await frame([5, [14, 0, 1]])
+        checksum = BookChecksum().compute([], [], [13], [0.7])
+        await frame([5, 'cs', checksum])
+        assert not conn.ws.sent and 'BTC/USDT' not in exchange._pruned_d
+        await frame([5, 'cs', checksum + 1])
+        assert conn.ws.sent == [{'event': 'unsubscribe', 'chanId': 5}]
+
+    asyncio.run(run())
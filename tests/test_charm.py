@@ -0,0 +1,75 @@
+# !/usr/bin/env python
+"""
+rounding the legs of an opportunity to the trading rules of their exchanges
+"""
+__author__ = 'Rick Zhang'
+__time__ = '2018/10/12'
+
+import pytest
+
+from arbcharm.charm import ArbCharm
+from arbcharm.markets import MarketMeta
+from arbcharm.models import BaseExchange, Order
+
+
+def exchange(name, **rules):
+    exc = BaseExchange(name, {})
+    exc.market_d['BTC/USDT'] = MarketMeta(symbol='BTC/USDT', **rules)
+    return exc
+
+
+A = exchange('a', amount_digits=6, price_digits=2, min_amount=0.001)
+B = exchange('b', amount_digits=4, price_digits=1, min_notional=10)
+C = exchange('c', amount_digits=3, price_digits=2, min_amount=0.002)
+
+
+@pytest.fixture(name='charm')
+def charm_fixture():
+    return ArbCharm('BTC/USDT', [A, B, C])
+
+
+def order(exc, side, price, amount):
+    return Order(exc=exc, symbol='BTC/USDT', price=price, amount=amount, side=side)
+
+
+def test_legs_are_floored_to_the_coarsest_step(charm):
+    legs = charm.fix_amounts([
+        order(A, Order.SIDE_BUY, 6500.123, 0.0123456),
+        order(B, Order.SIDE_SELL, 6530.07, 0.0123456),
+    ])
+    # a could take 0.012345, b only 0.0123
+    assert [o.amount for o in legs] == [0.0123, 0.0123]
+
+
+def test_heavy_side_is_cut_back(charm):
+    legs = charm.fix_amounts([
+        order(A, Order.SIDE_BUY, 6500, 0.0051234),
+        order(C, Order.SIDE_BUY, 6501, 0.0043),
+        order(B, Order.SIDE_SELL, 6530, 0.0094234),
+    ])
+    amount_d = {o.exc: o.amount for o in legs}
+    # floored to 0.001: 0.005 + 0.004 bought, the sell is cut from 0.009 to match
+    assert amount_d == {A: 0.005, C: 0.004, B: 0.009}
+
+    legs = charm.fix_amounts([
+        order(A, Order.SIDE_SELL, 6530, 0.004),
+        order(C, Order.SIDE_SELL, 6530, 0.006),
+        order(B, Order.SIDE_BUY, 6500, 0.007),
+    ])
+    # the largest sell gives up the excess first
+    assert {o.exc: o.amount for o in legs} == {A: 0.004, C: 0.003, B: 0.007}
+
+
+def test_legs_below_the_minimum_are_dropped_not_raised(charm):
+    # 0.0015 is under the minimum of a after flooring to the step of c
+    assert charm.fix_amounts([
+        order(A, Order.SIDE_BUY, 6500, 0.0015), order(C, Order.SIDE_SELL, 6530, 0.0015),
+    ]) == []
+    # under the 10 USDT notional of b
+    assert charm.fix_amounts([
+        order(A, Order.SIDE_BUY, 6500, 0.0015), order(B, Order.SIDE_SELL, 6530, 0.0015),
+    ]) == []
+    # a side rounded away
+    assert charm.fix_amounts([
+        order(A, Order.SIDE_BUY, 6500, 0.01), order(C, Order.SIDE_SELL, 6530, 0.0009),
+    ]) == []
@@ -0,0 +1,108 @@
+# !/usr/bin/env python
+"""
+reconnect policy of the shared websocket connections
+"""
+__author__ = 'Rick Zhang'
+__time__ = '2018/10/12'
+
+import asyncio
+
+import pytest
+
+from arbcharm import settings
+from arbcharm.exchange_api import connection
+from arbcharm.exchange_api.connection import ReconnectPolicy, WsConnection
+from arbcharm.tools import get_logger
+
+
+class _Counter:
+    def inc(self, value=1):
+        pass
+
+    def record(self, value):
+        pass
+
+
+class FakeExchange:
+    def __init__(self):
+        self.logger = get_logger('test')
+        self.frame_counter = _Counter()
+        self.frame_hist = _Counter()
+        self.handled = []
+
+    def ws_url(self):
+        return 'wss://example'
+
+    async def send_subscribe(self, conn, symbol):
+        pass
+
+    async def warm_start(self, symbol):
+        pass
+
+    def record_frame(self, source, frame):
+        pass
+
+    async def handle_frame(self, _conn, frame):
+        self.handled.append(frame)
+        return True
+
+    async def keepalive(self, conn):
+        pass
+
+
+class FakeWs:
+    """
+    delivers frames, then drops
+    """
+    def __init__(self, frames):
+        self.frames = list(frames)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def recv(self):
+        if not self.frames:
+            raise ConnectionError('dropped')
+        return self.frames.pop(0)
+
+
+def run_once(monkeypatch, frames):
+    exchange = FakeExchange()
+    conn = WsConnection(exchange, 'test#0')
+    conn.symbols.add('BTC/USDT')
+    monkeypatch.setattr(connection.websockets, 'connect', lambda url: FakeWs(frames), raising=False)
+    conn.policy.failures = 3
+
+    async def run():
+        with pytest.raises(ConnectionError):
+            await conn._run_once()
+    asyncio.run(run())
+    assert exchange.handled == frames
+    return conn
+
+
+def test_short_connection_keeps_backing_off(monkeypatch):
+    monkeypatch.setattr(settings, 'RECONNECT_HEALTHY_TIME', 30)
+    conn = run_once(monkeypatch, ['a', 'b'])
+    assert conn.policy.failures == 3
+    assert conn.ws is None
+
+
+def test_healthy_connection_resets_the_backoff(monkeypatch):
+    monkeypatch.setattr(settings, 'RECONNECT_HEALTHY_TIME', 0)
+    conn = run_once(monkeypatch, ['a'])
+    assert conn.policy.failures == 0
+
+
+def test_breaker_opens_after_consecutive_failures():
+    policy = ReconnectPolicy(base_delay=0.1, max_delay=1, breaker_failures=3, breaker_cooldown=60)
+    assert policy.next_delay() <= 0.1
+    assert policy.next_delay() <= 0.2
+    assert not policy.is_open
+    assert policy.next_delay() == 60 and policy.is_open
+    assert policy.next_delay() == 60  # half open: one more failure opens it again
+    policy.reset()
+    assert not policy.is_open and policy.next_delay() <= 0.1
@@ -0,0 +1,90 @@
+# !/usr/bin/env python
+"""
+fee- and depth-aware sizing of the matches of auto_match
+"""
+__author__ = 'Rick Zhang'
+__time__ = '2018/10/12'
+
+import pytest
+
+from arbcharm.evaluator import size_opportunity
+from arbcharm.matcher import auto_match, crossing_books
+from arbcharm.models import Order, OrderBook
+
+
+class _Exchange:
+    def __init__(self, name):
+        self.name = name
+
+
+A, B, C = _Exchange('a'), _Exchange('b'), _Exchange('c')
+
+
+def book(exchange, asks, bids):
+    ob = OrderBook(exchange=exchange, symbol='BTC/USDT')
+    ob.load(asks=asks, bids=bids)
+    ob.touch()  # as set_book does
+    return ob
+
+
+def test_vwap_over_several_levels():
+    books = [
+        book(A, asks=[[100, 1], [100.5, 1], [104, 5]], bids=[[99, 1]]),
+        book(B, asks=[[103, 1]], bids=[[102, 1.5], [101, 1], [99.5, 1]]),
+    ]
+    opportunity = size_opportunity('BTC/USDT', auto_match(books), {}, 0.0)
+    buy = opportunity.leg_d[(A, Order.SIDE_BUY)]
+    sell = opportunity.leg_d[(B, Order.SIDE_SELL)]
+    assert buy.amount == sell.amount == 2
+    assert buy.vwap == pytest.approx(100.25) and buy.price == 100.5  # limit at the worst level
+    assert sell.vwap == pytest.approx((102*1.5 + 101*0.5)/2) and sell.price == 101
+    assert opportunity.profit == pytest.approx(102*1.5 + 101*0.5 - 100 - 100.5)
+    orders = {(o.exc, o.side): o for o in opportunity.to_orders()}
+    assert orders[(A, Order.SIDE_BUY)].price == 100.5 and orders[(B, Order.SIDE_SELL)].amount == 2
+
+
+def test_fees_stop_the_walk():
+    books = [
+        book(A, asks=[[100, 1], [101, 1]], bids=[]),
+        book(B, asks=[], bids=[[101.5, 2]]),
+    ]
+    fee_d = {A: 0.001, B: 0.001}
+    opportunity = size_opportunity('BTC/USDT', auto_match(books, fee_d), fee_d, 0.0)
+    # 101 bought for 101.101 and sold for 101.3985 still gains, deeper levels would not
+    assert opportunity.leg_d[(A, Order.SIDE_BUY)].amount == 2
+    opportunity = size_opportunity('BTC/USDT', auto_match(books, fee_d), fee_d, 0.003)
+    assert opportunity.leg_d[(A, Order.SIDE_BUY)].amount == 1
+    expect = 101.5*0.999 - 100*1.001
+    assert opportunity.profit == pytest.approx(expect)
+    assert opportunity.cost == pytest.approx(100*1.001)
+    assert opportunity.edge == pytest.approx(expect/(100*1.001))
+    assert not size_opportunity('BTC/USDT', auto_match(books, fee_d), fee_d, 0.02)
+
+
+def test_capacity_caps_the_legs():
+    books = [
+        book(A, asks=[[100, 5]], bids=[]),
+        book(B, asks=[], bids=[[102, 5]]),
+    ]
+    trades = auto_match(books)
+    capacity_d = {A: (0, 250), B: (10, 0)}
+    opportunity = size_opportunity('BTC/USDT', trades, {}, 0.0, capacity_d=capacity_d)
+    assert opportunity.leg_d[(A, Order.SIDE_BUY)].amount == pytest.approx(2.5)
+    opportunity = size_opportunity('BTC/USDT', trades, {}, 0.0, capacity_d={B: (1.5, 0)})
+    assert opportunity.leg_d[(B, Order.SIDE_SELL)].amount == pytest.approx(1.5)
+    opportunity = size_opportunity('BTC/USDT', trades, {}, 0.0, amount_mul=0.1)
+    assert opportunity.leg_d[(B, Order.SIDE_SELL)].amount == pytest.approx(0.5)
+
+
+def test_crossing_books_leaves_out_books_that_can_not_trade():
+    books = [
+        book(A, asks=[[100, 1]], bids=[[99, 1]]),
+        book(B, asks=[[103, 1]], bids=[[101, 1]]),
+        book(C, asks=[[100.8, 1]], bids=[[99.5, 1]]),
+    ]
+    assert crossing_books(books) == books  # c's ask is under b's bid too
+    fee_d = {A: 0.001, B: 0.001, C: 0.002}
+    assert crossing_books(books, fee_d) == books[:2]
+    assert crossing_books(books, fee_d, rate=0.01) == []
+    # one book never crosses itself
+    assert crossing_books([book(A, asks=[[100, 1]], bids=[[101, 1]])]) == []
@@ -0,0 +1,60 @@
+# !/usr/bin/env python
+"""
+order cancellation of the execution engine
+"""
+__author__ = 'Rick Zhang'
+__time__ = '2018/10/12'
+
+import asyncio
+
+from ccxt.base import errors as ccxt_errors
+
+from arbcharm import settings
+from arbcharm.execution import ExecutionEngine, TrackedOrder
+from arbcharm.models import BaseExchange, Order
+
+
+class FakeCcxt:
+    def __init__(self, cancel_error=None, fetch_status='canceled'):
+        self.cancel_error = cancel_error
+        self.fetch_status = fetch_status
+        self.cancel_calls = 0
+
+    async def cancel_order(self, _oid, **_kw):
+        self.cancel_calls += 1
+        if self.cancel_error is not None:
+            raise self.cancel_error
+
+    async def fetch_order(self, oid, symbol=None):
+        return {'id': oid, 'symbol': symbol, 'status': self.fetch_status, 'filled': 0.1}
+
+
+def placed_order(ccxt_exchange):
+    exchange = BaseExchange('test', {})
+    exchange._ccxt_exchange = ccxt_exchange
+    reconcile_l = []
+    exchange.inventory.request_reconcile = lambda: reconcile_l.append(True)
+    t = TrackedOrder(Order(exc=exchange, symbol='BTC/USDT', price=6500.0, amount=0.5, side='buy'))
+    t.oid = '1'
+    exchange.watch_order(t)
+    return t, reconcile_l
+
+
+def test_cancel_gives_up_after_retries(monkeypatch):
+    monkeypatch.setattr(settings, 'ORDER_CANCEL_RETRIES', 3)
+    monkeypatch.setattr(settings, 'ORDER_POLL_INTERVAL', 0)
+    ccxt_exchange = FakeCcxt(cancel_error=ccxt_errors.NetworkError('timeout'))
+    t, reconcile_l = placed_order(ccxt_exchange)
+    asyncio.run(ExecutionEngine('BTC/USDT').cancel(t))
+    assert ccxt_exchange.cancel_calls == 3
+    assert t.status == TrackedOrder.STATUS_UNKNOWN and t.is_done
+    assert reconcile_l
+
+
+def test_cancel_takes_the_final_fills():
+    ccxt_exchange = FakeCcxt()
+    t, reconcile_l = placed_order(ccxt_exchange)
+    asyncio.run(ExecutionEngine('BTC/USDT').cancel(t))
+    assert ccxt_exchange.cancel_calls == 1
+    assert t.status == TrackedOrder.STATUS_CANCELED and t.filled == 0.1
+    assert not reconcile_l
@@ -0,0 +1,44 @@
+# !/usr/bin/env python
+"""
+trading rules of one market
+"""
+__author__ = 'Rick Zhang'
+__time__ = '2018/10/12'
+
+from arbcharm.markets import MarketMeta
+
+
+def test_from_ccxt():
+    meta = MarketMeta.from_ccxt({
+        'symbol': 'BTC/USDT',
+        'precision': {'amount': 4, 'price': 1},
+        'limits': {'amount': {'min': 0.001}, 'cost': {'min': None}},
+        'taker': 0.002,
+    })
+    assert meta.amount_step == 0.0001 and meta.price_step == 0.1
+    assert meta.min_amount == 0.001 and meta.min_notional == 0.0
+    assert meta.maker_fee == 0.0 and meta.taker_fee == 0.002
+
+
+def test_floor_amount():
+    meta = MarketMeta(symbol='BTC/USDT', amount_digits=3)
+    assert meta.floor_amount(0.0129) == 0.012
+    assert meta.floor_amount(0.3) == 0.3  # 0.3/0.001 is 299.99999999999994
+    assert meta.floor_amount(0.0009) == 0
+    assert MarketMeta(symbol='BTC/USDT').floor_amount(0.0123456) == 0.0123456
+
+
+def test_min_order_amount():
+    meta = MarketMeta(symbol='BTC/USDT', min_amount=0.001, min_notional=10)
+    assert meta.min_order_amount(5000) == 0.002
+    assert meta.min_order_amount(20000) == 0.001
+    assert meta.min_order_amount(0) == 0.001
+
+
+def test_fix_price_rounds_away_from_the_book():
+    meta = MarketMeta(symbol='BTC/USDT', price_digits=1)
+    # a buy limit rounded up and a sell limit down still take the level they were priced at
+    assert meta.fix_price(6500.01, 'buy') == 6500.1
+    assert meta.fix_price(6500.09, 'sell') == 6500.0
+    assert meta.fix_price(6500.1, 'buy') == meta.fix_price(6500.1, 'sell') == 6500.1
+    assert MarketMeta(symbol='BTC/USDT').fix_price(6500.123, 'buy') == 6500.123
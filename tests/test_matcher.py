@@ -0,0 +1,160 @@
+# !/usr/bin/env python
+"""
+arbcharm.matcher.auto_match against the original sort-and-pop matcher of benchmarks.legacy
+"""
+__author__ = 'Rick Zhang'
+__time__ = '2018/10/12'
+
+import random
+
+import pytest
+
+from arbcharm.matcher import auto_match
+from arbcharm.models import OrderBook
+from benchmarks import legacy
+
+
+class _Exchange:
+    def __init__(self, name):
+        self.name = name
+
+
+def make_book(name, mid, depth, tick=0.5, empty_side=None):
+    def side(sign):
+        # coarse ticks and round amounts so that equal prices and amounts are common
+        return [
+            [round((mid+sign*tick*(j+1))/tick)*tick, random.choice((0.5, 1.0, random.random()))]
+            for j in range(depth)
+        ]
+    ob = OrderBook(exchange=_Exchange(name), symbol='BTC/USDT')
+    ob.load(
+        asks=[] if empty_side == 'asks' else side(1),
+        bids=[] if empty_side == 'bids' else side(-1),
+    )
+    return ob
+
+
+def make_books(n_exchange, depth):
+    return [
+        make_book(
+            'exc{}'.format(i), 6500 + random.uniform(-5, 5), random.randint(0, depth),
+            empty_side=random.choice((None, None, None, 'asks', 'bids')),
+        )
+        for i in range(n_exchange)
+    ]
+
+
+def to_legacy(books, fee_d=None):
+    """
+    legacy books priced net of the taker fee, the legacy matcher knows no fees.
+    the legacy loop stops once either row list is popped empty, even with a partly filled row
+    left on the other side, so every book gets a level that never crosses at the end of both sides
+    """
+    res = []
+    for ob in books:
+        fee = fee_d.get(ob.exchange, 0.0) if fee_d else 0.0
+        asks = [legacy.OrderRow(price=p*(1+fee), amount=a, count=1) for p, a in ob.asks.levels()]
+        bids = [legacy.OrderRow(price=p*(1-fee), amount=a, count=1) for p, a in ob.bids.levels()]
+        asks.append(legacy.OrderRow(price=float('inf'), amount=1, count=1))
+        bids.append(legacy.OrderRow(price=0.0, amount=1, count=1))
+        res.append(legacy.OrderBook(
+            exchange=ob.exchange, symbol=ob.symbol, asks=asks, bids=bids, timestamp=ob.recv_time,
+        ))
+    return res
+
+
+def net_tuples(trades, fee_d=None):
+    def fee(exc):
+        return fee_d.get(exc, 0.0) if fee_d else 0.0
+    return [
+        (
+            t.bid_exc.name,
+            t.ask_exc.name,
+            t.bid_price*(1-fee(t.bid_exc)) if fee(t.bid_exc) else t.bid_price,
+            t.ask_price*(1+fee(t.ask_exc)) if fee(t.ask_exc) else t.ask_price,
+            t.amount,
+        )
+        for t in trades
+    ]
+
+
+def legacy_tuples(trades):
+    return [(t.bid_exc.name, t.ask_exc.name, t.bid_price, t.ask_price, t.amount) for t in trades]
+
+
+def book_state(books):
+    return [(list(ob.asks.levels()), list(ob.bids.levels()), ob.top) for ob in books]
+
+
+@pytest.fixture(autouse=True)
+def seed():
+    random.seed(0)
+
+
+def test_random_books():
+    for _ in range(500):
+        books = make_books(random.randint(1, 8), 30)
+        expect = legacy_tuples(legacy.auto_match(to_legacy(books)))
+        assert net_tuples(auto_match(books)) == expect
+
+
+def test_ties_between_exchanges():
+    # identical books: every level ties and the exchange listed first trades first
+    for _ in range(100):
+        book = make_book('exc0', 6500, 10)
+        books = [book]
+        for i in range(1, 4):
+            twin = make_book('exc{}'.format(i), 6500, 0)
+            twin.load(asks=list(book.asks.levels()), bids=list(book.bids.levels()))
+            books.append(twin)
+        books.append(make_book('cross', 6490, 10))
+        expect = legacy_tuples(legacy.auto_match(to_legacy(books)))
+        assert expect
+        assert net_tuples(auto_match(books)) == expect
+
+
+def test_empty_sides():
+    assert auto_match([]) == []
+    books = [make_book('a', 6500, 5, empty_side='asks'), make_book('b', 6400, 5, empty_side='asks')]
+    assert auto_match(books) == []
+    books = [make_book('a', 6500, 5, empty_side='bids'), make_book('b', 6400, 0)]
+    assert auto_match(books) == []
+    books = [make_book('a', 6500, 5, empty_side='bids'), make_book('b', 6510, 5, empty_side='asks')]
+    assert net_tuples(auto_match(books)) == legacy_tuples(legacy.auto_match(to_legacy(books)))
+
+
+def test_fee_adjusted_prices():
+    for _ in range(500):
+        books = make_books(random.randint(2, 6), 30)
+        fee_d = {ob.exchange: random.choice((0.0, 0.001, 0.002, random.uniform(0, 0.003)))
+                 for ob in books}
+        trades = auto_match(books, fee_d)
+        expect = legacy_tuples(legacy.auto_match(to_legacy(books, fee_d)))
+        assert net_tuples(trades, fee_d) == expect
+        # raw book prices are reported, not the net ones
+        raw_prices = {ob.exchange: {p for p, _ in ob.bids.levels()} for ob in books}
+        for ob in books:
+            raw_prices[ob.exchange].update(p for p, _ in ob.asks.levels())
+        assert all(t.bid_price in raw_prices[t.bid_exc] for t in trades)
+        assert all(t.ask_price in raw_prices[t.ask_exc] for t in trades)
+
+
+def test_fee_removes_thin_edge():
+    a = OrderBook(exchange=_Exchange('a'), symbol='BTC/USDT')
+    a.load(asks=[[101, 1]], bids=[[99, 1]])
+    b = OrderBook(exchange=_Exchange('b'), symbol='BTC/USDT')
+    b.load(asks=[[102, 1]], bids=[[101.1, 1]])
+    assert len(auto_match([a, b])) == 1
+    assert auto_match([a, b], {a.exchange: 0.001, b.exchange: 0.001}) == []
+
+
+def test_books_are_not_mutated():
+    for _ in range(200):
+        books = make_books(random.randint(1, 6), 30)
+        fee_d = {ob.exchange: random.choice((0.0, 0.001)) for ob in books}
+        versions = [ob.version for ob in books]
+        state = book_state(books)
+        auto_match(books)
+        auto_match(books, fee_d)
+        assert book_state(books) == state
+        assert [ob.version for ob in books] == versions
@@ -0,0 +1,76 @@
+# !/usr/bin/env python
+"""
+exchange book state: REST warm starts and update notifications
+"""
+__author__ = 'Rick Zhang'
+__time__ = '2018/10/12'
+
+import asyncio
+
+from arbcharm import settings, tools
+from arbcharm.exchange_api.binance import Binance
+from arbcharm.models import BookNotifier
+
+
+class FakeCcxt:
+    def __init__(self):
+        self.calls = 0
+
+    async def fetch_order_book(self, _symbol, _limit):
+        self.calls += 1
+        return {'nonce': None, 'bids': [[100.0, 1.0]], 'asks': [[101.0, 1.0]]}
+
+
+def make_exchange(monkeypatch):
+    monkeypatch.setattr(settings, 'BINANCE_DIFF_DEPTH', False)
+    exchange = Binance('binance', {})
+    exchange._ccxt_exchange = FakeCcxt()
+    return exchange
+
+
+def test_warm_start_is_rate_limited_per_symbol(monkeypatch):
+    monkeypatch.setattr(settings, 'WARM_START_INTERVAL', 30)
+    exchange = make_exchange(monkeypatch)
+
+    async def run():
+        await exchange.warm_start('BTC/USDT')
+        assert exchange._ccxt_exchange.calls == 1
+        assert exchange.get_book('BTC/USDT').bids.top(1) == ([100.0], [1.0])
+        # reconnects of a flapping connection
+        for _ in range(5):
+            exchange.mark_down(['BTC/USDT'])
+            await exchange.warm_start('BTC/USDT')
+        assert exchange._ccxt_exchange.calls == 1
+        await exchange.warm_start('ETH/USDT')
+        assert exchange._ccxt_exchange.calls == 2
+
+    asyncio.run(run())
+
+
+def test_warm_start_keeps_a_fresh_book(monkeypatch):
+    monkeypatch.setattr(settings, 'WARM_START_INTERVAL', 0)
+    exchange = make_exchange(monkeypatch)
+
+    async def run():
+        await exchange.warm_start('BTC/USDT')
+        await exchange.warm_start('BTC/USDT')
+        assert exchange._ccxt_exchange.calls == 1
+        exchange.mark_down(['BTC/USDT'])
+        await exchange.warm_start('BTC/USDT')
+        assert exchange._ccxt_exchange.calls == 2
+
+    asyncio.run(run())
+
+
+def test_notifier_time_is_the_book_clock():
+    # under replay the books are stamped by the simulated clock, so are the updates they signal
+    tools.set_clock(lambda: 1539000000.0)
+    try:
+        notifier = BookNotifier('BTC/USDT')
+        notifier.notify()
+        notifier.notify()
+        assert notifier.pending and notifier.coalesced_count == 1
+        assert notifier.take() == tools.monotonic() == 1539000000.0
+        assert not notifier.pending
+    finally:
+        tools.set_clock()
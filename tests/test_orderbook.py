@@ -0,0 +1,125 @@
+# !/usr/bin/env python
+"""
+book sides pruned by trades: head offsets and compaction
+"""
+__author__ = 'Rick Zhang'
+__time__ = '2018/10/12'
+
+import random
+
+import pytest
+
+from arbcharm.models import BookSide, OrderBook
+
+
+class _Exchange:
+    name = 'test'
+
+
+def side_of(prices, reverse=False):
+    side = BookSide(reverse=reverse)
+    for price in prices:
+        side.set_level(price, price/100)
+    return side
+
+
+def test_pruning_only_moves_the_head():
+    asks = side_of([100, 101, 102, 103, 104])
+    assert asks.better_than(102) == [100, 101]
+    assert asks.remove_better_than(102) == 2
+    assert asks._head == 2 and len(asks._keys) == 5
+    assert len(asks) == 3 and asks.price(0) == 102 and asks[-1].price == 104
+    assert asks.top(5) == ([102, 103, 104], [1.02, 1.03, 1.04])
+    assert list(asks.levels(2)) == [(102, 1.02), (103, 1.03)]
+    assert asks.depth_at(103) == 2
+    assert asks.remove_better_than(102) == 0
+    assert asks.better_than(99) == [] and asks.remove_better_than(99) == 0
+
+    bids = side_of([100, 99, 98], reverse=True)
+    assert bids.better_than(98.5) == [100, 99]
+    assert bids.remove_better_than(98.5) == 2
+    assert bids.top(5) == ([98], [0.98])
+    # everything pruned
+    assert bids.remove_better_than(0) == 1
+    assert not bids and len(bids) == 0 and bids.top(5) == ([], [])
+    with pytest.raises(IndexError):
+        bids.price(-1)
+
+
+def test_new_best_level_reuses_a_pruned_slot():
+    asks = side_of([100, 101, 102, 103])
+    asks.remove_better_than(102)
+    asks.set_level(101.5, 2.0)
+    assert asks._head == 1 and len(asks._keys) == 4
+    assert asks.top(5) == ([101.5, 102, 103], [2.0, 1.02, 1.03])
+    # removing the best level moves the head again
+    assert asks.remove_level(101.5)
+    assert asks._head == 2 and asks.top(1) == ([102], [1.02])
+    assert not asks.remove_level(101.5)
+    # changes behind the head
+    asks.set_level(102.5, 3.0)
+    asks.set_level(103, 0.5)
+    assert asks.remove_level(102)
+    assert asks.top(5) == ([102.5, 103], [3.0, 0.5])
+
+
+def test_dead_prefix_is_compacted():
+    asks = side_of(range(100, 110))
+    asks.remove_better_than(108)
+    assert asks._head == 8
+    # an insert behind the head with more dead than live levels drops the prefix first
+    asks.set_level(108.5, 1.0)
+    assert asks._head == 0 and len(asks._keys) == 3
+    assert asks.top(5) == ([108, 108.5, 109], [1.08, 1.0, 1.09])
+
+    bids = side_of(range(100, 90, -1), reverse=True)
+    bids.remove_better_than(99)
+    bids.set_level(95.5, 1.0)
+    assert bids._head == 1  # fewer dead than live levels: kept
+    bids._compact()
+    assert bids._head == 0 and bids.top(3) == ([99, 98, 97], [0.99, 0.98, 0.97])
+
+
+def test_truncate_and_load_after_pruning():
+    asks = side_of(range(100, 110))
+    asks.remove_better_than(103)
+    asks.truncate(3)
+    assert asks.top(10) == ([103, 104, 105], [1.03, 1.04, 1.05])
+    asks.load([[200, 1], [201, 2]])
+    assert asks._head == 0 and asks.top(5) == ([200, 201], [1, 2])
+
+
+def test_remove_bad_price():
+    ob = OrderBook(exchange=_Exchange(), symbol='BTC/USDT')
+    ob.load(asks=[[101, 1], [102, 1], [103, 1]], bids=[[101.8, 1], [101.5, 1], [99, 1]])
+    # a trade at 101.6: the ask at 101 and the bid at 101.8 were taken, their deletes are late
+    assert ob.remove_bad_price(101.6) == 2
+    assert ob.asks.top(5) == ([102, 103], [1, 1])
+    assert ob.bids.top(5) == ([101.5, 99], [1, 1])
+    assert ob.remove_bad_price(101.6) == 0
+
+
+@pytest.mark.parametrize('reverse', [False, True])
+def test_random_changes_match_a_sorted_dict(reverse):
+    rnd = random.Random(3)
+    side = BookSide(reverse=reverse)
+    expect = {}
+    for _ in range(3000):
+        price = float(rnd.randint(1, 60))
+        op = rnd.random()
+        if op < 0.55:
+            amount = rnd.randint(1, 100)/10
+            side.set_level(price, amount)
+            expect[price] = amount
+        elif op < 0.9:
+            assert side.remove_level(price) == (price in expect)
+            expect.pop(price, None)
+        else:
+            better = [p for p in expect if (p > price if reverse else p < price)]
+            assert sorted(side.better_than(price), reverse=reverse) == side.better_than(price)
+            assert side.remove_better_than(price) == len(better)
+            for p in better:
+                del expect[p]
+        prices = sorted(expect, reverse=reverse)
+        assert side.top(100) == (prices, [expect[p] for p in prices])
+        assert len(side) == len(expect)